@@ -0,0 +1,283 @@
+import array
+import json
+import os
+import platform
+import py_compile
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from MessagePackFormat import (
+    MessagePackFormat, NilFormat, BoolFormat, FixIntFormat, UInt8Format, UInt16Format, UInt32Format, UInt64Format,
+    Int8Format, Int16Format, Int32Format, Int64Format, Float32Format, Float64Format,
+    FixStrFormat, Str8Format, Str16Format, Str32Format, Bin8Format, Bin16Format, Bin32Format,
+    FixArrayFormat, Array16Format, Array32Format, FixMapFormat, Map16Format, Map32Format, ExtFormat,
+    TypedArrayFormat, packb, unpackb,
+)
+
+def best_time(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def int_heavy_array(count):
+    elements = []
+    for i in range(count):
+        if i % 3 == 0:
+            elements.append(FixIntFormat(i % 128))
+        elif i % 3 == 1:
+            elements.append(UInt16Format(i % 0x10000))
+        else:
+            elements.append(Int32Format(-i))
+    return Array32Format(elements)
+
+def str_heavy_array(count):
+    elements = []
+    for i in range(count):
+        if i % 2 == 0:
+            elements.append(FixStrFormat(f"key{i}"))
+        else:
+            elements.append(Str8Format(f"value-{i}-" * 4))
+    return Array32Format(elements)
+
+def float_heavy_array(count):
+    return Array32Format([Float64Format(i * 0.5) for i in range(count)])
+
+# Cumulative `python -X importtime` budget for importing the codec, so worker
+# processes that only need the codec start quickly.
+IMPORT_BUDGET_US = 10000
+
+def import_time_us(module='MessagePackFormat'):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    # Measure a warm import from cached bytecode, not a first-time compile.
+    py_compile.compile(os.path.join(directory, module + '.py'))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=directory, capture_output=True, text=True, check=True,
+    )
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    raise RuntimeError(f"{module} not found in -X importtime output")
+
+def bench_decode(count=30000):
+    results = {}
+    for name, build in (('int', int_heavy_array), ('str', str_heavy_array), ('float', float_heavy_array)):
+        data = memoryview(build(count).to_bytes())
+        elapsed = best_time(lambda: MessagePackFormat.from_buffer(data, 0))
+        results[name] = count / elapsed
+    return results
+
+# Bytes held per element by the decoded value, on the same 30000-element
+# Array32Format and Map32Format payloads as MessagePackExamples.py.
+def bench_memory(count=30000):
+    payloads = {
+        'Array32Format': (Array32Format, Array32Format([FixIntFormat(i % 128) for i in range(count)]).to_bytes()),
+        'Map32Format': (Map32Format, Map32Format(OrderedDict(
+            {FixStrFormat(f"key{i}"): FixIntFormat(i % 128) for i in range(count)})).to_bytes()),
+    }
+    results = {}
+    for name, (cls, data) in payloads.items():
+        tracemalloc.start()
+        value = cls.from_bytes(data)
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del value
+        results[name] = retained / count
+    return results
+
+# Benchmark suite: encode/decode throughput and peak memory for one value of
+# every Format class and for typical message shapes through packb/unpackb.
+# Inputs are fixed, so runs on the same machine are comparable; run_suite()
+# returns a JSON-serializable dict and compare() lists the metrics of a run
+# that fell behind a baseline run by more than a tolerance:
+#
+#     python MessagePackBenchmark.py --json run.json --baseline base.json
+def format_cases():
+    return [
+        ('NilFormat', NilFormat()),
+        ('BoolFormat', BoolFormat(True)),
+        ('FixIntFormat', FixIntFormat(100)),
+        ('UInt8Format', UInt8Format(200)),
+        ('UInt16Format', UInt16Format(60000)),
+        ('UInt32Format', UInt32Format(4000000000)),
+        ('UInt64Format', UInt64Format(2 ** 63)),
+        ('Int8Format', Int8Format(-100)),
+        ('Int16Format', Int16Format(-30000)),
+        ('Int32Format', Int32Format(-2 ** 31)),
+        ('Int64Format', Int64Format(-2 ** 63)),
+        ('Float32Format', Float32Format(1.5)),
+        ('Float64Format', Float64Format(3.141592653589793)),
+        ('FixStrFormat', FixStrFormat("sensor_temperature")),
+        ('Str8Format', Str8Format("status: nominal, all channels within limits " * 4)),
+        ('Str16Format', Str16Format("log line with some detail\n" * 400)),
+        ('Str32Format', Str32Format("x" * 70000)),
+        ('Bin8Format', Bin8Format(bytes(range(200)))),
+        ('Bin16Format', Bin16Format(bytes(10000))),
+        ('Bin32Format', Bin32Format(bytes(100000))),
+        ('FixArrayFormat', FixArrayFormat([FixIntFormat(i) for i in range(10)])),
+        ('Array16Format', Array16Format([Float64Format(i * 0.5) for i in range(1000)])),
+        ('Array32Format', Array32Format([FixIntFormat(i % 128) for i in range(70000)])),
+        ('FixMapFormat', FixMapFormat(OrderedDict(
+            (FixStrFormat(f"k{i}"), FixIntFormat(i)) for i in range(10)))),
+        ('Map16Format', Map16Format(OrderedDict(
+            (FixStrFormat(f"key{i}"), Float64Format(i * 0.25)) for i in range(1000)))),
+        ('Map32Format', Map32Format(OrderedDict(
+            (FixStrFormat(f"key{i}"), FixIntFormat(i % 128)) for i in range(70000)))),
+        ('ExtFormat', ExtFormat(5, bytes(range(16)))),
+        ('TypedArrayFormat', TypedArrayFormat.from_array(array.array('d', range(10000)))),
+    ]
+
+def message_cases():
+    telemetry = {
+        'id': 123456, 'timestamp': 1700000000.125, 'channel': 'adc0', 'status': 'ok',
+        'temperature': 21.5, 'pressure': 1013.25, 'humidity': 40.0, 'voltage': 3.3,
+        'current': -0.125, 'errors': 0, 'retries': 3, 'enabled': True,
+    }
+    deep = {'leaf': [1, 2.5, 'end', None]}
+    for level in range(32):
+        deep = {'level': level, 'child': deep}
+    blobs = {'id': 7, 'frame': bytes(range(256)) * 1024, 'crc': 0xdeadbeef}
+    strings = {f"field_{i:03d}": f"value number {i} " * (1 + i % 5) for i in range(200)}
+    return [
+        ('flat_telemetry_map', telemetry),
+        ('deep_nesting', deep),
+        ('large_bin_blob', blobs),
+        ('string_heavy_map', strings),
+    ]
+
+# Number of calls that takes at least min_time, so fast and slow cases are
+# timed over comparable intervals.
+def _calls_for(func, min_time=0.02):
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        if time.perf_counter() - start >= min_time:
+            return calls
+        calls *= 2
+
+def _throughput(func, size, repeat):
+    calls = _calls_for(func)
+    def run():
+        for _ in range(calls):
+            func()
+    elapsed = best_time(run, repeat) / calls
+    return {'ops_per_s': 1 / elapsed, 'mb_per_s': size / elapsed / 1e6}
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def _measure(encode, decode, size, repeat):
+    encoded = _throughput(encode, size, repeat)
+    decoded = _throughput(decode, size, repeat)
+    return {
+        'encoded_size': size,
+        'encode_ops_per_s': encoded['ops_per_s'], 'encode_mb_per_s': encoded['mb_per_s'],
+        'decode_ops_per_s': decoded['ops_per_s'], 'decode_mb_per_s': decoded['mb_per_s'],
+        'encode_peak_bytes': _peak_memory(encode), 'decode_peak_bytes': _peak_memory(decode),
+    }
+
+def run_suite(repeat=5):
+    formats = {}
+    for name, value in format_cases():
+        data = value.to_bytes()
+        cls = type(value)
+        formats[name] = _measure(value.to_bytes, lambda: cls.from_bytes(data), len(data), repeat)
+    messages = {}
+    for name, obj in message_cases():
+        data = packb(obj)
+        messages[name] = _measure(lambda: packb(obj), lambda: unpackb(data), len(data), repeat)
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'import_time_us': min(import_time_us() for _ in range(repeat)),
+        'formats': formats,
+        'messages': messages,
+    }
+
+# Metrics where higher is better; every other metric is lower-is-better.
+_HIGHER_IS_BETTER = ('encode_ops_per_s', 'encode_mb_per_s', 'decode_ops_per_s', 'decode_mb_per_s')
+
+def compare(baseline, current, tolerance=0.10):
+    regressions = []
+    if current['import_time_us'] > baseline['import_time_us'] * (1 + tolerance):
+        regressions.append(('import_time_us', baseline['import_time_us'], current['import_time_us']))
+    for group in ('formats', 'messages'):
+        for case, metrics in current[group].items():
+            base = baseline.get(group, {}).get(case)
+            if base is None:
+                continue
+            for metric, value in metrics.items():
+                if metric == 'encoded_size' or metric not in base:
+                    continue
+                if metric in _HIGHER_IS_BETTER:
+                    worse = value < base[metric] * (1 - tolerance)
+                else:
+                    worse = value > base[metric] * (1 + tolerance)
+                if worse:
+                    regressions.append((f"{group}.{case}.{metric}", base[metric], value))
+    return regressions
+
+def print_suite(results):
+    print(f"import MessagePackFormat: {results['import_time_us']} us")
+    for group in ('formats', 'messages'):
+        for case, metrics in results[group].items():
+            print(f"{case:20} {metrics['encoded_size']:9d} B  "
+                  f"encode {metrics['encode_ops_per_s']:12,.0f}/s {metrics['encode_mb_per_s']:8.1f} MB/s  "
+                  f"decode {metrics['decode_ops_per_s']:12,.0f}/s {metrics['decode_mb_per_s']:8.1f} MB/s  "
+                  f"peak {metrics['decode_peak_bytes']:10,d} B")
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="MessagePack codec benchmarks")
+    parser.add_argument('--suite', action='store_true', help="run the per-format and message-shape suite")
+    parser.add_argument('--json', metavar='PATH', help="write the suite results as JSON ('-' for stdout)")
+    parser.add_argument('--baseline', metavar='PATH', help="compare the suite results against a JSON run")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed relative slowdown (default 0.10)")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    if args.suite or args.json or args.baseline:
+        results = run_suite(args.repeat)
+        if args.json == '-':
+            json.dump(results, sys.stdout, indent=2)
+            print()
+        else:
+            print_suite(results)
+            if args.json:
+                with open(args.json, 'w') as f:
+                    json.dump(results, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = compare(json.load(f), results, args.tolerance)
+            for metric, before, after in regressions:
+                print(f"regression: {metric}: {before:,.1f} -> {after:,.1f}", file=sys.stderr)
+            if regressions:
+                sys.exit(1)
+        return
+    elapsed = min(import_time_us() for _ in range(args.repeat))
+    print(f"import MessagePackFormat: {elapsed} us (budget {IMPORT_BUDGET_US} us)")
+    for name, ops in bench_decode().items():
+        print(f"decode {name}-heavy array: {ops:,.0f} elements/s")
+    for name, size in bench_memory().items():
+        print(f"decoded {name}: {size:.1f} bytes/element")
+    if elapsed > IMPORT_BUDGET_US:
+        sys.exit("import time budget exceeded")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import array
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+from MessagePackFormat import PathQuery, Timestamp, packb, skip, unpackb
+
+# Sidecar index header: magic, version, byte order of the arrays, capture
+# bytes covered, fingerprint of those bytes, record count, timestamp count,
+# length of the encoded timestamp key path that follows the header.
+_INDEX_HEADER = struct.Struct('<4sBcxxQ16sQQI')
+_INDEX_MAGIC = b'MPCI'
+_INDEX_VERSION = 2
+
+# Bytes hashed at each end of the covered part of the capture.
+_FINGERPRINT_SPAN = 64 * 1024
+
+# Identifies the capture contents an index was built from: a hash of the
+# first and last _FINGERPRINT_SPAN bytes of the covered range, which appending
+# records leaves unchanged. The capture's size and mtime are left out on
+# purpose, since appending changes both. Only the ends are hashed so that
+# opening a large capture stays cheap. An in-place edit that keeps the covered
+# length and both ends is therefore not detected; remove the index after
+# editing a capture that way.
+def _fingerprint(data, covered):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(data[:min(covered, _FINGERPRINT_SPAN)])
+    digest.update(data[max(0, covered - _FINGERPRINT_SPAN):covered])
+    return digest.digest()
+
+_BYTE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+
+# Random access to a capture file of concatenated MessagePack records:
+#
+#     with CaptureReader('frames.cap', timestamp_key='t') as capture:
+#         last = capture[-1]
+#         for record in capture.records_between(t0, t1):
+#             replay(record)
+#
+# The capture is memory-mapped and records are decoded in place from the
+# mapping. The first open walks the file once with skip() (headers only) and
+# writes a sidecar index, by default next to the capture with an '.idx'
+# suffix: the start offset of every record and, when timestamp_key (a map key
+# or a PathQuery path) is given, each record's timestamp read with PathQuery
+# (numbers, or Timestamp values as Unix seconds), stored sorted along with the
+# matching record numbers. Later opens map the index as it is, so record N is
+# one offset lookup and a time range is a binary search, without reading the
+# rest of either file. If the capture has grown since the index was written,
+# only the new records are scanned and the index is rewritten; an index that
+# does not match (other key, other byte order, capture now shorter, or
+# rewritten with other contents) is rebuilt. When the index cannot be written
+# (e.g. a read-only directory), it is kept in memory for this reader only. A
+# truncated or corrupt trailing
+# record, e.g. one still being written, is left out of the index. Views
+# returned by raw() stay valid after close(): the capture is unmapped once
+# the last of them is released.
+class CaptureReader:
+    def __init__(self, path, timestamp_key=None, index_path=None):
+        self.path = path
+        self.index_path = index_path if index_path is not None else path + '.idx'
+        if timestamp_key is None:
+            self._query = None
+            self._key_bytes = b''
+        else:
+            if isinstance(timestamp_key, (str, int)):
+                timestamp_key = [timestamp_key]
+            self._query = PathQuery(timestamp_key)
+            self._key_bytes = packb(list(self._query.path))
+        self._file = open(path, 'rb')
+        if os.fstat(self._file.fileno()).st_size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = memoryview(self._mmap)
+        else:
+            self._mmap = None
+            self._data = memoryview(b'')
+        self._index_mmap = None
+        covered = self._map_index()
+        if covered is None:
+            self._build_index(array.array('Q', [0]), array.array('d'), array.array('Q'))
+        elif covered < len(self._data):
+            self._build_index(array.array('Q', self._offsets), array.array('d', self._times),
+                              array.array('Q', self._order))
+
+    # Maps an existing, matching index and returns the capture bytes it
+    # covers, or None when there is no usable index.
+    def _map_index(self):
+        try:
+            index_file = open(self.index_path, 'rb')
+        except FileNotFoundError:
+            return None
+        with index_file:
+            size = os.fstat(index_file.fileno()).st_size
+            if size < _INDEX_HEADER.size:
+                return None
+            index_mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, byte_order, covered, fingerprint, count, time_count, key_length = \
+            _INDEX_HEADER.unpack_from(index_mmap)
+        start = _INDEX_HEADER.size
+        base = -(-(start + key_length) // 8) * 8
+        if (magic != _INDEX_MAGIC or version != _INDEX_VERSION or byte_order != _BYTE_ORDER
+                or index_mmap[start:start + key_length] != self._key_bytes
+                or covered > len(self._data) or size != base + 8 * (count + 1 + 2 * time_count)
+                or fingerprint != _fingerprint(self._data, covered)):
+            index_mmap.close()
+            return None
+        view = memoryview(index_mmap)
+        end = base + 8 * (count + 1)
+        self._offsets = view[base:end].cast('Q')
+        self._times = view[end:end + 8 * time_count].cast('d')
+        self._order = view[end + 8 * time_count:end + 16 * time_count].cast('Q')
+        self._index_mmap = index_mmap
+        return covered
+
+    # Scans the records after offsets[-1], adds them to the index arrays and
+    # writes the index, or keeps the arrays in memory when it cannot be written.
+    def _build_index(self, offsets, times, order):
+        data = self._data
+        end = len(data)
+        first = len(offsets) - 1
+        offset = offsets[-1]
+        while offset < end:
+            try:
+                offset = skip(data, offset)
+            except ValueError:
+                break
+            offsets.append(offset)
+        if self._query is not None and len(offsets) - 1 > first:
+            stamped = list(zip(times, order))
+            for record in range(first, len(offsets) - 1):
+                try:
+                    value = self._query.extract(data[offsets[record]:offsets[record + 1]], None)
+                except ValueError:
+                    continue
+                if isinstance(value, Timestamp):
+                    value = value.to_unix()
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+                    stamped.append((float(value), record))
+            stamped.sort()
+            times = array.array('d', [stamp for stamp, _ in stamped])
+            order = array.array('Q', [record for _, record in stamped])
+        self._release_index()
+        try:
+            self._write_index(offsets, times, order)
+        except OSError:
+            self._offsets, self._times, self._order = offsets, times, order
+            return
+        self._map_index()
+
+    def _write_index(self, offsets, times, order):
+        temporary = self.index_path + '.tmp'
+        try:
+            with open(temporary, 'wb') as index_file:
+                header = _INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, _BYTE_ORDER, offsets[-1],
+                                            _fingerprint(self._data, offsets[-1]), len(offsets) - 1, len(times),
+                                            len(self._key_bytes))
+                index_file.write(header)
+                index_file.write(self._key_bytes)
+                index_file.write(bytes(-(len(header) + len(self._key_bytes)) % 8))
+                offsets.tofile(index_file)
+                times.tofile(index_file)
+                order.tofile(index_file)
+            os.replace(temporary, self.index_path)
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+
+    def _release_index(self):
+        if self._index_mmap is not None:
+            self._offsets.release()
+            self._times.release()
+            self._order.release()
+            self._index_mmap.close()
+            self._index_mmap = None
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    # Encoded bytes of record n, as a memoryview into the mapped capture.
+    def raw(self, n):
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError("CaptureReader index out of range")
+        return self._data[self._offsets[n]:self._offsets[n + 1]]
+
+    def __getitem__(self, n):
+        return unpackb(self.raw(n))
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    # Record numbers whose timestamp t satisfies start <= t < end, in
+    # timestamp order.
+    def time_range(self, start, end):
+        if self._query is None:
+            raise ValueError("CaptureReader was opened without a timestamp_key")
+        low = bisect.bisect_left(self._times, start)
+        high = bisect.bisect_left(self._times, end, low)
+        return self._order[low:high].tolist()
+
+    def records_between(self, start, end):
+        for n in self.time_range(start, end):
+            yield self[n]
+
+    def close(self):
+        try:
+            self._release_index()
+            self._data.release()
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    pass  # raw() views still exported; unmapped when they are gone
+                self._mmap = None
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
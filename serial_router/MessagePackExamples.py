@@ -0,0 +1,205 @@
+from collections import OrderedDict
+
+from MessagePackFormat import (
+    NilFormat, BoolFormat, FixIntFormat, UInt8Format, UInt16Format, UInt32Format, UInt64Format,
+    Int8Format, Int16Format, Int32Format, Int64Format, Float32Format, Float64Format,
+    FixStrFormat, Str8Format, Str16Format, Str32Format, Bin8Format, Bin16Format, Bin32Format,
+    FixArrayFormat, Array16Format, Array32Format, FixMapFormat, Map16Format, Map32Format, ExtFormat,
+)
+
+
+def main():
+    # Example usage for serialization
+    nil_format = NilFormat()
+    print(nil_format.to_bytes())
+
+    bool_format_true = BoolFormat(True)
+    print(bool_format_true.to_bytes())
+
+    fixint_format = FixIntFormat(127)
+    print(fixint_format.to_bytes())
+
+    uint8_format = UInt8Format(255)
+    print(uint8_format.to_bytes())
+
+    uint16_format = UInt16Format(65535)
+    print(uint16_format.to_bytes())
+
+    uint32_format = UInt32Format(4294967295)
+    print(uint32_format.to_bytes())
+
+    uint64_format = UInt64Format(18446744073709551615)
+    print(uint64_format.to_bytes())
+
+    int8_format = Int8Format(-128)
+    print(int8_format.to_bytes())
+
+    int16_format = Int16Format(-32768)
+    print(int16_format.to_bytes())
+
+    int32_format = Int32Format(-2147483648)
+    print(int32_format.to_bytes())
+
+    int64_format = Int64Format(-9223372036854775808)
+    print(int64_format.to_bytes())
+
+    float32_format = Float32Format(3.14)
+    print(float32_format.to_bytes())
+
+    float64_format = Float64Format(3.14)
+    print(float64_format.to_bytes())
+
+    fixstr_format = FixStrFormat("Hello")
+    print(fixstr_format.to_bytes())
+
+    str8_format = Str8Format("Hello" * 10)
+    print(str8_format.to_bytes())
+
+    str16_format = Str16Format("Hello" * 100)
+    print(str16_format.to_bytes())
+
+    str32_format = Str32Format("Hello" * 1000)
+    print(str32_format.to_bytes())
+
+    bin8_format = Bin8Format(b'\x01\x02\x03')
+    print(bin8_format.to_bytes())
+
+    bin16_format = Bin16Format(b'\x01\x02' * 100)
+    print(bin16_format.to_bytes())
+
+    bin32_format = Bin32Format(b'\x01\x02' * 1000)
+    print(bin32_format.to_bytes())
+
+    fixarray_format = FixArrayFormat([FixIntFormat(1), FixIntFormat(2), FixIntFormat(3)])
+    print(fixarray_format.to_bytes())
+
+    array16_format = Array16Format([FixIntFormat(i) for i in range(20)])
+    print(array16_format.to_bytes())
+
+    array32_format = Array32Format([FixIntFormat(i % 128) for i in range(30000)])
+    print(array32_format.to_bytes())
+
+    fixmap_format = FixMapFormat(OrderedDict({FixStrFormat("key"): FixIntFormat(1)}))
+    print(fixmap_format.to_bytes())
+
+    map16_format = Map16Format(OrderedDict({FixStrFormat(f"key{i}"): FixIntFormat(i) for i in range(20)}))
+    print(map16_format.to_bytes())
+
+    map32_format = Map32Format(OrderedDict({FixStrFormat(f"key{i}"): FixIntFormat(i % 128) for i in range(30000)}))
+    print(map32_format.to_bytes())
+
+    ext_format = ExtFormat(1, b'\x01\x02\x03')
+    print(ext_format.to_bytes())
+
+    # Example usage for deserialization
+    data = bytes([0xc0])
+    nil_format = NilFormat.from_bytes(data)
+    print(type(nil_format))
+
+    data = bytes([0xc3])
+    bool_format = BoolFormat.from_bytes(data)
+    print(type(bool_format), bool_format.value)
+
+    data = bytes([0x7f])
+    fixint_format = FixIntFormat.from_bytes(data)
+    print(type(fixint_format), fixint_format.value)
+
+    data = bytes([0xcc, 0xff])
+    uint8_format = UInt8Format.from_bytes(data)
+    print(type(uint8_format), uint8_format.value)
+
+    data = bytes([0xcd, 0xff, 0xff])
+    uint16_format = UInt16Format.from_bytes(data)
+    print(type(uint16_format), uint16_format.value)
+
+    data = bytes([0xce, 0xff, 0xff, 0xff, 0xff])
+    uint32_format = UInt32Format.from_bytes(data)
+    print(type(uint32_format), uint32_format.value)
+
+    data = bytes([0xcf, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff])
+    uint64_format = UInt64Format.from_bytes(data)
+    print(type(uint64_format), uint64_format.value)
+
+    data = bytes([0xd0, 0x80])
+    int8_format = Int8Format.from_bytes(data)
+    print(type(int8_format), int8_format.value)
+
+    data = bytes([0xd1, 0x80, 0x00])
+    int16_format = Int16Format.from_bytes(data)
+    print(type(int16_format), int16_format.value)
+
+    data = bytes([0xd2, 0x80, 0x00, 0x00, 0x00])
+    int32_format = Int32Format.from_bytes(data)
+    print(type(int32_format), int32_format.value)
+
+    data = bytes([0xd3, 0x80, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+    int64_format = Int64Format.from_bytes(data)
+    print(type(int64_format), int64_format.value)
+
+    data = bytes([0xca, 0x40, 0x49, 0x0f, 0xdb])
+    float32_format = Float32Format.from_bytes(data)
+    print(type(float32_format), float32_format.value)
+
+    data = bytes([0xcb, 0x40, 0x09, 0x21, 0xfb, 0x54, 0x44, 0x2d, 0x18])
+    float64_format = Float64Format.from_bytes(data)
+    print(type(float64_format), float64_format.value)
+
+    data = bytes([0xa5]) + b"Hello"
+    fixstr_format = FixStrFormat.from_bytes(data)
+    print(type(fixstr_format), fixstr_format.value)
+
+    data = bytes([0xd9, 0x1e]) + b"Hello" * 6
+    str8_format = Str8Format.from_bytes(data)
+    print(type(str8_format), str8_format.value)
+
+    data = bytes([0xda, 0x01, 0xf4]) + b"Hello" * 100
+    str16_format = Str16Format.from_bytes(data)
+    print(type(str16_format), str16_format.value)
+
+    data = bytes([0xdb, 0x00, 0x00, 0x0c, 0x80]) + b"Hello" * 1000
+    str32_format = Str32Format.from_bytes(data)
+    print(type(str32_format), str32_format.value)
+
+    data = bytes([0xc4, 0x03, 0x01, 0x02, 0x03])
+    bin8_format = Bin8Format.from_bytes(data)
+    print(type(bin8_format), bin8_format.value)
+
+    data = bytes([0xc5, 0x00, 0x0a]) + b'\x01\x02' * 5
+    bin16_format = Bin16Format.from_bytes(data)
+    print(type(bin16_format), bin16_format.value)
+
+    data = bytes([0xc6, 0x00, 0x00, 0x07, 0xd0]) + b'\x01\x02' * 500
+    bin32_format = Bin32Format.from_bytes(data)
+    print(type(bin32_format), bin32_format.value)
+
+    data = bytes([0x93, 0x01, 0x02, 0x03])
+    fixarray_format = FixArrayFormat.from_bytes(data)
+    print(type(fixarray_format), [el.value for el in fixarray_format.value])
+
+    data = bytes([0xdc, 0x00, 0x14]) + bytes(range(20))
+    array16_format = Array16Format.from_bytes(data)
+    print(type(array16_format), [el.value for el in array16_format.value])
+
+    data = bytes([0xdd, 0x00, 0x00, 0x75, 0x30]) + bytes(i % 128 for i in range(30000))
+    array32_format = Array32Format.from_bytes(data)
+    print(type(array32_format), [el.value for el in array32_format.value])
+
+    data = bytes([0x81, 0xa3, 0x6b, 0x65, 0x79, 0x01])
+    fixmap_format = FixMapFormat.from_bytes(data)
+    print(type(fixmap_format), {k: v.value for k, v in fixmap_format.value.items()})
+
+    data = bytes([0xde, 0x00, 0x14]) + b''.join([bytes([0xa0 | len(f'key{i}')]) + f'key{i}'.encode() + bytes([i]) for i in range(20)])
+    map16_format = Map16Format.from_bytes(data)
+    print(type(map16_format), {k: v.value for k, v in map16_format.value.items()})
+
+    data = bytes([0xdf, 0x00, 0x00, 0x75, 0x30]) + b''.join([bytes([0xa0 | len(f'key{i}')]) + f'key{i}'.encode() + bytes([i % 128]) for i in range(30000)])
+    map32_format = Map32Format.from_bytes(data)
+    print(type(map32_format), {k: v.value for k, v in map32_format.value.items()})
+
+    data = bytes([0xd4, 0x01, 0x02])
+    ext_format = ExtFormat.from_bytes(data)
+    print(type(ext_format), ext_format.type, ext_format.data)
+
+
+if __name__ == '__main__':
+    main()
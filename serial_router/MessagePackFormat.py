@@ -1,102 +1,88 @@
 from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+import array
+import functools
 import struct
+import sys
+
+_UINT8 = struct.Struct('>B')
+_UINT16 = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+_INT8 = struct.Struct('>b')
+_INT16 = struct.Struct('>h')
+_INT32 = struct.Struct('>i')
+_INT64 = struct.Struct('>q')
+_FLOAT32 = struct.Struct('>f')
+_FLOAT64 = struct.Struct('>d')
+_PACK_UINT8 = struct.Struct('>BB')
+_PACK_UINT16 = struct.Struct('>BH')
+_PACK_UINT32 = struct.Struct('>BI')
+_PACK_UINT64 = struct.Struct('>BQ')
+_PACK_INT8 = struct.Struct('>Bb')
+_PACK_INT16 = struct.Struct('>Bh')
+_PACK_INT32 = struct.Struct('>Bi')
+_PACK_INT64 = struct.Struct('>Bq')
+_PACK_FLOAT64 = struct.Struct('>Bd')
 
 class MessagePackFormat:
+    __slots__ = ()
+
     def __init__(self):
         pass
 
     def to_bytes(self):
         raise NotImplementedError("This method should be implemented by subclasses")
 
+    # Writes the encoded value into a Packer. Containers override this so that
+    # nested values go straight into the packer's buffer instead of being
+    # concatenated at every level.
+    def write_to(self, packer):
+        packer.write(self.to_bytes())
+
+    # Exact length of to_bytes(). Strings, binaries, containers and ext
+    # values compute it without encoding anything; fixed-size scalars fall
+    # back to measuring their few encoded bytes.
+    def packed_size(self):
+        return len(self.to_bytes())
+
     @staticmethod
     def from_bytes(data):
         raise NotImplementedError("This method should be implemented by subclasses")
 
+    # Returns (value, number of bytes consumed), counting nested containers,
+    # strings and multi-byte scalars at their full encoded size.
     @staticmethod
     def from_bytes_with_size(data):
-        first_byte = data[0]
-        if first_byte == 0xc0:
-            return NilFormat.from_bytes(data), 1
-        elif first_byte in [0xc2, 0xc3]:
-            return BoolFormat.from_bytes(data), 1
-        elif (first_byte <= 0x7f) or (first_byte >= 0xe0):
-            return FixIntFormat.from_bytes(data), len(FixIntFormat.from_bytes(data).to_bytes())
-        elif first_byte == 0xcc:
-            return UInt8Format.from_bytes(data), 2
-        elif first_byte == 0xcd:
-            return UInt16Format.from_bytes(data), 3
-        elif first_byte == 0xce:
-            return UInt32Format.from_bytes(data), 5
-        elif first_byte == 0xcf:
-            return UInt64Format.from_bytes(data), 9
-        elif first_byte == 0xd0:
-            return Int8Format.from_bytes(data), 2
-        elif first_byte == 0xd1:
-            return Int16Format.from_bytes(data), 3
-        elif first_byte == 0xd2:
-            return Int32Format.from_bytes(data), 5
-        elif first_byte == 0xd3:
-            return Int64Format.from_bytes(data), 9
-        elif first_byte == 0xca:
-            return Float32Format.from_bytes(data), 5
-        elif first_byte == 0xcb:
-            return Float64Format.from_bytes(data), 9
-        elif first_byte >= 0xa0 and first_byte <= 0xbf:
-            return FixStrFormat.from_bytes(data), (first_byte & 0x1f) + 1
-        elif first_byte == 0xd9:
-            length = data[1]
-            return Str8Format.from_bytes(data), length + 2
-        elif first_byte == 0xda:
-            length = int.from_bytes(data[1:3], 'big')
-            return Str16Format.from_bytes(data), length + 3
-        elif first_byte == 0xdb:
-            length = int.from_bytes(data[1:5], 'big')
-            return Str32Format.from_bytes(data), length + 5
-        elif first_byte == 0xc4:
-            length = data[1]
-            return Bin8Format.from_bytes(data), length + 2
-        elif first_byte == 0xc5:
-            length = int.from_bytes(data[1:3], 'big')
-            return Bin16Format.from_bytes(data), length + 3
-        elif first_byte == 0xc6:
-            length = int.from_bytes(data[1:5], 'big')
-            return Bin32Format.from_bytes(data), length + 5
-        elif first_byte >= 0x90 and first_byte <= 0x9f:
-            length = first_byte & 0x0f
-            return FixArrayFormat.from_bytes(data), length + 1
-        elif first_byte == 0xdc:
-            length = int.from_bytes(data[1:3], 'big')
-            return Array16Format.from_bytes(data), length + 3
-        elif first_byte == 0xdd:
-            length = int.from_bytes(data[1:5], 'big')
-            return Array32Format.from_bytes(data), length + 5
-        elif first_byte >= 0x80 and first_byte <= 0x8f:
-            length = first_byte & 0x0f
-            return FixMapFormat.from_bytes(data), length * 2 + 1
-        elif first_byte == 0xde:
-            length = int.from_bytes(data[1:3], 'big')
-            return Map16Format.from_bytes(data), length * 2 + 3
-        elif first_byte == 0xdf:
-            length = int.from_bytes(data[1:5], 'big')
-            return Map32Format.from_bytes(data), length * 2 + 5
-        raise ValueError("Unknown format")
+        return MessagePackFormat.from_buffer(memoryview(data), 0)
+
+    # Decodes the value starting at data[offset] and returns (value, new_offset).
+    # data can be bytes, bytearray or memoryview; payloads are never sliced out
+    # of the buffer except to build the final str/bytes value.
+    @staticmethod
+    def from_buffer(data, offset=0):
+        return _FORMAT_DECODERS[data[offset]](data, offset)
 
 class NilFormat(MessagePackFormat):
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
 
     def to_bytes(self):
         return bytes([0xc0])
 
     @staticmethod
     def from_bytes(data):
-        if data[0] == 0xc0:
-            return NilFormat()
+        return NilFormat.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        if data[offset] == 0xc0:
+            return NilFormat(), offset + 1
         raise ValueError("Invalid NilFormat")
 
 class BoolFormat(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -104,15 +90,20 @@ class BoolFormat(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        if data[0] == 0xc2:
-            return BoolFormat(False)
-        elif data[0] == 0xc3:
-            return BoolFormat(True)
+        return BoolFormat.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        if data[offset] == 0xc2:
+            return BoolFormat(False), offset + 1
+        elif data[offset] == 0xc3:
+            return BoolFormat(True), offset + 1
         raise ValueError("Invalid BoolFormat")
 
 class FixIntFormat(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -125,16 +116,21 @@ class FixIntFormat(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        first_byte = data[0]
+        return FixIntFormat.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        first_byte = data[offset]
         if first_byte <= 0x7f:  # Positive fixint
-            return FixIntFormat(first_byte)
+            return FixIntFormat(first_byte), offset + 1
         elif first_byte >= 0xe0:  # Negative fixint
-            return FixIntFormat(first_byte - 0x100)
+            return FixIntFormat(first_byte - 0x100), offset + 1
         raise ValueError("Invalid FixIntFormat")
 
 class UInt8Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -142,11 +138,16 @@ class UInt8Format(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        return UInt8Format(data[1])
+        return UInt8Format.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        return UInt8Format(data[offset + 1]), offset + 2
 
 class UInt16Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -154,11 +155,16 @@ class UInt16Format(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        return UInt16Format(int.from_bytes(data[1:3], 'big'))
+        return UInt16Format.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        return UInt16Format(_UINT16.unpack_from(data, offset + 1)[0]), offset + 3
 
 class UInt32Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -166,11 +172,16 @@ class UInt32Format(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        return UInt32Format(int.from_bytes(data[1:5], 'big'))
+        return UInt32Format.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        return UInt32Format(_UINT32.unpack_from(data, offset + 1)[0]), offset + 5
 
 class UInt64Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -178,11 +189,16 @@ class UInt64Format(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        return UInt64Format(int.from_bytes(data[1:9], 'big'))
+        return UInt64Format.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        return UInt64Format(_UINT64.unpack_from(data, offset + 1)[0]), offset + 9
 
 class Int8Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -190,11 +206,16 @@ class Int8Format(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        return Int8Format(int.from_bytes(data[1:2], 'big', signed=True))
+        return Int8Format.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        return Int8Format(_INT8.unpack_from(data, offset + 1)[0]), offset + 2
 
 class Int16Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -202,11 +223,16 @@ class Int16Format(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        return Int16Format(int.from_bytes(data[1:3], 'big', signed=True))
+        return Int16Format.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        return Int16Format(_INT16.unpack_from(data, offset + 1)[0]), offset + 3
 
 class Int32Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -214,11 +240,16 @@ class Int32Format(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        return Int32Format(int.from_bytes(data[1:5], 'big', signed=True))
+        return Int32Format.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        return Int32Format(_INT32.unpack_from(data, offset + 1)[0]), offset + 5
 
 class Int64Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -226,11 +257,16 @@ class Int64Format(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        return Int64Format(int.from_bytes(data[1:9], 'big', signed=True))
+        return Int64Format.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        return Int64Format(_INT64.unpack_from(data, offset + 1)[0]), offset + 9
 
 class Float32Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -238,11 +274,16 @@ class Float32Format(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        return Float32Format(struct.unpack('>f', data[1:5])[0])
+        return Float32Format.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        return Float32Format(_FLOAT32.unpack_from(data, offset + 1)[0]), offset + 5
 
 class Float64Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -250,11 +291,23 @@ class Float64Format(MessagePackFormat):
 
     @staticmethod
     def from_bytes(data):
-        return Float64Format(struct.unpack('>d', data[1:9])[0])
+        return Float64Format.from_buffer(data, 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        return Float64Format(_FLOAT64.unpack_from(data, offset + 1)[0]), offset + 9
+
+# UTF-8 length of a str. An ASCII str has one byte per character, so only
+# non-ASCII text is encoded to be measured.
+def _utf8_length(value):
+    if value.isascii():
+        return len(value)
+    return len(value.encode('utf-8'))
 
 class FixStrFormat(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -264,14 +317,23 @@ class FixStrFormat(MessagePackFormat):
             raise ValueError("FixStr length out of range")
         return bytes([0xa0 | length]) + utf8_bytes
 
+    def packed_size(self):
+        return 1 + _utf8_length(self.value)
+
     @staticmethod
     def from_bytes(data):
-        length = data[0] & 0x1f
-        return FixStrFormat(data[1:1+length].decode('utf-8'))
+        return FixStrFormat.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        start = offset + 1
+        end = start + (data[offset] & 0x1f)
+        return FixStrFormat(str(data[start:end], 'utf-8')), end
 
 class Str8Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -281,14 +343,23 @@ class Str8Format(MessagePackFormat):
             raise ValueError("Str8 length out of range")
         return bytes([0xd9, length]) + utf8_bytes
 
+    def packed_size(self):
+        return 2 + _utf8_length(self.value)
+
     @staticmethod
     def from_bytes(data):
-        length = data[1]
-        return Str8Format(data[2:2+length].decode('utf-8'))
+        return Str8Format.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        start = offset + 2
+        end = start + data[offset + 1]
+        return Str8Format(str(data[start:end], 'utf-8')), end
 
 class Str16Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -298,14 +369,23 @@ class Str16Format(MessagePackFormat):
             raise ValueError("Str16 length out of range")
         return bytes([0xda]) + length.to_bytes(2, 'big') + utf8_bytes
 
+    def packed_size(self):
+        return 3 + _utf8_length(self.value)
+
     @staticmethod
     def from_bytes(data):
-        length = int.from_bytes(data[1:3], 'big')
-        return Str16Format(data[3:3+length].decode('utf-8'))
+        return Str16Format.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        start = offset + 3
+        end = start + _UINT16.unpack_from(data, offset + 1)[0]
+        return Str16Format(str(data[start:end], 'utf-8')), end
 
 class Str32Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -315,14 +395,23 @@ class Str32Format(MessagePackFormat):
             raise ValueError("Str32 length out of range")
         return bytes([0xdb]) + length.to_bytes(4, 'big') + utf8_bytes
 
+    def packed_size(self):
+        return 5 + _utf8_length(self.value)
+
     @staticmethod
     def from_bytes(data):
-        length = int.from_bytes(data[1:5], 'big')
-        return Str32Format(data[5:5+length].decode('utf-8'))
+        return Str32Format.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        start = offset + 5
+        end = start + _UINT32.unpack_from(data, offset + 1)[0]
+        return Str32Format(str(data[start:end], 'utf-8')), end
 
 class Bin8Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -331,14 +420,23 @@ class Bin8Format(MessagePackFormat):
             raise ValueError("Bin8 length out of range")
         return bytes([0xc4, length]) + self.value
 
+    def packed_size(self):
+        return 2 + len(self.value)
+
     @staticmethod
     def from_bytes(data):
-        length = data[1]
-        return Bin8Format(data[2:2+length])
+        return Bin8Format.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        start = offset + 2
+        end = start + data[offset + 1]
+        return Bin8Format(bytes(data[start:end])), end
 
 class Bin16Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -347,14 +445,23 @@ class Bin16Format(MessagePackFormat):
             raise ValueError("Bin16 length out of range")
         return bytes([0xc5]) + length.to_bytes(2, 'big') + self.value
 
+    def packed_size(self):
+        return 3 + len(self.value)
+
     @staticmethod
     def from_bytes(data):
-        length = int.from_bytes(data[1:3], 'big')
-        return Bin16Format(data[3:3+length])
+        return Bin16Format.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        start = offset + 3
+        end = start + _UINT16.unpack_from(data, offset + 1)[0]
+        return Bin16Format(bytes(data[start:end])), end
 
 class Bin32Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
@@ -363,388 +470,2008 @@ class Bin32Format(MessagePackFormat):
             raise ValueError("Bin32 length out of range")
         return bytes([0xc6]) + length.to_bytes(4, 'big') + self.value
 
+    def packed_size(self):
+        return 5 + len(self.value)
+
     @staticmethod
     def from_bytes(data):
-        length = int.from_bytes(data[1:5], 'big')
-        return Bin32Format(data[5:5+length])
+        return Bin32Format.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        start = offset + 5
+        end = start + _UINT32.unpack_from(data, offset + 1)[0]
+        return Bin32Format(bytes(data[start:end])), end
 
 class FixArrayFormat(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
+        packer = Packer()
+        self.write_to(packer)
+        return packer.bytes()
+
+    def write_to(self, packer):
         length = len(self.value)
         if length > 15:
             raise ValueError("FixArray length out of range")
-        return bytes([0x90 | length]) + b''.join([item.to_bytes() for item in self.value])
+        packer.write_byte(0x90 | length)
+        for item in self.value:
+            item.write_to(packer)
+
+    def packed_size(self):
+        return 1 + sum(item.packed_size() for item in self.value)
 
     @staticmethod
     def from_bytes(data):
-        length = data[0] & 0x0f
+        return FixArrayFormat.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        length = data[offset] & 0x0f
+        offset += 1
         elements = []
-        offset = 1
+        decoders = _FORMAT_DECODERS
         for _ in range(length):
-            element, size = MessagePackFormat.from_bytes_with_size(data[offset:])
+            element, offset = decoders[data[offset]](data, offset)
             elements.append(element)
-            offset += size
-        return FixArrayFormat(elements)
+        return FixArrayFormat(elements), offset
 
 class Array16Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
+        packer = Packer()
+        self.write_to(packer)
+        return packer.bytes()
+
+    def write_to(self, packer):
         length = len(self.value)
         if length > 0xffff:
             raise ValueError("Array16 length out of range")
-        return bytes([0xdc]) + length.to_bytes(2, 'big') + b''.join([item.to_bytes() for item in self.value])
+        packer.write_struct(_PACK_UINT16, 0xdc, length)
+        for item in self.value:
+            item.write_to(packer)
+
+    def packed_size(self):
+        return 3 + sum(item.packed_size() for item in self.value)
 
     @staticmethod
     def from_bytes(data):
-        length = int.from_bytes(data[1:3], 'big')
-        elements = []
-        offset = 3
-        for _ in range(length):
-            element, size = MessagePackFormat.from_bytes_with_size(data[offset:])
-            elements.append(element)
-            offset += size
-        return Array16Format(elements)
+        return Array16Format.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        length = _UINT16.unpack_from(data, offset + 1)[0]
+        offset += 3
+        elements, offset = _unpack_format_items(data, offset, length)
+        return Array16Format(elements), offset
 
 class Array32Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
+        packer = Packer()
+        self.write_to(packer)
+        return packer.bytes()
+
+    def write_to(self, packer):
         length = len(self.value)
         if length > 0xffffffff:
             raise ValueError("Array32 length out of range")
-        return bytes([0xdd]) + length.to_bytes(4, 'big') + b''.join([item.to_bytes() for item in self.value])
+        packer.write_struct(_PACK_UINT32, 0xdd, length)
+        for item in self.value:
+            item.write_to(packer)
+
+    def packed_size(self):
+        return 5 + sum(item.packed_size() for item in self.value)
 
     @staticmethod
     def from_bytes(data):
-        length = int.from_bytes(data[1:5], 'big')
-        elements = []
-        offset = 5
-        for _ in range(length):
-            element, size = MessagePackFormat.from_bytes_with_size(data[offset:])
-            elements.append(element)
-            offset += size
-        return Array32Format(elements)
+        return Array32Format.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        length = _UINT32.unpack_from(data, offset + 1)[0]
+        offset += 5
+        elements, offset = _unpack_format_items(data, offset, length)
+        return Array32Format(elements), offset
+
+# Map keys come from a small vocabulary, so their encoded bytes are cached in a
+# bounded LRU keyed by (value, Format class), cls None standing for the
+# smallest str format that Packer.pack() picks: a repeated key costs one
+# lookup instead of a utf-8 encode and a to_bytes(). key_cache_info() reports
+# the cache's size and hit rate and set_key_cache_size() replaces it with an
+# empty one of the given size. Only keys of up to _KEY_CACHE_MAX_LENGTH
+# characters are cached: longer keys are rarely a vocabulary and would pin
+# large strings in the cache, so they are encoded inline. On the decode side,
+# str keys are interned with sys.intern so repeated keys share one str object.
+_KEY_CACHE_SIZE = 1024
+_KEY_CACHE_MAX_LENGTH = 32
+_STR_KEY_FORMATS = frozenset((FixStrFormat, Str8Format, Str16Format, Str32Format))
+
+def _encode_key(value, cls=None):
+    if cls is None:
+        return packb(value)
+    return cls(value).to_bytes()
+
+_encoded_key = functools.lru_cache(maxsize=_KEY_CACHE_SIZE)(_encode_key)
+
+def set_key_cache_size(maxsize):
+    global _encoded_key
+    _encoded_key = functools.lru_cache(maxsize=maxsize)(_encode_key)
+
+def key_cache_info():
+    info = _encoded_key.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'size': info.currsize, 'maxsize': info.maxsize, 'hits': info.hits, 'misses': info.misses,
+        'hit_rate': info.hits / lookups if lookups else 0.0,
+    }
+
+def _write_key(packer, key):
+    if type(key) in _STR_KEY_FORMATS and len(key.value) <= _KEY_CACHE_MAX_LENGTH:
+        packer.write(_encoded_key(key.value, type(key)))
+    else:
+        key.write_to(packer)
 
 class FixMapFormat(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
+        packer = Packer()
+        self.write_to(packer)
+        return packer.bytes()
+
+    def write_to(self, packer):
         length = len(self.value)
         if length > 15:
             raise ValueError("FixMap length out of range")
-        return bytes([0x80 | length]) + b''.join([key.to_bytes() + val.to_bytes() for key, val in self.value.items()])
+        packer.write_byte(0x80 | length)
+        for key, val in self.value.items():
+            _write_key(packer, key)
+            val.write_to(packer)
+
+    def packed_size(self):
+        return 1 + sum(key.packed_size() + val.packed_size() for key, val in self.value.items())
 
     @staticmethod
     def from_bytes(data):
-        length = data[0] & 0x0f
+        return FixMapFormat.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        length = data[offset] & 0x0f
+        offset += 1
         map_items = OrderedDict()
-        offset = 1
+        decoders = _FORMAT_DECODERS
         for _ in range(length):
-            key, key_size = MessagePackFormat.from_bytes_with_size(data[offset:])
-            offset += key_size
-            value, value_size = MessagePackFormat.from_bytes_with_size(data[offset:])
-            offset += value_size
-            map_items[key.value] = value
-        return FixMapFormat(map_items)
+            key, offset = decoders[data[offset]](data, offset)
+            value, offset = decoders[data[offset]](data, offset)
+            key = key.value
+            if type(key) is str:
+                key = sys.intern(key)
+            map_items[key] = value
+        return FixMapFormat(map_items), offset
 
 class Map16Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
+        packer = Packer()
+        self.write_to(packer)
+        return packer.bytes()
+
+    def write_to(self, packer):
         length = len(self.value)
         if length > 0xffff:
             raise ValueError("Map16 length out of range")
-        return bytes([0xde]) + length.to_bytes(2, 'big') + b''.join([key.to_bytes() + val.to_bytes() for key, val in self.value.items()])
+        packer.write_struct(_PACK_UINT16, 0xde, length)
+        for key, val in self.value.items():
+            _write_key(packer, key)
+            val.write_to(packer)
+
+    def packed_size(self):
+        return 3 + sum(key.packed_size() + val.packed_size() for key, val in self.value.items())
 
     @staticmethod
     def from_bytes(data):
-        length = int.from_bytes(data[1:3], 'big')
+        return Map16Format.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        length = _UINT16.unpack_from(data, offset + 1)[0]
+        offset += 3
         map_items = OrderedDict()
-        offset = 3
+        decoders = _FORMAT_DECODERS
         for _ in range(length):
-            key, key_size = MessagePackFormat.from_bytes_with_size(data[offset:])
-            offset += key_size
-            value, value_size = MessagePackFormat.from_bytes_with_size(data[offset:])
-            offset += value_size
-            map_items[key.value] = value
-        return Map16Format(map_items)
+            key, offset = decoders[data[offset]](data, offset)
+            value, offset = decoders[data[offset]](data, offset)
+            key = key.value
+            if type(key) is str:
+                key = sys.intern(key)
+            map_items[key] = value
+        return Map16Format(map_items), offset
 
 class Map32Format(MessagePackFormat):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
     def to_bytes(self):
+        packer = Packer()
+        self.write_to(packer)
+        return packer.bytes()
+
+    def write_to(self, packer):
         length = len(self.value)
         if length > 0xffffffff:
             raise ValueError("Map32 length out of range")
-        return bytes([0xdf]) + length.to_bytes(4, 'big') + b''.join([key.to_bytes() + val.to_bytes() for key, val in self.value.items()])
+        packer.write_struct(_PACK_UINT32, 0xdf, length)
+        for key, val in self.value.items():
+            _write_key(packer, key)
+            val.write_to(packer)
+
+    def packed_size(self):
+        return 5 + sum(key.packed_size() + val.packed_size() for key, val in self.value.items())
 
     @staticmethod
     def from_bytes(data):
-        length = int.from_bytes(data[1:5], 'big')
+        return Map32Format.from_buffer(memoryview(data), 0)[0]
+
+    @staticmethod
+    def from_buffer(data, offset):
+        length = _UINT32.unpack_from(data, offset + 1)[0]
+        offset += 5
         map_items = OrderedDict()
-        offset = 5
+        decoders = _FORMAT_DECODERS
         for _ in range(length):
-            key, key_size = MessagePackFormat.from_bytes_with_size(data[offset:])
-            offset += key_size
-            value, value_size = MessagePackFormat.from_bytes_with_size(data[offset:])
-            offset += value_size
-            map_items[key.value] = value
-        return Map32Format(map_items)
+            key, offset = decoders[data[offset]](data, offset)
+            value, offset = decoders[data[offset]](data, offset)
+            key = key.value
+            if type(key) is str:
+                key = sys.intern(key)
+            map_items[key] = value
+        return Map32Format(map_items), offset
+
+# Ext types are signed 8-bit values: negative types are reserved by the
+# MessagePack spec (-1 is the timestamp), 0..127 are application-defined.
+def _ext_header(ext_type, length):
+    if not -0x80 <= ext_type <= 0x7f:
+        raise ValueError("Ext type out of range")
+    ext_type &= 0xff
+    if length == 1:
+        return bytes([0xd4, ext_type])
+    elif length == 2:
+        return bytes([0xd5, ext_type])
+    elif length == 4:
+        return bytes([0xd6, ext_type])
+    elif length == 8:
+        return bytes([0xd7, ext_type])
+    elif length == 16:
+        return bytes([0xd8, ext_type])
+    elif length <= 0xff:
+        return bytes([0xc7, length, ext_type])
+    elif length <= 0xffff:
+        return bytes([0xc8]) + length.to_bytes(2, 'big') + bytes([ext_type])
+    elif length <= 0xffffffff:
+        return bytes([0xc9]) + length.to_bytes(4, 'big') + bytes([ext_type])
+    else:
+        raise ValueError("Extension data length out of range")
+
+def _ext_header_size(length):
+    if length in (1, 2, 4, 8, 16):
+        return 2
+    elif length <= 0xff:
+        return 3
+    elif length <= 0xffff:
+        return 4
+    return 6
+
+# Returns (ext type, payload start, payload end) for the ext value at offset.
+def _ext_bounds(data, offset):
+    first_byte = data[offset]
+    if first_byte == 0xd4:  # fixext 1
+        start, length = offset + 2, 1
+    elif first_byte == 0xd5:  # fixext 2
+        start, length = offset + 2, 2
+    elif first_byte == 0xd6:  # fixext 4
+        start, length = offset + 2, 4
+    elif first_byte == 0xd7:  # fixext 8
+        start, length = offset + 2, 8
+    elif first_byte == 0xd8:  # fixext 16
+        start, length = offset + 2, 16
+    elif first_byte == 0xc7:  # ext 8
+        start, length = offset + 3, data[offset + 1]
+    elif first_byte == 0xc8:  # ext 16
+        start, length = offset + 4, _UINT16.unpack_from(data, offset + 1)[0]
+    elif first_byte == 0xc9:  # ext 32
+        start, length = offset + 6, _UINT32.unpack_from(data, offset + 1)[0]
+    else:
+        raise ValueError("Invalid ExtFormat")
+    ext_type = data[start - 1]
+    if ext_type >= 0x80:
+        ext_type -= 0x100
+    return ext_type, start, start + length
 
 class ExtFormat(MessagePackFormat):
+    __slots__ = ('type', 'data')
+
     def __init__(self, type, data):
-        super().__init__()
         self.type = type
         self.data = data
 
     def to_bytes(self):
+        return _ext_header(self.type, len(self.data)) + self.data
+
+    def write_to(self, packer):
+        packer.write(_ext_header(self.type, len(self.data)))
+        packer.write(self.data)
+
+    def packed_size(self):
         length = len(self.data)
-        if length == 1:
-            return bytes([0xd4, self.type]) + self.data
-        elif length == 2:
-            return bytes([0xd5, self.type]) + self.data
-        elif length == 4:
-            return bytes([0xd6, self.type]) + self.data
-        elif length == 8:
-            return bytes([0xd7, self.type]) + self.data
-        elif length == 16:
-            return bytes([0xd8, self.type]) + self.data
-        elif length <= 0xff:
-            return bytes([0xc7, length, self.type]) + self.data
-        elif length <= 0xffff:
-            return bytes([0xc8]) + length.to_bytes(2, 'big') + bytes([self.type]) + self.data
-        elif length <= 0xffffffff:
-            return bytes([0xc9]) + length.to_bytes(4, 'big') + bytes([self.type]) + self.data
-        else:
-            raise ValueError("Extension data length out of range")
+        return _ext_header_size(length) + length
 
     @staticmethod
     def from_bytes(data):
-        first_byte = data[0]
-        if first_byte == 0xd4:  # fixext 1
-            return ExtFormat(data[1], data[2:3])
-        elif first_byte == 0xd5:  # fixext 2
-            return ExtFormat(data[1], data[2:4])
-        elif first_byte == 0xd6:  # fixext 4
-            return ExtFormat(data[1], data[2:6])
-        elif first_byte == 0xd7:  # fixext 8
-            return ExtFormat(data[1], data[2:10])
-        elif first_byte == 0xd8:  # fixext 16
-            return ExtFormat(data[1], data[2:18])
-        elif first_byte == 0xc7:  # ext 8
-            length = data[1]
-            return ExtFormat(data[2], data[3:3+length])
-        elif first_byte == 0xc8:  # ext 16
-            length = int.from_bytes(data[1:3], 'big')
-            return ExtFormat(data[3], data[4:4+length])
-        elif first_byte == 0xc9:  # ext 32
-            length = int.from_bytes(data[1:5], 'big')
-            return ExtFormat(data[5], data[6:6+length])
-        raise ValueError("Invalid ExtFormat")
-
-
-# Example usage for serialization
-nil_format = NilFormat()
-print(nil_format.to_bytes())
-
-bool_format_true = BoolFormat(True)
-print(bool_format_true.to_bytes())
-
-fixint_format = FixIntFormat(127)
-print(fixint_format.to_bytes())
-
-uint8_format = UInt8Format(255)
-print(uint8_format.to_bytes())
-
-uint16_format = UInt16Format(65535)
-print(uint16_format.to_bytes())
-
-uint32_format = UInt32Format(4294967295)
-print(uint32_format.to_bytes())
-
-uint64_format = UInt64Format(18446744073709551615)
-print(uint64_format.to_bytes())
-
-int8_format = Int8Format(-128)
-print(int8_format.to_bytes())
-
-int16_format = Int16Format(-32768)
-print(int16_format.to_bytes())
-
-int32_format = Int32Format(-2147483648)
-print(int32_format.to_bytes())
-
-int64_format = Int64Format(-9223372036854775808)
-print(int64_format.to_bytes())
-
-float32_format = Float32Format(3.14)
-print(float32_format.to_bytes())
-
-float64_format = Float64Format(3.14)
-print(float64_format.to_bytes())
-
-fixstr_format = FixStrFormat("Hello")
-print(fixstr_format.to_bytes())
-
-str8_format = Str8Format("Hello" * 10)
-print(str8_format.to_bytes())
-
-str16_format = Str16Format("Hello" * 100)
-print(str16_format.to_bytes())
-
-str32_format = Str32Format("Hello" * 1000)
-print(str32_format.to_bytes())
-
-bin8_format = Bin8Format(b'\x01\x02\x03')
-print(bin8_format.to_bytes())
-
-bin16_format = Bin16Format(b'\x01\x02' * 100)
-print(bin16_format.to_bytes())
-
-bin32_format = Bin32Format(b'\x01\x02' * 1000)
-print(bin32_format.to_bytes())
-
-fixarray_format = FixArrayFormat([FixIntFormat(1), FixIntFormat(2), FixIntFormat(3)])
-print(fixarray_format.to_bytes())
-
-array16_format = Array16Format([FixIntFormat(i) for i in range(20)])
-print(array16_format.to_bytes())
-
-array32_format = Array32Format([FixIntFormat(i) for i in range(30000)])
-print(array32_format.to_bytes())
-
-fixmap_format = FixMapFormat(OrderedDict({FixStrFormat("key"): FixIntFormat(1)}))
-print(fixmap_format.to_bytes())
-
-map16_format = Map16Format(OrderedDict({FixStrFormat(f"key{i}"): FixIntFormat(i) for i in range(20)}))
-print(map16_format.to_bytes())
-
-map32_format = Map32Format(OrderedDict({FixStrFormat(f"key{i}"): FixIntFormat(i) for i in range(30000)}))
-print(map32_format.to_bytes())
-
-ext_format = ExtFormat(1, b'\x01\x02\x03')
-print(ext_format.to_bytes())
-
-# Example usage for deserialization
-data = bytes([0xc0])
-nil_format = NilFormat.from_bytes(data)
-print(type(nil_format))
-
-data = bytes([0xc3])
-bool_format = BoolFormat.from_bytes(data)
-print(type(bool_format), bool_format.value)
-
-data = bytes([0x7f])
-fixint_format = FixIntFormat.from_bytes(data)
-print(type(fixint_format), fixint_format.value)
-
-data = bytes([0xcc, 0xff])
-uint8_format = UInt8Format.from_bytes(data)
-print(type(uint8_format), uint8_format.value)
-
-data = bytes([0xcd, 0xff, 0xff])
-uint16_format = UInt16Format.from_bytes(data)
-print(type(uint16_format), uint16_format.value)
-
-data = bytes([0xce, 0xff, 0xff, 0xff, 0xff])
-uint32_format = UInt32Format.from_bytes(data)
-print(type(uint32_format), uint32_format.value)
-
-data = bytes([0xcf, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff])
-uint64_format = UInt64Format.from_bytes(data)
-print(type(uint64_format), uint64_format.value)
-
-data = bytes([0xd0, 0x80])
-int8_format = Int8Format.from_bytes(data)
-print(type(int8_format), int8_format.value)
-
-data = bytes([0xd1, 0x80, 0x00])
-int16_format = Int16Format.from_bytes(data)
-print(type(int16_format), int16_format.value)
-
-data = bytes([0xd2, 0x80, 0x00, 0x00, 0x00])
-int32_format = Int32Format.from_bytes(data)
-print(type(int32_format), int32_format.value)
-
-data = bytes([0xd3, 0x80, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
-int64_format = Int64Format.from_bytes(data)
-print(type(int64_format), int64_format.value)
-
-data = bytes([0xca, 0x40, 0x49, 0x0f, 0xdb])
-float32_format = Float32Format.from_bytes(data)
-print(type(float32_format), float32_format.value)
+        return ExtFormat.from_buffer(memoryview(data), 0)[0]
 
-data = bytes([0xcb, 0x40, 0x09, 0x21, 0xfb, 0x54, 0x44, 0x2d, 0x18])
-float64_format = Float64Format.from_bytes(data)
-print(type(float64_format), float64_format.value)
-
-data = bytes([0xa5]) + b"Hello"
-fixstr_format = FixStrFormat.from_bytes(data)
-print(type(fixstr_format), fixstr_format.value)
+    @staticmethod
+    def from_buffer(data, offset):
+        ext_type, start, end = _ext_bounds(data, offset)
+        return ExtFormat(ext_type, bytes(data[start:end])), end
+
+# Application ext type for TypedArrayFormat.
+TYPED_ARRAY_EXT_TYPE = 0x10
+
+# (numpy dtype kind, item size) -> typecode stored in the typed array payload.
+# The codes are shared by struct, array and numpy.
+_TYPED_ARRAY_CODES = {
+    ('i', 1): 'b', ('u', 1): 'B', ('i', 2): 'h', ('u', 2): 'H',
+    ('i', 4): 'i', ('u', 4): 'I', ('i', 8): 'q', ('u', 8): 'Q',
+    ('f', 4): 'f', ('f', 8): 'd',
+}
+_ARRAY_TYPECODE_KINDS = {
+    'b': 'i', 'h': 'i', 'i': 'i', 'l': 'i', 'q': 'i',
+    'B': 'u', 'H': 'u', 'I': 'u', 'L': 'u', 'Q': 'u',
+    'f': 'f', 'd': 'f',
+}
+_NATIVE_BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+# A homogeneous numeric array carried as one ext value. The payload is the
+# element typecode, the byte order ('<' or '>') and then the raw contiguous
+# elements, so encoding is a single copy of the source buffer and decoding
+# returns views onto the received bytes instead of one object per element.
+# Multi-dimensional arrays are flattened.
+class TypedArrayFormat(ExtFormat):
+    __slots__ = ()
+
+    def __init__(self, data):
+        self.type = TYPED_ARRAY_EXT_TYPE
+        self.data = data
 
-data = bytes([0xd9, 0x1e]) + b"Hello" * 6
-str8_format = Str8Format.from_bytes(data)
-print(type(str8_format), str8_format.value)
+    # Builds the ext payload from an array.array or a numpy.ndarray.
+    @staticmethod
+    def from_array(values):
+        if isinstance(values, array.array):
+            kind = _ARRAY_TYPECODE_KINDS.get(values.typecode)
+            byte_order = _NATIVE_BYTE_ORDER
+        else:
+            kind = values.dtype.kind
+            byte_order = values.dtype.byteorder
+            if byte_order in '=|':
+                byte_order = _NATIVE_BYTE_ORDER
+        code = _TYPED_ARRAY_CODES.get((kind, values.itemsize))
+        if code is None:
+            raise ValueError("Unsupported typed array element type")
+        raw = memoryview(values)
+        if not raw.c_contiguous:
+            raw = memoryview(values.copy())
+        data = bytearray(2 + raw.nbytes)
+        data[0] = ord(code)
+        data[1] = ord(byte_order)
+        data[2:] = raw.cast('B')
+        return TypedArrayFormat(data)
+
+    @property
+    def typecode(self):
+        return chr(self.data[0])
+
+    @property
+    def byte_order(self):
+        return chr(self.data[1])
+
+    # Elements as a memoryview cast to the typecode, sharing the payload bytes.
+    # A payload in the non-native byte order cannot be viewed in place and is
+    # returned as a byte-swapped array.array copy.
+    def to_array(self):
+        elements = memoryview(self.data)[2:]
+        if self.byte_order == _NATIVE_BYTE_ORDER:
+            return elements.cast(self.typecode)
+        values = array.array(self.typecode)
+        values.frombytes(elements)
+        values.byteswap()
+        return values
+
+    # Elements as a numpy.ndarray view of the payload bytes, in either byte order.
+    def to_numpy(self):
+        import numpy
+        return numpy.frombuffer(self.data, dtype=self.byte_order + self.typecode, offset=2)
 
-data = bytes([0xda, 0x01, 0xf4]) + b"Hello" * 100
-str16_format = Str16Format.from_bytes(data)
-print(type(str16_format), str16_format.value)
+    @staticmethod
+    def from_bytes(data):
+        return TypedArrayFormat.from_buffer(memoryview(data), 0)[0]
 
-data = bytes([0xdb, 0x00, 0x00, 0x0c, 0x80]) + b"Hello" * 1000
-str32_format = Str32Format.from_bytes(data)
-print(type(str32_format), str32_format.value)
+    # The payload stays a memoryview into data, so decoding copies nothing.
+    @staticmethod
+    def from_buffer(data, offset):
+        ext_type, start, end = _ext_bounds(data, offset)
+        if ext_type != TYPED_ARRAY_EXT_TYPE:
+            raise ValueError("Invalid TypedArrayFormat")
+        return TypedArrayFormat(data[start:end]), end
+
+# Ext types -> Format class decoding them in the Format tree; other ext
+# values decode as plain ExtFormat.
+_EXT_FORMATS = {TYPED_ARRAY_EXT_TYPE: TypedArrayFormat}
+
+def _decode_ext_format(data, offset):
+    ext_type = data[offset + _HEADER_SIZES[data[offset]] - 1]
+    if ext_type >= 0x80:
+        ext_type -= 0x100
+    return _EXT_FORMATS.get(ext_type, ExtFormat).from_buffer(data, offset)
+
+# Ext codecs used by packb/unpackb. An encoder is looked up by the exact type
+# of the object being packed and returns (ext type, payload bytes); a decoder
+# is looked up by ext type and gets the payload as a memoryview into the
+# buffer being decoded, so it must copy anything it keeps. Ext types without
+# a decoder decode to ExtFormat instances, which packb writes back unchanged.
+_EXT_ENCODERS = {}
+_EXT_DECODERS = {}
+
+def register_ext_type(ext_type, cls, encode, decode):
+    if not -0x80 <= ext_type <= 0x7f:
+        raise ValueError("Ext type out of range")
+    def encode_ext(obj):
+        return ext_type, encode(obj)
+    _EXT_ENCODERS[cls] = encode_ext
+    _EXT_DECODERS[ext_type] = decode
+
+TIMESTAMP_EXT_TYPE = -1
+
+_TIMESTAMP96 = struct.Struct('>Iq')
+
+# Seconds and nanoseconds since the Unix epoch, carried as the standard
+# timestamp ext type in its smallest form: 4 bytes (whole seconds up to
+# 2106), 8 bytes (nanoseconds, up to 2514) or 12 bytes.
+class Timestamp:
+    __slots__ = ('seconds', 'nanoseconds')
+
+    def __init__(self, seconds, nanoseconds=0):
+        if not 0 <= nanoseconds < 1000000000:
+            raise ValueError("Timestamp nanoseconds out of range")
+        self.seconds = seconds
+        self.nanoseconds = nanoseconds
+
+    def __eq__(self, other):
+        if not isinstance(other, Timestamp):
+            return NotImplemented
+        return self.seconds == other.seconds and self.nanoseconds == other.nanoseconds
+
+    def __hash__(self):
+        return hash((self.seconds, self.nanoseconds))
+
+    def __repr__(self):
+        return f"Timestamp({self.seconds}, {self.nanoseconds})"
 
-data = bytes([0xc4, 0x03, 0x01, 0x02, 0x03])
-bin8_format = Bin8Format.from_bytes(data)
-print(type(bin8_format), bin8_format.value)
+    @staticmethod
+    def from_unix(value):
+        seconds = int(value // 1)
+        nanoseconds = int(round((value - seconds) * 1e9))
+        if nanoseconds == 1000000000:
+            seconds, nanoseconds = seconds + 1, 0
+        return Timestamp(seconds, nanoseconds)
 
-data = bytes([0xc5, 0x00, 0x0a]) + b'\x01\x02' * 5
-bin16_format = Bin16Format.from_bytes(data)
-print(type(bin16_format), bin16_format.value)
+    def to_unix(self):
+        return self.seconds + self.nanoseconds / 1e9
 
-data = bytes([0xc6, 0x00, 0x00, 0x07, 0xd0]) + b'\x01\x02' * 500
-bin32_format = Bin32Format.from_bytes(data)
-print(type(bin32_format), bin32_format.value)
+    @staticmethod
+    def from_unix_nano(value):
+        return Timestamp(*divmod(value, 1000000000))
 
-data = bytes([0x93, 0x01, 0x02, 0x03])
-fixarray_format = FixArrayFormat.from_bytes(data)
-print(type(fixarray_format), [el.value for el in fixarray_format.value])
+    def to_unix_nano(self):
+        return self.seconds * 1000000000 + self.nanoseconds
 
-data = bytes([0xdc, 0x00, 0x14]) + bytes(range(20))
-array16_format = Array16Format.from_bytes(data)
-print(type(array16_format), [el.value for el in array16_format.value])
+    def to_bytes(self):
+        seconds, nanoseconds = self.seconds, self.nanoseconds
+        if seconds >> 34 == 0:
+            if nanoseconds == 0 and seconds <= 0xffffffff:
+                return _UINT32.pack(seconds)
+            return _UINT64.pack(nanoseconds << 34 | seconds)
+        return _TIMESTAMP96.pack(nanoseconds, seconds)
 
-data = bytes([0xdd, 0x00, 0x00, 0x75, 0x30]) + bytes(range(30000))
-array32_format = Array32Format.from_bytes(data)
-print(type(array32_format), [el.value for el in array32_format.value])
+    @staticmethod
+    def from_bytes(payload):
+        length = len(payload)
+        if length == 4:
+            return Timestamp(_UINT32.unpack_from(payload)[0])
+        elif length == 8:
+            value = _UINT64.unpack_from(payload)[0]
+            return Timestamp(value & 0x3ffffffff, value >> 34)
+        elif length == 12:
+            nanoseconds, seconds = _TIMESTAMP96.unpack_from(payload)
+            return Timestamp(seconds, nanoseconds)
+        raise ValueError("Invalid timestamp payload")
+
+register_ext_type(TIMESTAMP_EXT_TYPE, Timestamp, Timestamp.to_bytes, Timestamp.from_bytes)
+
+# Application ext type for packed float vectors: array.array('f') values
+# carried as their raw little-endian float32 elements with no further header,
+# so 2- and 4-element vectors are fixext 8/16 records. Other array.array
+# typecodes go out as TypedArrayFormat payloads and come back as array.array.
+FLOAT_VECTOR_EXT_TYPE = 0x11
+
+def _encode_array(values):
+    if values.typecode == 'f':
+        if sys.byteorder != 'little':
+            values = array.array('f', values)
+            values.byteswap()
+        return FLOAT_VECTOR_EXT_TYPE, values.tobytes()
+    return TYPED_ARRAY_EXT_TYPE, bytes(TypedArrayFormat.from_array(values).data)
+
+def _decode_float_vector(payload):
+    if len(payload) % 4:
+        raise ValueError("Invalid float vector payload")
+    values = array.array('f')
+    values.frombytes(payload)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+def _decode_typed_array(payload):
+    typed = TypedArrayFormat(payload)
+    values = array.array(typed.typecode)
+    values.frombytes(payload[2:])
+    if typed.byte_order != _NATIVE_BYTE_ORDER:
+        values.byteswap()
+    return values
+
+_EXT_ENCODERS[array.array] = _encode_array
+_EXT_DECODERS[FLOAT_VECTOR_EXT_TYPE] = _decode_float_vector
+_EXT_DECODERS[TYPED_ARRAY_EXT_TYPE] = _decode_typed_array
+
+def _unknown_format(data, offset):
+    raise ValueError("Unknown format")
+
+# Lead byte -> (from_buffer of the matching class, bytes before the payload or
+# first element), built once at import.
+def _build_format_table():
+    table = [(_unknown_format, 1)] * 256
+    for first_byte in range(0x00, 0x80):
+        table[first_byte] = (FixIntFormat.from_buffer, 1)
+    for first_byte in range(0xe0, 0x100):
+        table[first_byte] = (FixIntFormat.from_buffer, 1)
+    for first_byte in range(0x80, 0x90):
+        table[first_byte] = (FixMapFormat.from_buffer, 1)
+    for first_byte in range(0x90, 0xa0):
+        table[first_byte] = (FixArrayFormat.from_buffer, 1)
+    for first_byte in range(0xa0, 0xc0):
+        table[first_byte] = (FixStrFormat.from_buffer, 1)
+    table[0xc0] = (NilFormat.from_buffer, 1)
+    table[0xc2] = (BoolFormat.from_buffer, 1)
+    table[0xc3] = (BoolFormat.from_buffer, 1)
+    table[0xc4] = (Bin8Format.from_buffer, 2)
+    table[0xc5] = (Bin16Format.from_buffer, 3)
+    table[0xc6] = (Bin32Format.from_buffer, 5)
+    table[0xca] = (Float32Format.from_buffer, 5)
+    table[0xcb] = (Float64Format.from_buffer, 9)
+    table[0xcc] = (UInt8Format.from_buffer, 2)
+    table[0xcd] = (UInt16Format.from_buffer, 3)
+    table[0xce] = (UInt32Format.from_buffer, 5)
+    table[0xcf] = (UInt64Format.from_buffer, 9)
+    table[0xd0] = (Int8Format.from_buffer, 2)
+    table[0xd1] = (Int16Format.from_buffer, 3)
+    table[0xd2] = (Int32Format.from_buffer, 5)
+    table[0xd3] = (Int64Format.from_buffer, 9)
+    table[0xd9] = (Str8Format.from_buffer, 2)
+    table[0xda] = (Str16Format.from_buffer, 3)
+    table[0xdb] = (Str32Format.from_buffer, 5)
+    table[0xdc] = (Array16Format.from_buffer, 3)
+    table[0xdd] = (Array32Format.from_buffer, 5)
+    table[0xde] = (Map16Format.from_buffer, 3)
+    table[0xdf] = (Map32Format.from_buffer, 5)
+    for first_byte in range(0xd4, 0xd9):
+        table[first_byte] = (_decode_ext_format, 2)
+    table[0xc7] = (_decode_ext_format, 3)
+    table[0xc8] = (_decode_ext_format, 4)
+    table[0xc9] = (_decode_ext_format, 6)
+    return table
+
+_FORMAT_TABLE = _build_format_table()
+_FORMAT_DECODERS = [decoder for decoder, _ in _FORMAT_TABLE]
+_HEADER_SIZES = [header_size for _, header_size in _FORMAT_TABLE]
+
+# Plain-object codec: packb/unpackb go straight between None/bool/int/float/
+# str/bytes/list/tuple/dict and bytes without building *Format instances.
+# MessagePackFormat instances may appear anywhere in the value tree and are
+# written through their write_to().
+
+# Serializes into a single bytearray. Every value, however deeply nested, is
+# appended exactly once, so a message costs one copy into the buffer instead
+# of one per nesting level:
+#
+#     packer = Packer()
+#     for msg in messages:
+#         packer.reset()
+#         packer.pack(msg)
+#         sock.sendall(packer.getbuffer())
+#
+# Several objects packed without a reset() are laid out back to back. A view
+# returned by getbuffer() must be released before the next pack() or reset(),
+# since a bytearray with live exports cannot be resized.
+class Packer:
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def reset(self):
+        del self._buffer[:]
+
+    def getbuffer(self):
+        return memoryview(self._buffer)
+
+    def bytes(self):
+        return bytes(self._buffer)
+
+    def write(self, data):
+        self._buffer += data
+
+    def write_byte(self, value):
+        self._buffer.append(value)
+
+    def write_struct(self, fmt, *values):
+        self._buffer += fmt.pack(*values)
+
+    def pack(self, obj):
+        buf = self._buffer
+        if obj is None:
+            buf.append(0xc0)
+        elif obj is True:
+            buf.append(0xc3)
+        elif obj is False:
+            buf.append(0xc2)
+        elif isinstance(obj, int):
+            self._pack_int(obj)
+        elif isinstance(obj, float):
+            buf += _PACK_FLOAT64.pack(0xcb, obj)
+        elif isinstance(obj, str):
+            self._pack_str(obj)
+        elif isinstance(obj, (bytes, bytearray, memoryview)):
+            self._pack_bin(obj)
+        elif isinstance(obj, (list, tuple)):
+            self.pack_array_header(len(obj))
+            for item in obj:
+                self.pack(item)
+        elif isinstance(obj, dict):
+            self.pack_map_header(len(obj))
+            for key, value in obj.items():
+                if type(key) is str and len(key) <= _KEY_CACHE_MAX_LENGTH:
+                    buf += _encoded_key(key)
+                else:
+                    self.pack(key)
+                self.pack(value)
+        elif isinstance(obj, MessagePackFormat):
+            obj.write_to(self)
+        elif isinstance(obj, (ArrayView, MapView)):
+            buf += obj.raw()
+        else:
+            encode = _EXT_ENCODERS.get(type(obj))
+            if encode is None:
+                raise TypeError(f"Cannot serialize object of type {type(obj).__name__}")
+            ext_type, payload = encode(obj)
+            buf += _ext_header(ext_type, len(payload))
+            buf += payload
+
+    def _pack_int(self, value):
+        buf = self._buffer
+        if 0 <= value <= 0x7f or -32 <= value < 0:
+            buf.append(value & 0xff)
+        elif value > 0:
+            if value <= 0xff:
+                buf += _PACK_UINT8.pack(0xcc, value)
+            elif value <= 0xffff:
+                buf += _PACK_UINT16.pack(0xcd, value)
+            elif value <= 0xffffffff:
+                buf += _PACK_UINT32.pack(0xce, value)
+            elif value <= 0xffffffffffffffff:
+                buf += _PACK_UINT64.pack(0xcf, value)
+            else:
+                raise ValueError("Integer value out of range")
+        elif value >= -0x80:
+            buf += _PACK_INT8.pack(0xd0, value)
+        elif value >= -0x8000:
+            buf += _PACK_INT16.pack(0xd1, value)
+        elif value >= -0x80000000:
+            buf += _PACK_INT32.pack(0xd2, value)
+        elif value >= -0x8000000000000000:
+            buf += _PACK_INT64.pack(0xd3, value)
+        else:
+            raise ValueError("Integer value out of range")
 
-data = bytes([0x81, 0xa3, 0x6b, 0x65, 0x79, 0x01])
-fixmap_format = FixMapFormat.from_bytes(data)
-print(type(fixmap_format), {k: v.value for k, v in fixmap_format.value.items()})
+    def _pack_str(self, value):
+        buf = self._buffer
+        utf8_bytes = value.encode('utf-8')
+        length = len(utf8_bytes)
+        if length <= 31:
+            buf.append(0xa0 | length)
+        elif length <= 0xff:
+            buf += _PACK_UINT8.pack(0xd9, length)
+        elif length <= 0xffff:
+            buf += _PACK_UINT16.pack(0xda, length)
+        elif length <= 0xffffffff:
+            buf += _PACK_UINT32.pack(0xdb, length)
+        else:
+            raise ValueError("String length out of range")
+        buf += utf8_bytes
+
+    def _pack_bin(self, value):
+        buf = self._buffer
+        length = value.nbytes if isinstance(value, memoryview) else len(value)
+        if length <= 0xff:
+            buf += _PACK_UINT8.pack(0xc4, length)
+        elif length <= 0xffff:
+            buf += _PACK_UINT16.pack(0xc5, length)
+        elif length <= 0xffffffff:
+            buf += _PACK_UINT32.pack(0xc6, length)
+        else:
+            raise ValueError("Binary length out of range")
+        buf += value
 
-data = bytes([0xde, 0x00, 0x14]) + b''.join([bytes([0xa4]) + f'key{i}'.encode() + bytes([i]) for i in range(20)])
-map16_format = Map16Format.from_bytes(data)
-print(type(map16_format), {k: v.value for k, v in map16_format.value.items()})
-
-data = bytes([0xdf, 0x00, 0x00, 0x75, 0x30]) + b''.join([bytes([0xa4]) + f'key{i}'.encode() + bytes([i]) for i in range(30000)])
-map32_format = Map32Format.from_bytes(data)
-print(type(map32_format), {k: v.value for k, v in map32_format.value.items()})
+    def pack_array_header(self, length):
+        if length <= 15:
+            self._buffer.append(0x90 | length)
+        elif length <= 0xffff:
+            self._buffer += _PACK_UINT16.pack(0xdc, length)
+        elif length <= 0xffffffff:
+            self._buffer += _PACK_UINT32.pack(0xdd, length)
+        else:
+            raise ValueError("Array length out of range")
 
-data = bytes([0xd4, 0x01, 0x02])
-ext_format = ExtFormat.from_bytes(data)
-print(type(ext_format), ext_format.type, ext_format.data)
+    def pack_map_header(self, length):
+        if length <= 15:
+            self._buffer.append(0x80 | length)
+        elif length <= 0xffff:
+            self._buffer += _PACK_UINT16.pack(0xde, length)
+        elif length <= 0xffffffff:
+            self._buffer += _PACK_UINT32.pack(0xdf, length)
+        else:
+            raise ValueError("Map length out of range")
+
+def packb(obj):
+    packer = Packer()
+    packer.pack(obj)
+    return packer.bytes()
+
+# Size first, then fill: packed_size(obj) is the exact length packb(obj)
+# returns, computed without encoding (ASCII strings are measured by their
+# character count, only non-ASCII text is encoded to be measured), and
+# pack_into(obj, buffer, offset) writes the encoding straight into a
+# preallocated writable buffer (a bytearray, mmap, shared memory block, ...)
+# and returns the offset after it:
+#
+#     size = packed_size(msg)
+#     pack_into(msg, block.buf, offset)
+#
+# The whole message is checked to fit before anything is written.
+def packed_size(obj):
+    if obj is None or obj is True or obj is False:
+        return 1
+    elif isinstance(obj, int):
+        return _int_size(obj)
+    elif isinstance(obj, float):
+        return 9
+    elif isinstance(obj, str):
+        length = _utf8_length(obj)
+        if length <= 31:
+            return 1 + length
+        elif length <= 0xff:
+            return 2 + length
+        elif length <= 0xffff:
+            return 3 + length
+        elif length <= 0xffffffff:
+            return 5 + length
+        raise ValueError("String length out of range")
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        length = obj.nbytes if isinstance(obj, memoryview) else len(obj)
+        if length <= 0xff:
+            return 2 + length
+        elif length <= 0xffff:
+            return 3 + length
+        elif length <= 0xffffffff:
+            return 5 + length
+        raise ValueError("Binary length out of range")
+    elif isinstance(obj, (list, tuple)):
+        size = _container_header_size(len(obj), "Array length out of range")
+        for item in obj:
+            size += packed_size(item)
+        return size
+    elif isinstance(obj, dict):
+        size = _container_header_size(len(obj), "Map length out of range")
+        for key, value in obj.items():
+            size += packed_size(key) + packed_size(value)
+        return size
+    elif isinstance(obj, MessagePackFormat):
+        return obj.packed_size()
+    elif isinstance(obj, (ArrayView, MapView)):
+        return len(obj.raw())
+    encode = _EXT_ENCODERS.get(type(obj))
+    if encode is None:
+        raise TypeError(f"Cannot serialize object of type {type(obj).__name__}")
+    length = len(encode(obj)[1])
+    return _ext_header_size(length) + length
+
+def _int_size(value):
+    if -32 <= value <= 0x7f:
+        return 1
+    elif value > 0:
+        if value <= 0xff:
+            return 2
+        elif value <= 0xffff:
+            return 3
+        elif value <= 0xffffffff:
+            return 5
+        elif value <= 0xffffffffffffffff:
+            return 9
+    elif value >= -0x80:
+        return 2
+    elif value >= -0x8000:
+        return 3
+    elif value >= -0x80000000:
+        return 5
+    elif value >= -0x8000000000000000:
+        return 9
+    raise ValueError("Integer value out of range")
+
+def _container_header_size(length, message):
+    if length <= 15:
+        return 1
+    elif length <= 0xffff:
+        return 3
+    elif length <= 0xffffffff:
+        return 5
+    raise ValueError(message)
+
+def pack_into(obj, buffer, offset=0):
+    buffer = memoryview(buffer).cast('B')
+    if offset + packed_size(obj) > len(buffer):
+        raise ValueError("Buffer too small")
+    return _fill(buffer, offset, obj)
+
+# Writes obj at buffer[offset:] and returns the offset after it, laying out
+# exactly the bytes Packer.pack() would append.
+def _fill(buffer, offset, obj):
+    if obj is None:
+        buffer[offset] = 0xc0
+        return offset + 1
+    elif obj is True:
+        buffer[offset] = 0xc3
+        return offset + 1
+    elif obj is False:
+        buffer[offset] = 0xc2
+        return offset + 1
+    elif isinstance(obj, int):
+        if 0 <= obj <= 0x7f or -32 <= obj < 0:
+            buffer[offset] = obj & 0xff
+            return offset + 1
+        elif obj > 0:
+            if obj <= 0xff:
+                _PACK_UINT8.pack_into(buffer, offset, 0xcc, obj)
+                return offset + 2
+            elif obj <= 0xffff:
+                _PACK_UINT16.pack_into(buffer, offset, 0xcd, obj)
+                return offset + 3
+            elif obj <= 0xffffffff:
+                _PACK_UINT32.pack_into(buffer, offset, 0xce, obj)
+                return offset + 5
+            _PACK_UINT64.pack_into(buffer, offset, 0xcf, obj)
+            return offset + 9
+        elif obj >= -0x80:
+            _PACK_INT8.pack_into(buffer, offset, 0xd0, obj)
+            return offset + 2
+        elif obj >= -0x8000:
+            _PACK_INT16.pack_into(buffer, offset, 0xd1, obj)
+            return offset + 3
+        elif obj >= -0x80000000:
+            _PACK_INT32.pack_into(buffer, offset, 0xd2, obj)
+            return offset + 5
+        _PACK_INT64.pack_into(buffer, offset, 0xd3, obj)
+        return offset + 9
+    elif isinstance(obj, float):
+        _PACK_FLOAT64.pack_into(buffer, offset, 0xcb, obj)
+        return offset + 9
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        length = len(data)
+        if length <= 31:
+            buffer[offset] = 0xa0 | length
+            offset += 1
+        elif length <= 0xff:
+            _PACK_UINT8.pack_into(buffer, offset, 0xd9, length)
+            offset += 2
+        elif length <= 0xffff:
+            _PACK_UINT16.pack_into(buffer, offset, 0xda, length)
+            offset += 3
+        else:
+            _PACK_UINT32.pack_into(buffer, offset, 0xdb, length)
+            offset += 5
+        buffer[offset:offset + length] = data
+        return offset + length
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        length = obj.nbytes if isinstance(obj, memoryview) else len(obj)
+        if length <= 0xff:
+            _PACK_UINT8.pack_into(buffer, offset, 0xc4, length)
+            offset += 2
+        elif length <= 0xffff:
+            _PACK_UINT16.pack_into(buffer, offset, 0xc5, length)
+            offset += 3
+        else:
+            _PACK_UINT32.pack_into(buffer, offset, 0xc6, length)
+            offset += 5
+        if isinstance(obj, memoryview):
+            obj = obj.cast('B')
+        return _fill_raw(buffer, offset, obj)
+    elif isinstance(obj, (list, tuple)):
+        offset = _fill_header(buffer, offset, len(obj), 0x90, 0xdc)
+        for item in obj:
+            offset = _fill(buffer, offset, item)
+        return offset
+    elif isinstance(obj, dict):
+        offset = _fill_header(buffer, offset, len(obj), 0x80, 0xde)
+        for key, value in obj.items():
+            if type(key) is str and len(key) <= _KEY_CACHE_MAX_LENGTH:
+                offset = _fill_raw(buffer, offset, _encoded_key(key))
+            else:
+                offset = _fill(buffer, offset, key)
+            offset = _fill(buffer, offset, value)
+        return offset
+    elif isinstance(obj, MessagePackFormat):
+        return _fill_raw(buffer, offset, obj.to_bytes())
+    elif isinstance(obj, (ArrayView, MapView)):
+        return _fill_raw(buffer, offset, obj.raw())
+    ext_type, payload = _EXT_ENCODERS[type(obj)](obj)
+    offset = _fill_raw(buffer, offset, _ext_header(ext_type, len(payload)))
+    return _fill_raw(buffer, offset, payload)
+
+def _fill_raw(buffer, offset, data):
+    end = offset + len(data)
+    buffer[offset:end] = data
+    return end
+
+# Array (fix_code 0x90, code 0xdc) or map (0x80, 0xde) header; the 32-bit
+# form is code + 1.
+def _fill_header(buffer, offset, length, fix_code, code):
+    if length <= 15:
+        buffer[offset] = fix_code | length
+        return offset + 1
+    elif length <= 0xffff:
+        _PACK_UINT16.pack_into(buffer, offset, code, length)
+        return offset + 3
+    _PACK_UINT32.pack_into(buffer, offset, code + 1, length)
+    return offset + 5
+
+def _unpack_positive_fixint(data, offset):
+    return data[offset], offset + 1
+
+def _unpack_negative_fixint(data, offset):
+    return data[offset] - 0x100, offset + 1
+
+def _unpack_nil(data, offset):
+    return None, offset + 1
+
+def _unpack_false(data, offset):
+    return False, offset + 1
+
+def _unpack_true(data, offset):
+    return True, offset + 1
+
+def _scalar_unpacker(fmt):
+    unpack_from = fmt.unpack_from
+    size = fmt.size + 1
+    def unpack(data, offset):
+        return unpack_from(data, offset + 1)[0], offset + size
+    return unpack
+
+def _length_of(data, offset, header_size):
+    if header_size == 2:
+        return data[offset + 1]
+    elif header_size == 3:
+        return _UINT16.unpack_from(data, offset + 1)[0]
+    return _UINT32.unpack_from(data, offset + 1)[0]
+
+def _unpack_fixstr(data, offset):
+    start = offset + 1
+    end = start + (data[offset] & 0x1f)
+    return str(data[start:end], 'utf-8'), end
+
+def _str_unpacker(header_size):
+    def unpack(data, offset):
+        start = offset + header_size
+        end = start + _length_of(data, offset, header_size)
+        return str(data[start:end], 'utf-8'), end
+    return unpack
+
+def _bin_unpacker(header_size):
+    def unpack(data, offset):
+        start = offset + header_size
+        end = start + _length_of(data, offset, header_size)
+        return bytes(data[start:end]), end
+    return unpack
+
+# zero_copy decoding: payloads of at least _ZERO_COPY_MIN_LENGTH bytes come
+# back as a memoryview into the buffer being decoded, which stays alive (and,
+# for a bytearray, cannot be resized) while the view is referenced. Shorter
+# payloads are still copied: a memoryview object is larger than a small bytes.
+_ZERO_COPY_MIN_LENGTH = 256
+
+def _bin_view_unpacker(header_size):
+    def unpack(data, offset):
+        start = offset + header_size
+        end = start + _length_of(data, offset, header_size)
+        if end - start < _ZERO_COPY_MIN_LENGTH:
+            return bytes(data[start:end]), end
+        return data[start:end], end
+    return unpack
+
+# Ext values go through the registered decoder for their type, or decode to
+# ExtFormat (sharing the buffer under zero_copy). payload_length is the fixed
+# payload size of a fixext, or None when the header carries the length.
+def _ext_unpacker(header_size, payload_length, zero_copy):
+    def unpack(data, offset):
+        start = offset + header_size
+        if payload_length is None:
+            end = start + _length_of(data, offset, header_size - 1)
+        else:
+            end = start + payload_length
+        ext_type = data[start - 1]
+        if ext_type >= 0x80:
+            ext_type -= 0x100
+        decode = _EXT_DECODERS.get(ext_type)
+        if decode is not None:
+            return decode(data[start:end]), end
+        if zero_copy:
+            return ExtFormat(ext_type, data[start:end]), end
+        return ExtFormat(ext_type, bytes(data[start:end])), end
+    return unpack
+
+# intern_strings decoding: strings of up to _INTERN_MAX_LENGTH bytes go through
+# a bounded LRU keyed by the string itself, which hands back the first equal
+# str it saw, so repeated values share one object instead of one per message.
+_INTERN_MAX_LENGTH = 32
+_STRING_CACHE_SIZE = 4096
+_interned_str = functools.lru_cache(maxsize=_STRING_CACHE_SIZE)(str)
+
+def _unpack_fixstr_interned(data, offset):
+    start = offset + 1
+    end = start + (data[offset] & 0x1f)
+    return _interned_str(str(data[start:end], 'utf-8')), end
+
+def _unpack_str8_interned(data, offset):
+    start = offset + 2
+    end = start + data[offset + 1]
+    if end - start > _INTERN_MAX_LENGTH:
+        return str(data[start:end], 'utf-8'), end
+    return _interned_str(str(data[start:end], 'utf-8')), end
+
+# Arrays of at least _BULK_MIN_RUN consecutive elements sharing one fixed-width
+# numeric lead byte (or all positive fixints) are decoded as a batch: the
+# payload bytes are gathered with one strided slice per byte lane and loaded
+# into an array.array, instead of dispatching on every element.
+_BULK_MIN_RUN = 16
+
+# Lead byte -> (encoded element size, array typecode of the payload).
+_BULK_TYPES = {
+    0xca: (5, 'f'), 0xcb: (9, 'd'),
+    0xcc: (2, 'B'), 0xcd: (3, 'H'), 0xce: (5, 'I'), 0xcf: (9, 'Q'),
+    0xd0: (2, 'b'), 0xd1: (3, 'h'), 0xd2: (5, 'i'), 0xd3: (9, 'q'),
+}
+_BULK_FORMATS = {
+    0xca: Float32Format, 0xcb: Float64Format,
+    0xcc: UInt8Format, 0xcd: UInt16Format, 0xce: UInt32Format, 0xcf: UInt64Format,
+    0xd0: Int8Format, 0xd1: Int16Format, 0xd2: Int32Format, 0xd3: Int64Format,
+}
+_POSITIVE_FIXINTS = bytes(range(0x80))
+
+# Lead byte -> encoded size for the bytes that can start a batchable run, else 0.
+_RUN_SIZES = [1 if first_byte <= 0x7f else _BULK_TYPES.get(first_byte, (0,))[0] for first_byte in range(256)]
+
+# Counts how many of the next `limit` elements of `size` bytes start with one
+# of lead_bytes, growing the window of lead bytes compared at a time so the
+# scan stays linear in the run length.
+def _run_length(data, offset, size, lead_bytes, limit):
+    run = 0
+    window = _BULK_MIN_RUN
+    while run < limit:
+        window = min(window, limit - run)
+        start = offset + run * size
+        tags = bytes(data[start:start + window * size:size])
+        matched = len(tags) - len(tags.lstrip(lead_bytes))
+        run += matched
+        if matched < window:
+            break
+        window *= 2
+    return run
+
+# Returns (array.array of values, new offset) for a run of at least
+# _BULK_MIN_RUN same-typed elements starting at offset, or None.
+def _unpack_bulk(data, offset, length):
+    first_byte = data[offset]
+    if first_byte <= 0x7f:
+        size, typecode, lead_bytes = 1, 'B', _POSITIVE_FIXINTS
+    else:
+        bulk = _BULK_TYPES.get(first_byte)
+        if bulk is None:
+            return None
+        size, typecode = bulk
+        lead_bytes = bytes([first_byte])
+    run = _run_length(data, offset, size, lead_bytes, min(length, (len(data) - offset) // size))
+    if run < _BULK_MIN_RUN:
+        return None
+    end = offset + run * size
+    values = array.array(typecode)
+    if size == 1:
+        values.frombytes(data[offset:end])
+        return values, end
+    width = size - 1
+    packed = bytearray(run * width)
+    for lane in range(width):
+        packed[lane::width] = bytes(data[offset + 1 + lane:end:size])
+    values.frombytes(packed)
+    if width > 1 and sys.byteorder == 'little':
+        values.byteswap()
+    return values, end
+
+# Between bulk probes, elements are decoded one by one in chunks of
+# _BULK_PROBE_INTERVAL so arrays without numeric runs pay one probe per chunk.
+_BULK_PROBE_INTERVAL = 64
+
+def _array_items_unpacker(table, numeric_arrays):
+    def unpack_items(data, offset, length):
+        items = []
+        index = 0
+        while index < length:
+            if length - index >= _BULK_MIN_RUN:
+                bulk = _unpack_bulk(data, offset, length - index)
+                if bulk is not None:
+                    values, offset = bulk
+                    if numeric_arrays is not None and len(values) == length:
+                        if numeric_arrays == 'numpy':
+                            import numpy
+                            return numpy.frombuffer(values, dtype=values.typecode), offset
+                        return values, offset
+                    items += values.tolist()
+                    index += len(values)
+                    continue
+            count = min(_BULK_PROBE_INTERVAL, length - index)
+            for _ in range(count):
+                item, offset = table[data[offset]](data, offset)
+                items.append(item)
+            index += count
+        return items, offset
+    return unpack_items
+
+# Typed counterpart of unpack_items for Array16Format/Array32Format: bulk runs
+# are decoded in one batch and only wrapped per element.
+def _unpack_format_items(data, offset, length):
+    elements = []
+    decoders = _FORMAT_DECODERS
+    index = 0
+    while index < length:
+        if length - index >= _BULK_MIN_RUN:
+            first_byte = data[offset]
+            bulk = _unpack_bulk(data, offset, length - index)
+            if bulk is not None:
+                values, offset = bulk
+                cls = FixIntFormat if first_byte <= 0x7f else _BULK_FORMATS[first_byte]
+                elements += map(cls, values.tolist())
+                index += len(values)
+                continue
+        count = min(_BULK_PROBE_INTERVAL, length - index)
+        for _ in range(count):
+            element, offset = decoders[data[offset]](data, offset)
+            elements.append(element)
+        index += count
+    return elements, offset
+
+def _unpack_fixstr_key(data, offset):
+    start = offset + 1
+    end = start + (data[offset] & 0x1f)
+    return sys.intern(str(data[start:end], 'utf-8')), end
+
+def _str_key_unpacker(header_size):
+    def unpack(data, offset):
+        start = offset + header_size
+        end = start + _length_of(data, offset, header_size)
+        return sys.intern(str(data[start:end], 'utf-8')), end
+    return unpack
+
+# Map keys are decoded through key_table, which differs from table only in
+# interning str keys.
+def _map_items_unpacker(table, key_table):
+    def unpack_items(data, offset, length):
+        items = {}
+        for _ in range(length):
+            key, offset = key_table[data[offset]](data, offset)
+            value, offset = table[data[offset]](data, offset)
+            items[key] = value
+        return items, offset
+    return unpack_items
+
+def _container_unpacker(unpack_items, header_size):
+    if header_size == 1:
+        def unpack(data, offset):
+            return unpack_items(data, offset + 1, data[offset] & 0x0f)
+    else:
+        def unpack(data, offset):
+            return unpack_items(data, offset + header_size, _length_of(data, offset, header_size))
+    return unpack
+
+# Every dispatch table built by _unpacker_table(), and the hook that
+# MessagePackStats sets while instrumentation is enabled so that tables built
+# in the meantime get instrumented too.
+_UNPACKER_TABLES = []
+_instrument_table = None
+
+# numeric_arrays selects what an array made of a single same-typed numeric run
+# decodes to: None for a list, 'array' for an array.array, 'numpy' for a
+# numpy.ndarray sharing the array.array's memory. zero_copy returns bin
+# payloads as memoryviews into the source buffer instead of bytes copies, and
+# intern_strings shares short decoded strings between messages.
+@functools.lru_cache(maxsize=None)
+def _unpacker_table(numeric_arrays=None, zero_copy=False, intern_strings=False):
+    if numeric_arrays not in (None, 'array', 'numpy'):
+        raise ValueError("numeric_arrays must be None, 'array' or 'numpy'")
+    table = [_unknown_format] * 256
+    unpack_array_items = _array_items_unpacker(table, numeric_arrays)
+    key_table = [_unknown_format] * 256
+    unpack_map_items = _map_items_unpacker(table, key_table)
+    for first_byte in range(0x00, 0x80):
+        table[first_byte] = _unpack_positive_fixint
+    for first_byte in range(0xe0, 0x100):
+        table[first_byte] = _unpack_negative_fixint
+    for first_byte in range(0x80, 0x90):
+        table[first_byte] = _container_unpacker(unpack_map_items, 1)
+    for first_byte in range(0x90, 0xa0):
+        table[first_byte] = _container_unpacker(unpack_array_items, 1)
+    for first_byte in range(0xa0, 0xc0):
+        table[first_byte] = _unpack_fixstr
+    table[0xc0] = _unpack_nil
+    table[0xc2] = _unpack_false
+    table[0xc3] = _unpack_true
+    table[0xc4] = _bin_unpacker(2)
+    table[0xc5] = _bin_unpacker(3)
+    table[0xc6] = _bin_unpacker(5)
+    table[0xca] = _scalar_unpacker(_FLOAT32)
+    table[0xcb] = _scalar_unpacker(_FLOAT64)
+    table[0xcc] = _scalar_unpacker(_UINT8)
+    table[0xcd] = _scalar_unpacker(_UINT16)
+    table[0xce] = _scalar_unpacker(_UINT32)
+    table[0xcf] = _scalar_unpacker(_UINT64)
+    table[0xd0] = _scalar_unpacker(_INT8)
+    table[0xd1] = _scalar_unpacker(_INT16)
+    table[0xd2] = _scalar_unpacker(_INT32)
+    table[0xd3] = _scalar_unpacker(_INT64)
+    table[0xd9] = _str_unpacker(2)
+    table[0xda] = _str_unpacker(3)
+    table[0xdb] = _str_unpacker(5)
+    table[0xdc] = _container_unpacker(unpack_array_items, 3)
+    table[0xdd] = _container_unpacker(unpack_array_items, 5)
+    table[0xde] = _container_unpacker(unpack_map_items, 3)
+    table[0xdf] = _container_unpacker(unpack_map_items, 5)
+    for first_byte, payload_length in zip(range(0xd4, 0xd9), (1, 2, 4, 8, 16)):
+        table[first_byte] = _ext_unpacker(2, payload_length, zero_copy)
+    table[0xc7] = _ext_unpacker(3, None, zero_copy)
+    table[0xc8] = _ext_unpacker(4, None, zero_copy)
+    table[0xc9] = _ext_unpacker(6, None, zero_copy)
+    if zero_copy:
+        table[0xc4] = _bin_view_unpacker(2)
+        table[0xc5] = _bin_view_unpacker(3)
+        table[0xc6] = _bin_view_unpacker(5)
+    if intern_strings:
+        for first_byte in range(0xa0, 0xc0):
+            table[first_byte] = _unpack_fixstr_interned
+        table[0xd9] = _unpack_str8_interned
+    key_table[:] = table
+    for first_byte in range(0xa0, 0xc0):
+        key_table[first_byte] = _unpack_fixstr_key
+    key_table[0xd9] = _str_key_unpacker(2)
+    key_table[0xda] = _str_key_unpacker(3)
+    key_table[0xdb] = _str_key_unpacker(5)
+    _UNPACKER_TABLES.append(table)
+    _UNPACKER_TABLES.append(key_table)
+    if _instrument_table is not None:
+        _instrument_table(table)
+        _instrument_table(key_table)
+    return table
+
+_UNPACKERS = _unpacker_table()
+
+def unpackb(data, numeric_arrays=None, zero_copy=False, intern_strings=False):
+    data = memoryview(data)
+    try:
+        obj, offset = _unpacker_table(numeric_arrays, zero_copy, intern_strings)[data[0]](data, 0)
+    except (IndexError, struct.error):
+        raise ValueError("Truncated object")
+    if offset != len(data):
+        if offset > len(data):
+            raise ValueError("Truncated object")
+        raise ValueError("Extra data after the packed object")
+    return obj
+
+# Lead byte -> reader for the declared length that follows the header (payload
+# bytes for str/bin, element count for arrays, key/value pairs for maps), or
+# None when the header size is the whole encoded size. _ITEMS_PER_LENGTH is the
+# number of nested objects each unit of that length stands for.
+def _read_length8(data, offset):
+    return data[offset + 1]
+
+def _read_length16(data, offset):
+    return _UINT16.unpack_from(data, offset + 1)[0]
+
+def _read_length32(data, offset):
+    return _UINT32.unpack_from(data, offset + 1)[0]
+
+def _read_fixstr_length(data, offset):
+    return data[offset] & 0x1f
+
+def _read_fixcontainer_length(data, offset):
+    return data[offset] & 0x0f
+
+def _fixext_length_reader(payload_length):
+    def read_length(data, offset):
+        return payload_length
+    return read_length
+
+def _build_length_tables():
+    readers = [None] * 256
+    items = [0] * 256
+    for first_byte in range(0x80, 0x90):
+        readers[first_byte], items[first_byte] = _read_fixcontainer_length, 2
+    for first_byte in range(0x90, 0xa0):
+        readers[first_byte], items[first_byte] = _read_fixcontainer_length, 1
+    for first_byte in range(0xa0, 0xc0):
+        readers[first_byte] = _read_fixstr_length
+    readers[0xc1] = _unknown_format
+    for first_byte, payload_length in zip(range(0xd4, 0xd9), (1, 2, 4, 8, 16)):
+        readers[first_byte] = _fixext_length_reader(payload_length)
+    readers[0xc7] = _read_length8
+    readers[0xc8] = _read_length16
+    readers[0xc9] = _read_length32
+    readers[0xc4] = readers[0xd9] = _read_length8
+    readers[0xc5] = readers[0xda] = _read_length16
+    readers[0xc6] = readers[0xdb] = _read_length32
+    readers[0xdc], items[0xdc] = _read_length16, 1
+    readers[0xdd], items[0xdd] = _read_length32, 1
+    readers[0xde], items[0xde] = _read_length16, 2
+    readers[0xdf], items[0xdf] = _read_length32, 2
+    return readers, items
+
+_LENGTH_READERS, _ITEMS_PER_LENGTH = _build_length_tables()
+
+# Lead byte -> 1 for str, 2 for bin, 3 for ext, else 0: the index of the
+# payload length limit that applies in unpackb_limited().
+_PAYLOAD_KINDS = [0] * 256
+for _first_byte in list(range(0xa0, 0xc0)) + [0xd9, 0xda, 0xdb]:
+    _PAYLOAD_KINDS[_first_byte] = 1
+for _first_byte in (0xc4, 0xc5, 0xc6):
+    _PAYLOAD_KINDS[_first_byte] = 2
+for _first_byte in (0xc7, 0xc8, 0xc9, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8):
+    _PAYLOAD_KINDS[_first_byte] = 3
+del _first_byte
+
+# Decoder for untrusted input. Containers are built with an explicit stack
+# instead of recursion, so nesting cannot exhaust the Python stack, and every
+# declared length is checked before any work is done for it: a container's
+# element count against max_elements (counted over the whole message) and
+# against the bytes left, since every element takes at least one byte, and
+# str/bin/ext lengths against their limits and the bytes left. A message
+# longer than max_bytes is refused outright. Any limit can be None. Limit
+# violations and malformed or truncated input raise ValueError. Decodes to
+# the same objects as unpackb(), taking its zero_copy and intern_strings
+# options; numeric runs are not bulk-decoded.
+def unpackb_limited(data, max_depth=64, max_elements=1 << 20, max_str_len=1 << 20, max_bin_len=1 << 24,
+                    max_ext_len=1 << 24, max_bytes=1 << 26, zero_copy=False, intern_strings=False):
+    return _unpackb_limited(data, max_depth, max_elements, max_str_len, max_bin_len, max_ext_len, max_bytes,
+                            zero_copy, intern_strings)
+
+# Looked up at call time, so that MessagePackStats can wrap it.
+def _unpackb_limited(data, max_depth, max_elements, max_str_len, max_bin_len, max_ext_len, max_bytes,
+                     zero_copy, intern_strings):
+    data = memoryview(data)
+    data_end = len(data)
+    if max_bytes is not None and data_end > max_bytes:
+        raise ValueError("Message exceeds max_bytes")
+    if max_depth is None:
+        max_depth = sys.maxsize
+    elements_left = sys.maxsize if max_elements is None else max_elements
+    payload_limits = (None, max_str_len, max_bin_len, max_ext_len)
+    table = _unpacker_table(None, zero_copy, intern_strings)
+    header_sizes = _HEADER_SIZES
+    length_readers = _LENGTH_READERS
+    items_per_length = _ITEMS_PER_LENGTH
+    stack = []  # [container, objects still expected, pending map key]
+    offset = 0
+    try:
+        while True:
+            first_byte = data[offset]
+            items = items_per_length[first_byte]
+            if items:
+                length = length_readers[first_byte](data, offset)
+                offset += header_sizes[first_byte]
+                elements_left -= length
+                if elements_left < 0:
+                    raise ValueError("Message exceeds max_elements")
+                if length * items > data_end - offset:
+                    raise ValueError("Declared length exceeds the data")
+                value = [] if items == 1 else {}
+                if length:
+                    if len(stack) >= max_depth:
+                        raise ValueError("Message exceeds max_depth")
+                    stack.append([value, length * items, _NO_KEY])
+                    continue
+            else:
+                kind = _PAYLOAD_KINDS[first_byte]
+                if kind:
+                    length = length_readers[first_byte](data, offset)
+                    limit = payload_limits[kind]
+                    if limit is not None and length > limit:
+                        raise ValueError("Payload exceeds its length limit")
+                    if offset + header_sizes[first_byte] + length > data_end:
+                        raise ValueError("Truncated object")
+                value, offset = table[first_byte](data, offset)
+            while stack:
+                top = stack[-1]
+                container = top[0]
+                if type(container) is list:
+                    container.append(value)
+                elif top[2] is _NO_KEY:
+                    top[2] = sys.intern(value) if type(value) is str else value
+                else:
+                    container[top[2]] = value
+                    top[2] = _NO_KEY
+                top[1] -= 1
+                if top[1]:
+                    break
+                stack.pop()
+                value = container
+            else:
+                break
+    except (IndexError, struct.error):
+        raise ValueError("Truncated object")
+    except TypeError:
+        raise ValueError("Unhashable map key")
+    if offset != data_end:
+        if offset > data_end:
+            raise ValueError("Truncated object")
+        raise ValueError("Extra data after the packed object")
+    return value
+
+_NO_KEY = object()
+
+# unpackb_limited()'s limits and their defaults, which Unpacker applies to the
+# limits it is not given.
+_LIMIT_DEFAULTS = dict(zip(unpackb_limited.__code__.co_varnames[1:unpackb_limited.__code__.co_argcount],
+                           unpackb_limited.__defaults__))
+
+# Incremental decoder for byte streams that arrive in arbitrary chunks:
+#
+#     unpacker = Unpacker()
+#     while True:
+#         unpacker.feed(port.read(4096))
+#         for obj in unpacker:
+#             route(obj)
+#
+# Headers of the object being received are walked once as bytes arrive, with
+# the open containers kept on a small stack, so a partial object is resumed
+# where it stopped instead of being re-parsed. The object is decoded in a
+# single pass once its last byte is in. Consumed bytes are dropped on the next
+# feed(), and feed() refuses to grow the buffer past max_buffer_size. With
+# limits, a dict of unpackb_limited() limits, objects are decoded by
+# unpackb_limited() instead, for streams from untrusted peers. The limits are
+# also checked on each header as it is walked, so an object that declares too
+# much (lengths, element counts, depth or size) raises ValueError at once,
+# before its bytes are buffered. Such an object is dropped: the rest of it is
+# walked and discarded as it arrives, and iteration carries on after it, as it
+# does after an object that fails to decode. zero_copy cannot be one of the
+# limits, since views into the buffer would pin it. A byte that cannot start
+# an object (0xc1) raises ValueError and drops the object being received up
+# to and including that byte.
+class Unpacker:
+    def __init__(self, max_buffer_size=16 * 1024 * 1024, limits=None):
+        self.max_buffer_size = max_buffer_size
+        self.limits = limits
+        self._check_header = None
+        if limits is not None:
+            unknown = limits.keys() - _LIMIT_DEFAULTS.keys()
+            if unknown:
+                raise TypeError("Unknown limits: %s" % ", ".join(sorted(unknown)))
+            if limits.get('zero_copy'):
+                raise ValueError("Unpacker limits cannot enable zero_copy")
+            resolved = {name: sys.maxsize if value is None else value
+                        for name, value in dict(_LIMIT_DEFAULTS, **limits).items()}
+            self._max_depth = resolved['max_depth']
+            self._max_elements = resolved['max_elements']
+            self._max_bytes = resolved['max_bytes']
+            self._payload_limits = (None, resolved['max_str_len'], resolved['max_bin_len'], resolved['max_ext_len'])
+            self._check_header = self._limit_error
+        self._buffer = bytearray()
+        self._start = 0  # first byte of the object being received
+        self._scan = 0  # first byte of that object not walked yet
+        self._pending = []  # elements still expected by each open container
+        self._elements = 0  # elements declared so far by that object's containers
+        self._dropping = False  # that object broke a limit and is being discarded
+        self._skip = 0  # bytes of a dropped payload still to discard from feed()
+
+    def feed(self, chunk):
+        if self._skip:
+            skipped = min(self._skip, len(chunk))
+            chunk = memoryview(chunk)[skipped:]
+            self._skip -= skipped
+        if self._start:
+            del self._buffer[:self._start]
+            self._scan -= self._start
+            self._start = 0
+        if len(self._buffer) + len(chunk) > self.max_buffer_size:
+            raise ValueError("Unpacker buffer is full")
+        self._buffer += chunk
+
+    # Bytes received but not yet returned as objects.
+    def buffered(self):
+        return len(self._buffer) - self._start
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._scan_object():
+            raise StopIteration
+        start = self._start
+        self._start = end = self._scan
+        with memoryview(self._buffer) as view:
+            if self.limits is None:
+                return _UNPACKERS[view[start]](view, start)[0]
+            return unpackb_limited(view[start:end], **self.limits)
+
+    def _scan_object(self):
+        data = self._buffer
+        end = len(data)
+        scan = self._scan
+        pending = self._pending
+        check_header = None if self._dropping else self._check_header
+        while scan < end:
+            first_byte = data[scan]
+            size = _HEADER_SIZES[first_byte]
+            if scan + size > end:
+                break
+            read_length = _LENGTH_READERS[first_byte]
+            if read_length is not None:
+                try:
+                    length = read_length(data, scan)
+                except ValueError:
+                    self._start = self._scan = scan + 1
+                    del pending[:]
+                    self._elements = 0
+                    self._dropping = False
+                    raise
+                items = _ITEMS_PER_LENGTH[first_byte]
+                if check_header is not None:
+                    error = check_header(first_byte, items, length, len(pending), scan + size)
+                    if error is not None:
+                        self._drop(scan, size if items else size + length, length * items)
+                        raise ValueError(error)
+                if items and length:
+                    pending.append(length * items)
+                    scan += size
+                    continue
+                if not items:
+                    size += length
+                    if scan + size > end:
+                        if not self._dropping:
+                            break
+                        self._skip = scan + size - end
+                        size = end - scan
+            scan += size
+            while pending:
+                pending[-1] -= 1
+                if pending[-1]:
+                    break
+                pending.pop()
+            else:
+                self._scan = scan
+                self._elements = 0
+                if not self._dropping:
+                    return True
+                self._start = scan
+                self._dropping = False
+                check_header = self._check_header
+        self._scan = scan
+        if self._dropping:
+            self._start = scan
+        return False
+
+    # Drops the object being received, which broke a limit at the header at
+    # scan: `size` bytes long with its payload, opening a container of
+    # `elements` elements if non-zero. What is buffered of the object is
+    # released, a payload not fully received yet is discarded by feed(), and
+    # the rest of the object is walked and discarded as it arrives.
+    def _drop(self, scan, size, elements):
+        pending = self._pending
+        if elements:
+            pending.append(elements)
+            scan += size
+        else:
+            end = len(self._buffer)
+            if scan + size > end:
+                self._skip = scan + size - end
+                size = end - scan
+            scan += size
+            while pending:
+                pending[-1] -= 1
+                if pending[-1]:
+                    break
+                pending.pop()
+        self._start = self._scan = scan
+        self._dropping = bool(pending)
+        if not pending:
+            self._elements = 0
+
+    # The limit a header breaks, as an error message, or None.
+    def _limit_error(self, first_byte, items, length, depth, header_end):
+        object_end = header_end
+        if items:
+            self._elements += length
+            if self._elements > self._max_elements:
+                return "Message exceeds max_elements"
+            if length and depth >= self._max_depth:
+                return "Message exceeds max_depth"
+        else:
+            if length > self._payload_limits[_PAYLOAD_KINDS[first_byte]]:
+                return "Payload exceeds its length limit"
+            object_end += length
+        if object_end - self._start > self._max_bytes:
+            return "Message exceeds max_bytes"
+        return None
+
+# Returns the offset just past the encoded object at data[offset] without
+# building it: only headers are read, str/bin payloads are jumped over without
+# decoding, and nothing is allocated per element. A container simply adds its
+# element count to the number of objects still to skip, since its elements
+# follow it in the buffer; runs of same-typed fixed-width scalars are jumped
+# over in one step. With count, that many consecutive objects are skipped.
+# Input that ends inside an object raises ValueError("Truncated object").
+def skip(data, offset=0, count=1):
+    header_sizes = _HEADER_SIZES
+    length_readers = _LENGTH_READERS
+    items_per_length = _ITEMS_PER_LENGTH
+    run_sizes = _RUN_SIZES
+    data_end = len(data)
+    remaining = count
+    try:
+        while remaining:
+            first_byte = data[offset]
+            if remaining >= _BULK_MIN_RUN:
+                size = run_sizes[first_byte]
+                if size and offset + size < data_end and run_sizes[data[offset + size]] == size:
+                    lead_bytes = _POSITIVE_FIXINTS if first_byte <= 0x7f else bytes([first_byte])
+                    run = _run_length(data, offset, size, lead_bytes, min(remaining, (data_end - offset) // size))
+                    offset += run * size
+                    remaining -= run
+                    continue
+            remaining -= 1
+            read_length = length_readers[first_byte]
+            if read_length is None:
+                offset += header_sizes[first_byte]
+            elif items_per_length[first_byte]:
+                remaining += read_length(data, offset) * items_per_length[first_byte]
+                offset += header_sizes[first_byte]
+            else:
+                offset += header_sizes[first_byte] + read_length(data, offset)
+    except (IndexError, struct.error):
+        raise ValueError("Truncated object")
+    if offset > data_end:
+        raise ValueError("Truncated object")
+    return offset
+
+# skip() for data that may end inside the object: walks as far as the data
+# goes and returns (offset, remaining), remaining being the number of objects
+# still to skip from offset, 0 once the objects are complete. Passing both back
+# with more data appended resumes the walk where it stopped, so a reader can
+# find where a message ends without rescanning it on every read.
+def skip_partial(data, offset=0, count=1):
+    header_sizes = _HEADER_SIZES
+    length_readers = _LENGTH_READERS
+    items_per_length = _ITEMS_PER_LENGTH
+    run_sizes = _RUN_SIZES
+    data_end = len(data)
+    remaining = count
+    while remaining and offset < data_end:
+        first_byte = data[offset]
+        if remaining >= _BULK_MIN_RUN:
+            size = run_sizes[first_byte]
+            if size and offset + size < data_end and run_sizes[data[offset + size]] == size:
+                lead_bytes = _POSITIVE_FIXINTS if first_byte <= 0x7f else bytes([first_byte])
+                run = _run_length(data, offset, size, lead_bytes, min(remaining, (data_end - offset) // size))
+                offset += run * size
+                remaining -= run
+                continue
+        size = header_sizes[first_byte]
+        if offset + size > data_end:
+            break
+        read_length = length_readers[first_byte]
+        if read_length is None:
+            offset += size
+        elif items_per_length[first_byte]:
+            remaining += read_length(data, offset) * items_per_length[first_byte]
+            offset += size
+        else:
+            end = offset + size + read_length(data, offset)
+            if end > data_end:
+                break
+            offset = end
+        remaining -= 1
+    return offset, remaining
+
+# Yields a memoryview of each object in a buffer of concatenated objects.
+def split(data):
+    data = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        end = skip(data, offset)
+        yield data[offset:end]
+        offset = end
+
+# Nested arrays and maps are returned as views; anything else is decoded.
+def _view_or_value(data, offset):
+    first_byte = data[offset]
+    if 0x90 <= first_byte <= 0x9f or first_byte == 0xdc or first_byte == 0xdd:
+        return ArrayView(data, offset)
+    elif 0x80 <= first_byte <= 0x8f or first_byte == 0xde or first_byte == 0xdf:
+        return MapView(data, offset)
+    return _UNPACKERS[first_byte](data, offset)[0]
+
+# Read-only, lazily decoded views over an encoded array or map. Element offsets
+# are indexed by walking headers only as far as the element being read, and an
+# element is decoded only when it is read, nested containers coming back as
+# views themselves. raw() returns the encoded bytes of the whole container and
+# raw_item()/raw_value() those of one element, as memoryviews into the source
+# buffer, so untouched sub-trees can be forwarded without re-encoding;
+# Packer.pack() writes a view's raw bytes as they are.
+class ArrayView(Sequence):
+    def __init__(self, data, offset=0):
+        data = memoryview(data)
+        first_byte = data[offset]
+        if 0x90 <= first_byte <= 0x9f:
+            self._length, start = first_byte & 0x0f, offset + 1
+        elif first_byte == 0xdc:
+            self._length, start = _UINT16.unpack_from(data, offset + 1)[0], offset + 3
+        elif first_byte == 0xdd:
+            self._length, start = _UINT32.unpack_from(data, offset + 1)[0], offset + 5
+        else:
+            raise ValueError("Invalid ArrayView")
+        self._data = data
+        self._offset = offset
+        self._offsets = [start]
+
+    # Element i spans self._offsets[i]:self._offsets[i + 1].
+    def _index(self, count):
+        offsets = self._offsets
+        data = self._data
+        while len(offsets) <= count:
+            offsets.append(skip(data, offsets[-1]))
+        return offsets
+
+    def __len__(self):
+        return self._length
+
+    def _check_index(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("ArrayView index out of range")
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        index = self._check_index(index)
+        return _view_or_value(self._data, self._index(index)[index])
+
+    def raw(self):
+        return self._data[self._offset:self._index(self._length)[-1]]
+
+    def raw_item(self, index):
+        index = self._check_index(index)
+        offsets = self._index(index + 1)
+        return self._data[offsets[index]:offsets[index + 1]]
+
+class MapView(Mapping):
+    def __init__(self, data, offset=0):
+        data = memoryview(data)
+        first_byte = data[offset]
+        if 0x80 <= first_byte <= 0x8f:
+            self._length, start = first_byte & 0x0f, offset + 1
+        elif first_byte == 0xde:
+            self._length, start = _UINT16.unpack_from(data, offset + 1)[0], offset + 3
+        elif first_byte == 0xdf:
+            self._length, start = _UINT32.unpack_from(data, offset + 1)[0], offset + 5
+        else:
+            raise ValueError("Invalid MapView")
+        self._data = data
+        self._offset = offset
+        self._values = {}  # key -> (value start, value end)
+        self._scanned = 0
+        self._next = start
+
+    # Decodes keys and skips their values until `key` is found, or to the end
+    # of the map when key is None.
+    def _index(self, key=None):
+        data = self._data
+        values = self._values
+        unpackers = _UNPACKERS
+        offset = self._next
+        while self._scanned < self._length:
+            found, offset = unpackers[data[offset]](data, offset)
+            end = skip(data, offset)
+            values[found] = (offset, end)
+            offset = self._next = end
+            self._scanned += 1
+            if key is not None and found == key:
+                break
+        return values
+
+    def _locate(self, key):
+        location = self._values.get(key)
+        if location is None:
+            location = self._index(key)[key]
+        return location
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __getitem__(self, key):
+        return _view_or_value(self._data, self._locate(key)[0])
+
+    def raw(self):
+        self._index()
+        return self._data[self._offset:self._next]
+
+    def raw_value(self, key):
+        start, end = self._locate(key)
+        return self._data[start:end]
+
+# A path into an encoded object, compiled once and applied to many messages:
+#
+#     temp = PathQuery(["sensors", 3, "temp"])
+#     for message in split(capture):
+#         record(temp.extract(message))
+#
+# str steps select a map key and int steps an array index (negative indices
+# count from the end) or an integer map key. Keys are matched against the
+# encoded key bytes, and everything off the path is jumped over with skip(),
+# so only the target value is decoded. A missing key or index raises
+# KeyError/IndexError unless a default is given; stepping into a scalar or
+# running off the end of the data raises ValueError.
+_MISSING = object()
+
+class PathQuery:
+    __slots__ = ('path', '_steps')
+
+    def __init__(self, path):
+        self.path = tuple(path)
+        steps = []
+        for step in self.path:
+            if isinstance(step, str):
+                steps.append((step, step.encode('utf-8')))
+            elif isinstance(step, int) and not isinstance(step, bool):
+                steps.append((step, None))
+            else:
+                raise TypeError("Path steps must be str or int, not %s" % type(step).__name__)
+        self._steps = tuple(steps)
+
+    # Returns the offset of the encoded value the path points to.
+    def locate(self, data, offset=0):
+        for step, key_bytes in self._steps:
+            try:
+                first_byte = data[offset]
+                items = _ITEMS_PER_LENGTH[first_byte]
+                if not items:
+                    raise ValueError("Cannot apply path step %r to a scalar" % (step,))
+                length = _LENGTH_READERS[first_byte](data, offset)
+            except (IndexError, struct.error):
+                raise ValueError("Truncated object")
+            offset += _HEADER_SIZES[first_byte]
+            if items == 2:
+                offset = _find_map_value(data, offset, length, step, key_bytes)
+            elif key_bytes is not None:
+                raise KeyError(step)
+            else:
+                index = step + length if step < 0 else step
+                if not 0 <= index < length:
+                    raise IndexError(step)
+                if index:
+                    offset = skip(data, offset, index)
+        return offset
+
+    def extract(self, data, default=_MISSING):
+        data = memoryview(data)
+        try:
+            offset = self.locate(data)
+        except (KeyError, IndexError):
+            if default is _MISSING:
+                raise
+            return default
+        try:
+            obj, offset = _UNPACKERS[data[offset]](data, offset)
+        except (IndexError, struct.error):
+            raise ValueError("Truncated object")
+        if offset > len(data):
+            raise ValueError("Truncated object")
+        return obj
+
+    # Applies the query to each buffer of an iterable (a list of messages,
+    # split(capture), an Unpacker-fed stream of frames...).
+    def extract_many(self, buffers, default=_MISSING):
+        extract = self.extract
+        for data in buffers:
+            yield extract(data, default)
+
+# Returns the offset of the value stored under `key` in the `length` pairs
+# starting at offset. str keys are compared as raw UTF-8 payloads.
+def _find_map_value(data, offset, length, key, key_bytes):
+    try:
+        for _ in range(length):
+            first_byte = data[offset]
+            if key_bytes is not None:
+                if 0xa0 <= first_byte <= 0xbf or 0xd9 <= first_byte <= 0xdb:
+                    start = offset + _HEADER_SIZES[first_byte]
+                    offset = start + _LENGTH_READERS[first_byte](data, offset)
+                    if offset - start == len(key_bytes) and data[start:offset] == key_bytes:
+                        return offset
+                else:
+                    offset = skip(data, offset)
+            elif first_byte <= 0x7f or first_byte >= 0xe0 or 0xcc <= first_byte <= 0xd3:
+                found, offset = _UNPACKERS[first_byte](data, offset)
+                if found == key:
+                    return offset
+            else:
+                offset = skip(data, offset)
+            offset = skip(data, offset)
+    except (IndexError, struct.error):
+        raise ValueError("Truncated object")
+    raise KeyError(key)
+
+@functools.lru_cache(maxsize=256)
+def _compiled_path(path):
+    return PathQuery(path)
+
+def extract(data, path, default=_MISSING):
+    return _compiled_path(tuple(path)).extract(data, default)
@@ -0,0 +1,197 @@
+import os
+import struct
+
+from MessagePackFormat import MessagePackFormat, packb, skip_partial
+
+# Framing of MessagePack messages on a byte stream, in one of two modes:
+#
+# - LENGTH_PREFIXED: every message is preceded by its size as a 4-byte
+#   big-endian unsigned int, so the reader never looks inside a message.
+# - SELF_DELIMITING: messages are sent back to back and the reader finds
+#   where each one ends by walking its headers with skip_partial().
+#
+#     writer = FrameWriter(sock)
+#     for obj in batch:
+#         writer.write(obj)
+#     writer.flush()  # one sendmsg() for the whole batch
+#
+#     reader = FrameReader(sock)
+#     for frame in reader:
+#         route(unpackb(frame))
+LENGTH_PREFIXED = 'length'
+SELF_DELIMITING = 'delimited'
+
+_LENGTH_PREFIX = struct.Struct('>I')
+
+def _iov_max():
+    try:
+        return os.sysconf('SC_IOV_MAX')
+    except (AttributeError, ValueError, OSError):
+        return 1024
+
+def _check_framing(framing):
+    if framing not in (LENGTH_PREFIXED, SELF_DELIMITING):
+        raise ValueError("framing must be LENGTH_PREFIXED or SELF_DELIMITING")
+
+# Cuts the complete frames out of data[offset:] and returns them as
+# memoryviews into data together with the offset of the first unconsumed byte.
+def split_frames(data, framing=LENGTH_PREFIXED, offset=0, max_frame_size=16 * 1024 * 1024):
+    data = memoryview(data)
+    end = len(data)
+    frames = []
+    if framing == LENGTH_PREFIXED:
+        while offset + 4 <= end:
+            length = _LENGTH_PREFIX.unpack_from(data, offset)[0]
+            if length > max_frame_size:
+                raise ValueError("Frame too large")
+            if offset + 4 + length > end:
+                break
+            frames.append(data[offset + 4:offset + 4 + length])
+            offset += 4 + length
+    else:
+        _check_framing(framing)
+        while offset < end:
+            frame_end, remaining = skip_partial(data, offset)
+            if remaining:
+                if end - offset > max_frame_size:
+                    raise ValueError("Frame too large")
+                break
+            frames.append(data[offset:frame_end])
+            offset = frame_end
+    return frames, offset
+
+# Queues encoded messages and hands them to the kernel in as few calls as
+# possible: each flush() passes the queued buffers (length prefixes and
+# payloads, never concatenated) to socket.sendmsg() for sockets or os.writev()
+# for file descriptors, up to IOV_MAX buffers per call, and carries on after
+# partial writes. write() flushes by itself once max_pending bytes are queued.
+# target is a socket, a file descriptor or an object with fileno().
+class FrameWriter:
+    def __init__(self, target, framing=LENGTH_PREFIXED, max_pending=64 * 1024):
+        _check_framing(framing)
+        self.framing = framing
+        self.max_pending = max_pending
+        if hasattr(target, 'sendmsg'):
+            self._send = target.sendmsg
+        else:
+            fd = target if isinstance(target, int) else target.fileno()
+            self._send = lambda buffers: os.writev(fd, buffers)
+        self._iov_max = _iov_max()
+        self._buffers = []
+        self._pending = 0
+
+    # Queues one already encoded message.
+    def write_frame(self, payload):
+        if self.framing == LENGTH_PREFIXED:
+            self._buffers.append(_LENGTH_PREFIX.pack(len(payload)))
+            self._pending += 4
+        self._buffers.append(payload)
+        self._pending += len(payload)
+        if self._pending >= self.max_pending:
+            self.flush()
+
+    # Queues obj encoded with to_bytes() for Format instances, packb() otherwise.
+    def write(self, obj):
+        if isinstance(obj, MessagePackFormat):
+            self.write_frame(obj.to_bytes())
+        else:
+            self.write_frame(packb(obj))
+
+    def flush(self):
+        buffers = self._buffers
+        while buffers:
+            batch = buffers[:self._iov_max]
+            sent = self._send(batch)
+            self._pending -= sent
+            done = 0
+            for buffer in batch:
+                size = len(buffer)
+                if sent < size:
+                    break
+                sent -= size
+                done += 1
+            del buffers[:done]
+            if sent:
+                buffers[0] = memoryview(buffers[0])[sent:]
+
+# Reads a framed stream with one recv_into()/os.readv() per read_frames()
+# call, straight into a reusable buffer, and returns the complete frames as
+# memoryviews into that buffer: no frame is copied, but a frame is only valid
+# until the next read_frames(), which moves the trailing partial frame to the
+# front of the buffer. Copy frames with bytes() to keep them longer. The
+# buffer grows when a single frame does not fit, up to max_frame_size. In
+# SELF_DELIMITING mode the walk over a partial frame is resumed where the
+# previous read left it, so a large frame arriving in many reads is scanned
+# once. source is a socket, a file descriptor or an object with fileno().
+class FrameReader:
+    def __init__(self, source, framing=LENGTH_PREFIXED, buffer_size=64 * 1024, max_frame_size=16 * 1024 * 1024):
+        _check_framing(framing)
+        self.framing = framing
+        self.max_frame_size = max_frame_size
+        if hasattr(source, 'recv_into'):
+            self._read_into = source.recv_into
+        else:
+            fd = source if isinstance(source, int) else source.fileno()
+            self._read_into = lambda buffer: os.readv(fd, [buffer])
+        self._buffer = bytearray(buffer_size)
+        self._start = 0  # first byte not returned in a frame yet
+        self._end = 0  # end of the bytes read so far
+        self._scan = 0  # first byte of the partial frame not walked yet
+        self._remaining = 0  # objects the partial frame still needs from _scan
+
+    def _make_room(self):
+        pending = self._end - self._start
+        needed = pending + 1
+        if self.framing == LENGTH_PREFIXED and pending >= 4:
+            length = _LENGTH_PREFIX.unpack_from(self._buffer, self._start)[0]
+            if length > self.max_frame_size:
+                raise ValueError("Frame too large")
+            needed = max(needed, 4 + length)
+        elif self._start == 0 and self._end == len(self._buffer):
+            needed = 2 * len(self._buffer)
+        if needed > len(self._buffer):
+            buffer = bytearray(max(needed, 2 * len(self._buffer)))
+            buffer[:pending] = memoryview(self._buffer)[self._start:self._end]
+            self._buffer = buffer
+        elif self._start:
+            view = memoryview(self._buffer)
+            view[:pending] = bytes(view[self._start:self._end])
+        self._scan -= self._start
+        self._start, self._end = 0, pending
+
+    # Returns the frames completed by one read, possibly none. Raises EOFError
+    # at the end of the stream, or ValueError when it ends inside a frame.
+    def read_frames(self):
+        self._make_room()
+        count = self._read_into(memoryview(self._buffer)[self._end:])
+        if not count:
+            if self._end > self._start:
+                raise ValueError("Truncated frame")
+            raise EOFError("End of stream")
+        self._end += count
+        if self.framing == LENGTH_PREFIXED:
+            frames, self._start = split_frames(
+                memoryview(self._buffer)[:self._end], self.framing, self._start, self.max_frame_size)
+            return frames
+        return self._split_delimited()
+
+    def _split_delimited(self):
+        data = memoryview(self._buffer)[:self._end]
+        frames = []
+        while self._scan < self._end:
+            self._scan, self._remaining = skip_partial(data, self._scan, self._remaining or 1)
+            if self._remaining:
+                if self._end - self._start > self.max_frame_size:
+                    raise ValueError("Frame too large")
+                break
+            frames.append(data[self._start:self._scan])
+            self._start = self._scan
+        return frames
+
+    def __iter__(self):
+        while True:
+            try:
+                frames = self.read_frames()
+            except EOFError:
+                return
+            yield from frames
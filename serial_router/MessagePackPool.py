@@ -0,0 +1,115 @@
+import os
+
+from MessagePackFormat import Packer, unpackb
+
+# Batch codec spreading independent messages over a process pool:
+#
+#     frames = pack_many(records, workers=8)
+#     records = unpack_many(frames, workers=8)
+#
+# Inputs are cut into chunks (by default about four per worker, so a slow
+# chunk does not hold up the whole batch) and every chunk is one task: a
+# worker packs its chunk into a single blob plus the message lengths, which
+# pickle far cheaper than one bytes object per message. For unpack_many, when
+# the buffers add up to at least _SHARED_MEMORY_MIN_SIZE bytes they are copied
+# once into a multiprocessing.shared_memory block and workers only receive its
+# name and their (start, end) ranges; smaller batches are sent inline. Decoded
+# objects still travel back pickled, so unpack_many scales best on messages
+# that are costly to decode relative to their decoded size.
+#
+# workers defaults to os.cpu_count(); with one worker, or fewer messages than
+# _MIN_PARALLEL_ITEMS, the batch is processed in this process. An existing
+# concurrent.futures executor can be passed to avoid starting a pool per call.
+_MIN_PARALLEL_ITEMS = 256
+_CHUNKS_PER_WORKER = 4
+_SHARED_MEMORY_MIN_SIZE = 1024 * 1024
+
+def _pack_chunk(objs):
+    packer = Packer()
+    lengths = []
+    for obj in objs:
+        start = len(packer)
+        packer.pack(obj)
+        lengths.append(len(packer) - start)
+    return packer.bytes(), lengths
+
+def _unpack_chunk(source, bounds, numeric_arrays):
+    if isinstance(source, str):
+        from multiprocessing import shared_memory
+        block = shared_memory.SharedMemory(name=source)
+        try:
+            data = block.buf
+            objs = [unpackb(data[start:end], numeric_arrays) for start, end in bounds]
+            del data
+        finally:
+            block.close()
+        return objs
+    data = memoryview(source)
+    return [unpackb(data[start:end], numeric_arrays) for start, end in bounds]
+
+def _chunks(count, workers, chunk_size):
+    if chunk_size is None:
+        chunk_size = max(1, -(-count // (workers * _CHUNKS_PER_WORKER)))
+    return [(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+
+def _run(tasks, workers, executor):
+    if executor is not None:
+        return [future.result() for future in [executor.submit(*task) for task in tasks]]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [future.result() for future in [pool.submit(*task) for task in tasks]]
+
+def pack_many(objs, workers=None, chunk_size=None, executor=None):
+    objs = list(objs)
+    workers = workers or os.cpu_count() or 1
+    if executor is None and (workers <= 1 or len(objs) < _MIN_PARALLEL_ITEMS):
+        results = [_pack_chunk(objs)]
+    else:
+        tasks = [(_pack_chunk, objs[start:end]) for start, end in _chunks(len(objs), workers, chunk_size)]
+        results = _run(tasks, workers, executor)
+    packed = []
+    for blob, lengths in results:
+        offset = 0
+        for length in lengths:
+            packed.append(blob[offset:offset + length])
+            offset += length
+    return packed
+
+def unpack_many(buffers, workers=None, chunk_size=None, executor=None, numeric_arrays=None):
+    buffers = list(buffers)
+    workers = workers or os.cpu_count() or 1
+    if executor is None and (workers <= 1 or len(buffers) < _MIN_PARALLEL_ITEMS):
+        return [unpackb(data, numeric_arrays) for data in buffers]
+    bounds = []
+    offset = 0
+    for data in buffers:
+        length = memoryview(data).nbytes
+        bounds.append((offset, offset + length))
+        offset += length
+    chunks = _chunks(len(buffers), workers, chunk_size)
+    if offset < _SHARED_MEMORY_MIN_SIZE:
+        tasks = [(_unpack_chunk, b''.join(buffers[start:end]), _rebase(bounds[start:end]), numeric_arrays)
+                 for start, end in chunks]
+        results = _run(tasks, workers, executor)
+    else:
+        from multiprocessing import shared_memory
+        block = shared_memory.SharedMemory(create=True, size=offset)
+        try:
+            view = block.buf
+            for data, (start, end) in zip(buffers, bounds):
+                view[start:end] = memoryview(data).cast('B')
+            del view
+            tasks = [(_unpack_chunk, block.name, bounds[start:end], numeric_arrays) for start, end in chunks]
+            results = _run(tasks, workers, executor)
+        finally:
+            block.close()
+            block.unlink()
+    objs = []
+    for chunk in results:
+        objs += chunk
+    return objs
+
+# Shifts a run of (start, end) ranges so that the first one starts at 0.
+def _rebase(bounds):
+    base = bounds[0][0]
+    return [(start - base, end - base) for start, end in bounds]
@@ -0,0 +1,262 @@
+from collections import OrderedDict
+import operator
+import struct
+
+from MessagePackFormat import (
+    BoolFormat, UInt8Format, UInt16Format, UInt32Format, UInt64Format,
+    Int8Format, Int16Format, Int32Format, Int64Format, Float32Format, Float64Format,
+    FixStrFormat, Str8Format, Str16Format, Str32Format, Bin8Format, Bin16Format, Bin32Format,
+    FixMapFormat, Map16Format, Map32Format, Packer, packb, unpackb,
+)
+
+# Format class -> (lead byte, struct code of the payload) for fixed-width fields.
+_FIXED_FIELDS = {
+    UInt8Format: (0xcc, 'B'), UInt16Format: (0xcd, 'H'), UInt32Format: (0xce, 'I'), UInt64Format: (0xcf, 'Q'),
+    Int8Format: (0xd0, 'b'), Int16Format: (0xd1, 'h'), Int32Format: (0xd2, 'i'), Int64Format: (0xd3, 'q'),
+    Float32Format: (0xca, 'f'), Float64Format: (0xcb, 'd'),
+}
+
+# Format class -> (lead byte, struct code of the length, is str) for str/bin fields.
+_VARIABLE_FIELDS = {
+    Str8Format: (0xd9, 'B', True), Str16Format: (0xda, 'H', True), Str32Format: (0xdb, 'I', True),
+    Bin8Format: (0xc4, 'B', False), Bin16Format: (0xc5, 'H', False), Bin32Format: (0xc6, 'I', False),
+}
+
+def _int_check(low, high):
+    return lambda value: type(value) is int and low <= value <= high
+
+def _float32_check(value):
+    if type(value) is not float:
+        return False
+    try:
+        struct.pack('>f', value)
+    except OverflowError:
+        return False
+    return True
+
+def _payload_check(value_type, max_length):
+    if value_type is str:
+        return lambda value: type(value) is str and len(value.encode('utf-8')) <= max_length
+    return lambda value: type(value) is value_type and len(value) <= max_length
+
+# Format class -> predicate telling whether a value decoded by unpackb() is
+# one the field's Format class could have encoded.
+_FIELD_CHECKS = {
+    BoolFormat: lambda value: type(value) is bool,
+    UInt8Format: _int_check(0, 0xff), UInt16Format: _int_check(0, 0xffff),
+    UInt32Format: _int_check(0, 0xffffffff), UInt64Format: _int_check(0, 0xffffffffffffffff),
+    Int8Format: _int_check(-0x80, 0x7f), Int16Format: _int_check(-0x8000, 0x7fff),
+    Int32Format: _int_check(-0x80000000, 0x7fffffff),
+    Int64Format: _int_check(-0x8000000000000000, 0x7fffffffffffffff),
+    Float32Format: _float32_check, Float64Format: lambda value: type(value) is float,
+    Str8Format: _payload_check(str, 0xff), Str16Format: _payload_check(str, 0xffff),
+    Str32Format: _payload_check(str, 0xffffffff),
+    Bin8Format: _payload_check(bytes, 0xff), Bin16Format: _payload_check(bytes, 0xffff),
+    Bin32Format: _payload_check(bytes, 0xffffffff),
+}
+
+def _key_format(name):
+    length = len(name.encode('utf-8'))
+    if length <= 31:
+        return FixStrFormat(name)
+    elif length <= 0xff:
+        return Str8Format(name)
+    elif length <= 0xffff:
+        return Str16Format(name)
+    return Str32Format(name)
+
+# A run of fixed-width fields, optionally closed by one str/bin field whose
+# length goes into the run's struct and whose payload follows it. The constant
+# bytes in front of each value (map header, encoded key, lead byte) are '%ds'
+# fields of the same struct, so the struct's fields alternate constant, value,
+# constant, value...: packing a run is one pack() of the constants interleaved
+# with the values, and unpacking is one unpack_from() whose even fields are
+# checked against the schema and whose odd fields are the values.
+class _Segment:
+    def __init__(self):
+        self.fmt = '>'
+        self.args = []  # constants, with None in place of each value
+        self.count = 0  # fixed-width fields in the run
+        self.variable = None  # None, or True/False for a closing str/bin field
+        self._pending = b''
+
+    def add_constant(self, data):
+        self._pending += data
+
+    def add_value(self, code):
+        self.fmt += '%ds%s' % (len(self._pending), code)
+        self.args += [self._pending, None]
+        self._pending = b''
+
+    def compile(self):
+        self.fmt = struct.Struct(self.fmt)
+        self.expected = tuple(self.args[0::2])
+
+# Encoder/decoder for maps with a fixed set of keys and value types, compiled
+# once from the Format classes of the fields:
+#
+#     TELEMETRY = MessageSchema([
+#         ('id', UInt32Format), ('temp', Float64Format), ('ok', BoolFormat),
+#         ('name', Str8Format),
+#     ])
+#     data = TELEMETRY.pack({'id': 7, 'temp': 21.5, 'ok': True, 'name': 'probe'})
+#     TELEMETRY.unpack(data)
+#
+# The encoded map is the one to_format() would produce, keys in schema order.
+# When every field is fixed-width the whole message is a single struct, so a
+# message costs one struct pack()/unpack_from(). unpack() accepts any encoding
+# of the same map (e.g. ints packed in their smallest format) by falling back
+# to unpackb(), and raises ValueError when the keys do not match the schema or
+# a value is not one its field's Format class could encode (wrong type, or
+# out of the class's range or length).
+class MessageSchema:
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.names = tuple(name for name, _ in self.fields)
+        if not self.names:
+            raise ValueError("Schema has no fields")
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("Duplicate field name in schema")
+        self._key_set = frozenset(self.names)
+        if len(self.names) == 1:
+            name = self.names[0]
+            self._values_of = lambda obj: (obj[name],)
+        else:
+            self._values_of = operator.itemgetter(*self.names)
+        header = Packer()
+        header.pack_map_header(len(self.fields))
+        segment = _Segment()
+        segment.add_constant(header.bytes())
+        self._segments = [segment]
+        self._bool_indexes = []
+        for index, (name, cls) in enumerate(self.fields):
+            segment.add_constant(packb(name))
+            if cls in _FIXED_FIELDS:
+                lead_byte, code = _FIXED_FIELDS[cls]
+                segment.add_constant(bytes([lead_byte]))
+                segment.add_value(code)
+                segment.count += 1
+            elif cls is BoolFormat:
+                segment.add_value('B')
+                segment.count += 1
+                self._bool_indexes.append(index)
+            elif cls in _VARIABLE_FIELDS:
+                lead_byte, code, is_str = _VARIABLE_FIELDS[cls]
+                segment.add_constant(bytes([lead_byte]))
+                segment.add_value(code)
+                segment.variable = is_str
+                segment = _Segment()
+                self._segments.append(segment)
+            else:
+                raise ValueError("Unsupported schema field type %s" % cls.__name__)
+        if not segment.args:
+            self._segments.pop()
+        self._checks = tuple(_FIELD_CHECKS[cls] for _, cls in self.fields)
+        for segment in self._segments:
+            segment.compile()
+        self._fixed = len(self._segments) == 1 and not self._bool_indexes
+        self.size = self._segments[0].fmt.size if self._fixed else None
+
+    # Values are checked against the same predicates unpack() applies, so
+    # pack() never emits a message the schema would reject.
+    def pack(self, obj):
+        values = self._values_of(obj)
+        for name, check, value in zip(self.names, self._checks, values):
+            if not check(value):
+                raise ValueError("Field %r does not match schema" % name)
+        if self._fixed:
+            segment = self._segments[0]
+            args = segment.args[:]
+            args[1::2] = values
+            return segment.fmt.pack(*args)
+        return self._pack_segments(values)
+
+    def _pack_segments(self, values):
+        if self._bool_indexes:
+            values = list(values)
+            for index in self._bool_indexes:
+                values[index] = 0xc3 if values[index] else 0xc2
+        buf = bytearray()
+        index = 0
+        for segment in self._segments:
+            args = segment.args[:]
+            if segment.variable is None:
+                args[1::2] = values[index:index + segment.count]
+                index += segment.count
+                buf += segment.fmt.pack(*args)
+                continue
+            payload = values[index + segment.count]
+            if segment.variable:
+                payload = payload.encode('utf-8')
+            args[1::2] = (*values[index:index + segment.count], len(payload))
+            index += segment.count + 1
+            buf += segment.fmt.pack(*args)
+            buf += payload
+        return bytes(buf)
+
+    def unpack(self, data):
+        if self._fixed:
+            segment = self._segments[0]
+            if len(data) == segment.fmt.size:
+                fields = segment.fmt.unpack_from(data)
+                if fields[0::2] == segment.expected:
+                    return dict(zip(self.names, fields[1::2]))
+        else:
+            values = self._unpack_segments(memoryview(data))
+            if values is not None:
+                return dict(zip(self.names, values))
+        obj = unpackb(data)
+        if not isinstance(obj, dict) or obj.keys() != self._key_set:
+            raise ValueError("Message does not match schema")
+        for name, check in zip(self.names, self._checks):
+            if not check(obj[name]):
+                raise ValueError("Field %r does not match schema" % name)
+        return obj
+
+    # Returns the field values, or None when data is not in the compiled layout.
+    def _unpack_segments(self, data):
+        values = []
+        offset = 0
+        try:
+            for segment in self._segments:
+                fields = segment.fmt.unpack_from(data, offset)
+                if fields[0::2] != segment.expected:
+                    return None
+                offset += segment.fmt.size
+                if segment.variable is None:
+                    values += fields[1::2]
+                    continue
+                values += fields[1:-1:2]
+                end = offset + fields[-1]
+                if end > len(data):
+                    return None
+                if segment.variable:
+                    values.append(str(data[offset:end], 'utf-8'))
+                else:
+                    values.append(bytes(data[offset:end]))
+                offset = end
+        except struct.error:
+            return None
+        if offset != len(data):
+            return None
+        for index in self._bool_indexes:
+            if values[index] == 0xc3:
+                values[index] = True
+            elif values[index] == 0xc2:
+                values[index] = False
+            else:
+                return None
+        return values
+
+    # Builds the equivalent Format tree, e.g. to mix schema messages into
+    # containers encoded through the class hierarchy.
+    def to_format(self, obj):
+        values = self._values_of(obj)
+        items = OrderedDict()
+        for (name, cls), value in zip(self.fields, values):
+            items[_key_format(name)] = cls(value)
+        if len(items) <= 15:
+            return FixMapFormat(items)
+        elif len(items) <= 0xffff:
+            return Map16Format(items)
+        return Map32Format(items)
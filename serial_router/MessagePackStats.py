@@ -0,0 +1,321 @@
+import time
+
+import MessagePackFormat as codec
+
+# Opt-in codec instrumentation:
+#
+#     stats = enable_stats()
+#     ...  # normal traffic
+#     disable_stats()
+#     print(stats.summary())
+#
+# Nothing in the codec checks whether stats are on. enable_stats() swaps
+# counting wrappers into the decode dispatch tables (the Format-class table
+# behind from_bytes_with_size/from_buffer and nested values, and every
+# unpackb/Unpacker table), into unpackb_limited(), into the from_buffer()/
+# to_bytes()/write_to() of the Format classes, into Packer.pack, into the
+# pack_into() writer and into the key cache; disable_stats() puts the originals
+# back. packed_size() is not an encode, so nothing it calls is counted. While enabled, bulk
+# decoding of numeric runs is switched off so that every element is counted.
+#
+# Counted per object, nested ones included: the lead byte (encoded_types and
+# decoded_types, indexed by lead byte) and, for arrays and maps, the nesting
+# depth they occur at (encode_depths/decode_depths, depth -> count). Counted
+# per top-level object: bytes_encoded and bytes_decoded, and the optional
+# timing_callback(direction, lead_byte, size, seconds) with direction
+# 'encode' or 'decode'.
+class CodecStats:
+    def __init__(self, timing_callback=None):
+        self.timing_callback = timing_callback
+        self.encoded_types = [0] * 256
+        self.decoded_types = [0] * 256
+        self.bytes_encoded = 0
+        self.bytes_decoded = 0
+        self.encode_depths = {}
+        self.decode_depths = {}
+        self._encode_depth = 0
+        self._decode_depth = 0
+        self._sizing = False
+
+    def reset(self):
+        self.__init__(self.timing_callback)
+
+    # Counts aggregated by Format class name, most frequent first.
+    def summary(self):
+        return {
+            'encoded': _by_name(self.encoded_types),
+            'decoded': _by_name(self.decoded_types),
+            'bytes_encoded': self.bytes_encoded,
+            'bytes_decoded': self.bytes_decoded,
+            'encode_depths': dict(sorted(self.encode_depths.items())),
+            'decode_depths': dict(sorted(self.decode_depths.items())),
+        }
+
+    def _encoded(self, lead_byte, depth, size, start_time):
+        if self._sizing:
+            return
+        self.encoded_types[lead_byte] += 1
+        if lead_byte in _CONTAINER_LEAD_BYTES:
+            self.encode_depths[depth] = self.encode_depths.get(depth, 0) + 1
+        if depth == 0:
+            self.bytes_encoded += size
+            if self.timing_callback is not None:
+                self.timing_callback('encode', lead_byte, size, time.perf_counter() - start_time)
+
+def _lead_byte_names():
+    names = []
+    for decoder in codec._FORMAT_DECODERS:
+        if decoder is codec._decode_ext_format:
+            names.append('ExtFormat')
+        elif decoder is codec._unknown_format:
+            names.append(None)
+        else:
+            names.append(decoder.__qualname__.split('.')[0])
+    return names
+
+_LEAD_BYTE_NAMES = _lead_byte_names()
+_CONTAINER_LEAD_BYTES = frozenset(list(range(0x80, 0xa0)) + [0xdc, 0xdd, 0xde, 0xdf])
+_CONTAINER_CLASSES = (
+    codec.FixArrayFormat, codec.Array16Format, codec.Array32Format,
+    codec.FixMapFormat, codec.Map16Format, codec.Map32Format,
+)
+
+def _by_name(counts):
+    totals = {}
+    for lead_byte, count in enumerate(counts):
+        if count:
+            name = _LEAD_BYTE_NAMES[lead_byte] or f"0x{lead_byte:02x}"
+            totals[name] = totals.get(name, 0) + count
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+_stats = None
+_restore = []  # callables undoing each patch, in the order applied
+
+def get_stats():
+    return _stats
+
+def enable_stats(timing_callback=None):
+    global _stats
+    if _stats is not None:
+        disable_stats()
+    stats = _stats = CodecStats(timing_callback)
+    _instrument_decoder_table(stats, codec._FORMAT_DECODERS)
+    for table in codec._UNPACKER_TABLES:
+        _instrument_decoder_table(stats, table)
+    _patch(codec, '_instrument_table', lambda table: _instrument_decoder_table(stats, table))
+    _patch(codec, '_BULK_MIN_RUN', float('inf'))
+    for cls in _format_classes():
+        if 'from_buffer' in cls.__dict__:
+            _patch(cls, 'from_buffer', _counting_from_buffer(stats, cls.from_buffer))
+        if cls in _CONTAINER_CLASSES:
+            _patch(cls, 'write_to', _counting_write_to(stats, cls.write_to))
+            continue
+        if 'to_bytes' in cls.__dict__:
+            _patch(cls, 'to_bytes', _counting_to_bytes(stats, cls.to_bytes))
+        if 'write_to' in cls.__dict__:
+            _patch(cls, 'write_to', _counting_write_to(stats, cls.write_to))
+    _patch(codec.Packer, 'pack', _counting_pack(stats, codec.Packer.pack))
+    _patch(codec, '_fill', _counting_fill(stats, codec._fill))
+    _patch(codec, 'packed_size', _uncounted_size(stats, codec.packed_size))
+    _patch(codec, '_unpackb_limited', _counting_limited(stats, codec._unpackb_limited))
+    _patch(codec, '_encoded_key', _counting_key(stats, codec._encoded_key))
+    return stats
+
+def disable_stats():
+    global _stats
+    while _restore:
+        _restore.pop()()
+    stats, _stats = _stats, None
+    return stats
+
+def _patch(owner, name, value):
+    original = vars(owner)[name]  # as stored, so staticmethods are put back as such
+    setattr(owner, name, value)
+    _restore.append(lambda: setattr(owner, name, original))
+
+# Every concrete Format class. The base class is left alone: its write_to()
+# calls to_bytes(), which is counted already.
+def _format_classes():
+    classes = []
+    pending = codec.MessagePackFormat.__subclasses__()
+    while pending:
+        cls = pending.pop()
+        classes.append(cls)
+        pending += cls.__subclasses__()
+    return classes
+
+def _instrument_decoder_table(stats, table):
+    original = table[:]
+    for lead_byte, decoder in enumerate(original):
+        if decoder is not codec._unknown_format:
+            table[lead_byte] = _counting_decoder(stats, decoder, lead_byte)
+    def restore():
+        table[:] = original
+    _restore.append(restore)
+
+def _counting_decoder(stats, decoder, lead_byte):
+    container = lead_byte in _CONTAINER_LEAD_BYTES
+    def decode(data, offset):
+        depth = stats._decode_depth
+        stats.decoded_types[lead_byte] += 1
+        if container:
+            stats.decode_depths[depth] = stats.decode_depths.get(depth, 0) + 1
+        if depth:
+            stats._decode_depth = depth + 1
+            try:
+                return decoder(data, offset)
+            finally:
+                stats._decode_depth = depth
+        start_time = time.perf_counter()
+        stats._decode_depth = 1
+        try:
+            result = decoder(data, offset)
+        finally:
+            stats._decode_depth = 0
+        size = result[1] - offset
+        stats.bytes_decoded += size
+        if stats.timing_callback is not None:
+            stats.timing_callback('decode', lead_byte, size, time.perf_counter() - start_time)
+        return result
+    return decode
+
+# unpackb_limited() decodes scalars through an instrumented table but builds
+# containers itself: scalars are counted there as nested values, containers
+# are counted here by walking the headers of the decoded message, and the
+# message itself is the top-level object.
+def _counting_limited(stats, unpackb_limited):
+    def counted(data, *args):
+        depth = stats._decode_depth
+        start_time = time.perf_counter()
+        stats._decode_depth = depth + 1
+        try:
+            value = unpackb_limited(data, *args)
+        finally:
+            stats._decode_depth = depth
+        data = memoryview(data)
+        _count_containers(stats, data, depth)
+        if depth == 0:
+            stats.bytes_decoded += len(data)
+            if stats.timing_callback is not None:
+                stats.timing_callback('decode', data[0], len(data), time.perf_counter() - start_time)
+        return value
+    return counted
+
+def _count_containers(stats, data, depth):
+    pending = []  # elements still expected by each open container
+    offset = 0
+    while True:
+        first_byte = data[offset]
+        read_length = codec._LENGTH_READERS[first_byte]
+        items = codec._ITEMS_PER_LENGTH[first_byte]
+        if items:
+            stats.decoded_types[first_byte] += 1
+            level = depth + len(pending)
+            stats.decode_depths[level] = stats.decode_depths.get(level, 0) + 1
+            length = read_length(data, offset)
+            offset += codec._HEADER_SIZES[first_byte]
+            if length:
+                pending.append(length * items)
+                continue
+        elif read_length is None:
+            offset += codec._HEADER_SIZES[first_byte]
+        else:
+            offset += codec._HEADER_SIZES[first_byte] + read_length(data, offset)
+        while pending:
+            pending[-1] -= 1
+            if pending[-1]:
+                break
+            pending.pop()
+        else:
+            return
+
+# Typed entry points (SomeFormat.from_bytes()/from_buffer()) decode the
+# top-level object without going through the dispatch table, so it is counted
+# here. Nested values, and ext classes reached from the table, are already
+# counted by the table and pass straight through.
+def _counting_from_buffer(stats, from_buffer):
+    def decode(data, offset=0):
+        if stats._decode_depth:
+            return from_buffer(data, offset)
+        return _counting_decoder(stats, from_buffer, data[offset])(data, offset)
+    return staticmethod(decode)
+
+def _counting_to_bytes(stats, to_bytes):
+    def counted(self):
+        depth = stats._encode_depth
+        start_time = time.perf_counter()
+        data = to_bytes(self)
+        stats._encoded(data[0], depth, len(data), start_time)
+        return data
+    return counted
+
+def _counting_write_to(stats, write_to):
+    def counted(self, packer):
+        depth = stats._encode_depth
+        start_time = time.perf_counter()
+        start = len(packer)
+        stats._encode_depth = depth + 1
+        try:
+            write_to(self, packer)
+        finally:
+            stats._encode_depth = depth
+        stats._encoded(packer._buffer[start], depth, len(packer) - start, start_time)
+    return counted
+
+def _counting_pack(stats, pack):
+    def counted(self, obj):
+        if isinstance(obj, codec.MessagePackFormat):
+            return pack(self, obj)
+        depth = stats._encode_depth
+        start_time = time.perf_counter()
+        start = len(self)
+        stats._encode_depth = depth + 1
+        try:
+            pack(self, obj)
+        finally:
+            stats._encode_depth = depth
+        stats._encoded(self._buffer[start], depth, len(self) - start, start_time)
+    return counted
+
+# pack_into() lays objects out with _fill(), which recurses through the module
+# global, so the patched one sees nested values too. Format instances are
+# counted by their own to_bytes().
+def _counting_fill(stats, fill):
+    def counted(buffer, offset, obj):
+        if isinstance(obj, codec.MessagePackFormat):
+            return fill(buffer, offset, obj)
+        depth = stats._encode_depth
+        start_time = time.perf_counter()
+        stats._encode_depth = depth + 1
+        try:
+            end = fill(buffer, offset, obj)
+        finally:
+            stats._encode_depth = depth
+        stats._encoded(buffer[offset], depth, end - offset, start_time)
+        return end
+    return counted
+
+# Format.packed_size() falls back to to_bytes(), which would otherwise count
+# the sizing pass of pack_into() as a second encode.
+def _uncounted_size(stats, packed_size):
+    def sized(obj):
+        sizing = stats._sizing
+        stats._sizing = True
+        try:
+            return packed_size(obj)
+        finally:
+            stats._sizing = sizing
+    return sized
+
+# Map keys served by the key cache never reach to_bytes()/pack(); on a miss
+# the cache encodes the key through them, so only hits are counted here. Keys
+# are always written inside a map, so a hit is only counted as a nested value.
+def _counting_key(stats, encoded_key):
+    def counted(value, cls=None):
+        misses = encoded_key.cache_info().misses
+        data = encoded_key(value) if cls is None else encoded_key(value, cls)
+        depth = stats._encode_depth
+        if depth and encoded_key.cache_info().misses == misses:
+            stats._encoded(data[0], depth, len(data), None)
+        return data
+    return counted
@@ -0,0 +1,102 @@
+import asyncio
+
+from MessagePackFormat import Packer, Unpacker
+
+_NOTHING = object()
+
+# asyncio front ends for moving MessagePack objects over any StreamReader/
+# StreamWriter pair (TCP, a pty or serial port wrapped with connect_read_pipe,
+# ...), so a single event loop can serve many links without a thread each:
+#
+#     reader, writer = await open_connection('127.0.0.1', 5555)
+#     writer.write({'cmd': 'start'})
+#     async for obj in reader:
+#         await writer.send(route(obj))
+#
+# MessagePackReader feeds whatever bytes arrive into an Unpacker, so objects
+# are decoded as soon as their last byte is in, however they were split into
+# reads. read() raises EOFError at the end of the stream, or ValueError when
+# the stream ends inside an object; async iteration just stops at the end.
+# limits are passed to the Unpacker for links to untrusted peers.
+class MessagePackReader:
+    def __init__(self, reader, read_size=64 * 1024, max_buffer_size=16 * 1024 * 1024, limits=None):
+        self._reader = reader
+        self.read_size = read_size
+        self._unpacker = Unpacker(max_buffer_size, limits)
+
+    async def read(self):
+        while True:
+            obj = next(self._unpacker, _NOTHING)
+            if obj is not _NOTHING:
+                return obj
+            chunk = await self._reader.read(self.read_size)
+            if not chunk:
+                if self._unpacker.buffered():
+                    raise ValueError("Truncated object")
+                raise EOFError("End of stream")
+            self._unpacker.feed(chunk)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.read()
+        except EOFError:
+            raise StopAsyncIteration
+
+# write() packs into a pending buffer and returns at once; everything written
+# during one pass of the event loop goes to the transport as a single write at
+# the end of that pass, or as soon as the buffer reaches flush_size. send() and
+# drain() flush and then wait on StreamWriter.drain(), which blocks while the
+# transport's own buffer is above its high-water mark, so producers that await
+# them are held back by a slow link instead of growing memory without bound.
+# Once the transport is closing, write() raises ConnectionResetError and
+# whatever was still pending is discarded.
+class MessagePackWriter:
+    def __init__(self, writer, flush_size=64 * 1024):
+        self._writer = writer
+        self.flush_size = flush_size
+        self._packer = Packer()
+        self._flush_scheduled = False
+
+    def write(self, obj):
+        if self._writer.is_closing():
+            raise ConnectionResetError("Connection is closing")
+        self._packer.pack(obj)
+        if len(self._packer) >= self.flush_size:
+            self.flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self._flush_scheduled = False
+        if len(self._packer):
+            if not self._writer.is_closing():
+                self._writer.write(self._packer.bytes())
+            self._packer.reset()
+
+    async def drain(self):
+        self.flush()
+        await self._writer.drain()
+
+    async def send(self, obj):
+        self.write(obj)
+        await self.drain()
+
+    async def close(self):
+        self.flush()
+        self._writer.close()
+        await self._writer.wait_closed()
+
+async def open_connection(host=None, port=None, **kwargs):
+    reader, writer = await asyncio.open_connection(host, port, **kwargs)
+    return MessagePackReader(reader), MessagePackWriter(writer)
+
+# Serves each incoming connection as client_connected(reader, writer) with
+# MessagePackReader/MessagePackWriter wrappers.
+async def start_server(client_connected, host=None, port=None, **kwargs):
+    async def connected(reader, writer):
+        await client_connected(MessagePackReader(reader), MessagePackWriter(writer))
+    return await asyncio.start_server(connected, host, port, **kwargs)
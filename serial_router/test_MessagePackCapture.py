@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from MessagePackCapture import CaptureReader
+from MessagePackFormat import Timestamp, packb, unpackb
+
+class CaptureIndexTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'a.cap')
+
+    def write(self, records, mode='wb'):
+        with open(self.path, mode) as capture:
+            for record in records:
+                capture.write(record if isinstance(record, bytes) else packb(record))
+
+    def open(self, timestamp_key='t', index_path=None):
+        return CaptureReader(self.path, timestamp_key=timestamp_key, index_path=index_path)
+
+    def test_index_and_reopen(self):
+        self.write({'t': 1000.0 + i * 0.5, 'seq': i, 'pad': 'x' * (i % 40)} for i in range(1000))
+        for _ in range(2):
+            with self.open() as capture:
+                self.assertEqual(len(capture), 1000)
+                self.assertEqual(capture[123]['seq'], 123)
+                self.assertEqual(capture[-1]['seq'], 999)
+                self.assertEqual(capture.time_range(1050, 1055), list(range(100, 110)))
+                self.assertEqual([r['seq'] for r in capture.records_between(1000, 1001)], [0, 1])
+                self.assertEqual(unpackb(capture.raw(5))['seq'], 5)
+
+    def test_append_and_partial_record(self):
+        self.write({'t': i, 'seq': i} for i in range(10))
+        with self.open() as capture:
+            self.assertEqual(len(capture), 10)
+        self.write([{'t': Timestamp(100), 'seq': 10}, {'seq': 11}, packb({'t': 5, 'seq': 12})[:-2]], 'ab')
+        with self.open() as capture:
+            self.assertEqual(len(capture), 12)
+            self.assertEqual(capture.time_range(99, 101), [10])
+        with self.open(['seq']) as capture:
+            self.assertEqual(capture.time_range(-5, 3), [0, 1, 2])
+        with self.open(None) as capture:
+            with self.assertRaises(ValueError):
+                capture.time_range(0, 1)
+
+    def test_rewritten_capture_rebuilds_index(self):
+        self.write({'t': i, 'v': i * 2} for i in range(3))
+        with self.open() as capture:
+            self.assertEqual(capture.time_range(0, 2), [0, 1])
+        self.write({'t': 1000 + i, 'v': i * 2} for i in range(3))
+        with self.open() as capture:
+            self.assertEqual(capture.time_range(1000, 1002), [0, 1])
+            self.assertEqual(capture.time_range(0, 2), [])
+
+    def test_unwritable_index_stays_in_memory(self):
+        self.write({'t': i, 'seq': i} for i in range(100))
+        index_path = os.path.join(os.path.dirname(self.path), 'missing', 'a.cap.idx')
+        for _ in range(2):
+            with self.open(index_path=index_path) as capture:
+                self.assertEqual(len(capture), 100)
+                self.assertEqual(capture[-1]['seq'], 99)
+                self.assertEqual(capture.time_range(10, 13), [10, 11, 12])
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['a.cap'])
+
+    def test_index_write_failure_leaves_no_temporary_file(self):
+        self.write({'t': i} for i in range(10))
+        with self.open() as capture:
+            self.assertEqual(len(capture), 10)
+        self.write([{'t': 10}], 'ab')
+        with mock.patch('os.replace', side_effect=OSError("No space left on device")):
+            capture = self.open()
+        with capture:
+            self.assertEqual(len(capture), 11)
+            self.assertEqual(capture.time_range(10, 11), [10])
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.path))), ['a.cap', 'a.cap.idx'])
+
+    def test_close_with_live_view(self):
+        self.write([{'t': 1}])
+        capture = self.open()
+        view = capture.raw(0)
+        capture.close()
+        self.assertTrue(capture._file.closed)
+        self.assertEqual(unpackb(view), {'t': 1})
+        view.release()
+
+    def test_empty_capture(self):
+        self.write([])
+        with self.open(None) as capture:
+            self.assertEqual(len(capture), 0)
+            self.assertEqual(list(capture), [])
+
+if __name__ == '__main__':
+    unittest.main()
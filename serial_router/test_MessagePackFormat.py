@@ -0,0 +1,587 @@
+import array
+import struct
+import sys
+import unittest
+
+import MessagePackFormat as codec
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from MessagePackFormat import (
+    MessagePackFormat, NilFormat, BoolFormat, FixIntFormat, UInt8Format, UInt16Format, UInt32Format, UInt64Format,
+    Int8Format, Int16Format, Int32Format, Int64Format, Float32Format, Float64Format,
+    FixStrFormat, Str8Format, Str16Format, Bin8Format, Bin16Format,
+    FixArrayFormat, Array16Format, Map16Format, ExtFormat, TypedArrayFormat, Unpacker, ArrayView, MapView, packb, unpackb, skip, split, extract, PathQuery,
+    key_cache_info, set_key_cache_size, register_ext_type, Timestamp, unpackb_limited,
+    packed_size, pack_into,
+)
+
+DEPTH = 50
+WIDTH = 40
+TRAILING = (b'', b'\xc0', b'\x01\x02\x03', b'\xdc\x00\x10')
+NATIVE_BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+def typed_leaves(level):
+    leaves = [
+        UInt8Format(200), UInt16Format(300 + level), UInt32Format(70000 + level), UInt64Format(2 ** 40 + level),
+        Int8Format(-100), Int16Format(-1000 - level), Int32Format(-70000), Int64Format(-2 ** 40),
+        Float32Format(1.5), Float64Format(level / 3), FixStrFormat('lvl%d' % level), Str8Format('é' * 40),
+        Str16Format('x' * 300), Bin8Format(bytes([level]) * 10), Bin16Format(bytes(300)),
+        NilFormat(), BoolFormat(True), FixIntFormat(-3),
+    ]
+    return [leaves[i % len(leaves)] for i in range(WIDTH)]
+
+# Arrays and maps alternate with the nesting level; every level holds WIDTH
+# leaves and the next level as its last element.
+def typed_tree(level=0):
+    leaves = typed_leaves(level)
+    child = typed_tree(level + 1) if level < DEPTH else FixArrayFormat([FixIntFormat(1)])
+    if level % 2:
+        items = {FixStrFormat('k%d' % i): leaf for i, leaf in enumerate(leaves)}
+        items[Str8Format('child-of-level-%d' % level)] = child
+        return Map16Format(items)
+    return Array16Format(leaves + [child])
+
+def plain_leaves(level):
+    leaves = [
+        200, 300 + level, 70000 + level, 2 ** 40 + level, 2 ** 64 - 1, -100, -1000 - level, -70000, -2 ** 40,
+        -2 ** 63, 1.5, level / 3, 'lvl%d' % level, 'é' * 40, 'x' * 300, 'ü' * 70000 if level == 0 else '',
+        bytes([level]) * 10, bytes(300), None, True, False, -3, 127,
+    ]
+    return [leaves[i % len(leaves)] for i in range(WIDTH)]
+
+def plain_tree(level=0):
+    leaves = plain_leaves(level)
+    child = plain_tree(level + 1) if level < DEPTH else [1]
+    if level % 2:
+        items = {'k%d' % i: leaf for i, leaf in enumerate(leaves)}
+        items[level] = child
+        return items
+    return leaves + [child]
+
+# Plain values of a Format tree, for comparing decoded trees with built ones.
+def plain(value):
+    if isinstance(value, NilFormat):
+        return None
+    if isinstance(value, ExtFormat):
+        return value.type, bytes(value.data)
+    if isinstance(value, MessagePackFormat):
+        value = value.value
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return {plain(key): plain(item) for key, item in value.items()}
+    return value
+
+class NestedRoundTripTest(unittest.TestCase):
+    def test_typed_round_trip(self):
+        tree = typed_tree()
+        encoded = tree.to_bytes()
+        for trailing in TRAILING:
+            value, size = MessagePackFormat.from_bytes_with_size(encoded + trailing)
+            self.assertEqual(size, len(encoded))
+            self.assertEqual(plain(value), plain(tree))
+        self.assertEqual(plain(Array16Format.from_bytes(encoded)), plain(tree))
+
+    def test_packb_round_trip(self):
+        tree = plain_tree()
+        encoded = packb(tree)
+        self.assertEqual(unpackb(encoded), tree)
+        for trailing in TRAILING:
+            self.assertEqual(MessagePackFormat.from_bytes_with_size(encoded + trailing)[1], len(encoded))
+
+    def test_typed_and_plain_encodings_decode_alike(self):
+        tree = typed_tree()
+        self.assertEqual(unpackb(tree.to_bytes()), plain(tree))
+        self.assertEqual(unpackb(packb(tree)), plain(tree))
+
+class PlainCodecTest(unittest.TestCase):
+    def test_scalars(self):
+        for value in (None, True, False, 0, 127, -32, -33, 255, 256, 2 ** 32, 2 ** 64 - 1, -2 ** 63, 0.5, '', 'é',
+                      'x' * 32, 'x' * 256, 'x' * 65536, b'', bytes(256), bytes(65536), [], {}, {1: [None]}):
+            self.assertEqual(unpackb(packb(value)), value)
+        self.assertEqual(unpackb(packb((1, 2))), [1, 2])
+        self.assertEqual(packb(2 ** 64 - 1), b'\xcf' + b'\xff' * 8)
+
+    def test_errors(self):
+        for value in (2 ** 64, -2 ** 63 - 1):
+            with self.assertRaisesRegex(ValueError, 'Integer value out of range'):
+                packb(value)
+        with self.assertRaises(TypeError):
+            packb(object())
+
+    def test_truncated_input(self):
+        for data in (b'', packb([1, 2, 3, 'abcdef'])[:-2], packb('x' * 40)[:-3], b'\xdc\x00', b'\xcd\x01'):
+            with self.assertRaisesRegex(ValueError, 'Truncated object'):
+                unpackb(data)
+        with self.assertRaisesRegex(ValueError, 'Extra data'):
+            unpackb(packb(1) + b'\x00')
+
+class UnpackerTest(unittest.TestCase):
+    def test_chunked_feeds(self):
+        objs = [plain_tree(DEPTH - 10), 1, 'x' * 300, {'a': [1, 2, {'b': b'z' * 70000}]}, [], 2.5]
+        stream = b''.join(packb(obj) for obj in objs)
+        for chunk_size in (1, 7, 4096, len(stream)):
+            unpacker = Unpacker()
+            received = []
+            for start in range(0, len(stream), chunk_size):
+                unpacker.feed(stream[start:start + chunk_size])
+                received += unpacker
+            self.assertEqual(received, objs)
+            self.assertEqual(unpacker.buffered(), 0)
+
+    def test_partial_object_stays_buffered(self):
+        unpacker = Unpacker()
+        unpacker.feed(packb([1, 2, 3])[:-1])
+        self.assertEqual(list(unpacker), [])
+        self.assertEqual(unpacker.buffered(), 3)
+        unpacker.feed(b'\x03')
+        self.assertEqual(list(unpacker), [[1, 2, 3]])
+
+    def test_invalid_lead_byte_is_dropped(self):
+        unpacker = Unpacker()
+        unpacker.feed(b'\xc1' + packb(1) + b'\x92\x01\xc1' + packb(2))
+        with self.assertRaisesRegex(ValueError, 'Unknown format'):
+            next(unpacker)
+        self.assertEqual(next(unpacker), 1)
+        with self.assertRaisesRegex(ValueError, 'Unknown format'):
+            next(unpacker)
+        self.assertEqual(list(unpacker), [2])
+
+    def test_max_buffer_size(self):
+        unpacker = Unpacker(max_buffer_size=10)
+        with self.assertRaisesRegex(ValueError, 'buffer is full'):
+            unpacker.feed(bytes(11))
+
+class TypedArrayTest(unittest.TestCase):
+    def test_round_trip_every_typecode(self):
+        for typecode in 'bBhHiIqQfd':
+            values = array.array(typecode, [0, 1, 2, 100] if typecode.isupper() else [0, -1, 2, -100])
+            encoded = TypedArrayFormat.from_array(values).to_bytes()
+            decoded, size = MessagePackFormat.from_bytes_with_size(encoded + b'\xc0')
+            self.assertIsInstance(decoded, TypedArrayFormat)
+            self.assertEqual(size, len(encoded))
+            self.assertEqual(decoded.typecode, typecode)
+            self.assertEqual(decoded.byte_order, NATIVE_BYTE_ORDER)
+            self.assertEqual(decoded.to_array().tolist(), values.tolist())
+
+    def test_decoding_shares_the_payload(self):
+        encoded = TypedArrayFormat.from_array(array.array('d', range(100))).to_bytes()
+        decoded = TypedArrayFormat.from_bytes(encoded)
+        self.assertIsInstance(decoded.data, memoryview)
+        self.assertIsInstance(decoded.to_array(), memoryview)
+
+    def test_foreign_byte_order(self):
+        swapped = array.array('i', [1, -2, 70000])
+        swapped.byteswap()
+        foreign = '>' if NATIVE_BYTE_ORDER == '<' else '<'
+        typed = TypedArrayFormat(b'i' + foreign.encode() + swapped.tobytes())
+        decoded = TypedArrayFormat.from_bytes(typed.to_bytes())
+        self.assertEqual(decoded.byte_order, foreign)
+        self.assertEqual(decoded.to_array(), array.array('i', [1, -2, 70000]))
+
+    def test_unsupported_element_type(self):
+        with self.assertRaises(ValueError):
+            TypedArrayFormat.from_array(array.array('u', 'ab'))
+        with self.assertRaises(ValueError):
+            TypedArrayFormat.from_bytes(ExtFormat(5, b'i<').to_bytes())
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        for dtype in ('<i4', '>i4', '<f8', '>u2'):
+            values = numpy.arange(10).astype(dtype)
+            decoded = TypedArrayFormat.from_bytes(TypedArrayFormat.from_array(values).to_bytes())
+            self.assertEqual(decoded.to_numpy().tolist(), values.tolist())
+        values = numpy.arange(20, dtype='f4')[::2]
+        self.assertEqual(TypedArrayFormat.from_array(values).to_numpy().tolist(), values.tolist())
+
+class BulkDecodeTest(unittest.TestCase):
+    def test_runs_decode_like_single_elements(self):
+        values = [300] * 40 + [-5] * 20 + [1.5] * 17 + list(range(100)) + ['x', 2 ** 40, -2 ** 40] * 10 + [0.25] * 16
+        encoded = packb(values)
+        self.assertEqual(unpackb(encoded), values)
+        self.assertEqual(unpackb(encoded, numeric_arrays='array'), values)
+        self.assertEqual(plain(Array16Format.from_bytes(encoded)), values)
+        self.assertEqual(unpackb(packb([-2] * 16), numeric_arrays='array'), [-2] * 16)
+
+    def test_numeric_arrays_array(self):
+        for values, typecode in (([1.5] * 100, 'd'), (list(range(100)), 'B'), ([70000] * 20, 'I'), ([-100] * 16, 'b'), ([-2 ** 40] * 16, 'q')):
+            decoded = unpackb(packb(values), numeric_arrays='array')
+            self.assertIsInstance(decoded, array.array)
+            self.assertEqual(decoded.typecode, typecode)
+            self.assertEqual(decoded.tolist(), values)
+        self.assertIsInstance(unpackb(packb([1.5] * 100)), list)
+        self.assertIsInstance(unpackb(packb([1.5] * 100 + ['x']), numeric_arrays='array'), list)
+        self.assertIsInstance(unpackb(packb([1.5] * 15), numeric_arrays='array'), list)
+        with self.assertRaises(ValueError):
+            unpackb(packb([1]), numeric_arrays='list')
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numeric_arrays_numpy(self):
+        decoded = unpackb(packb([1.5] * 100), numeric_arrays='numpy')
+        self.assertIsInstance(decoded, numpy.ndarray)
+        self.assertEqual(decoded.tolist(), [1.5] * 100)
+
+class ViewTest(unittest.TestCase):
+    def test_lazy_access(self):
+        message = {'id': 7, 'sensors': [{'temp': 20.5}, {'temp': 21.5, 'tags': ['a', 'b']}], 'blob': bytes(300)}
+        encoded = packb(message)
+        view = MapView(encoded)
+        self.assertEqual(len(view), 3)
+        self.assertEqual(view['id'], 7)
+        sensors = view['sensors']
+        self.assertIsInstance(sensors, ArrayView)
+        self.assertEqual(len(sensors), 2)
+        self.assertEqual(sensors[-1]['temp'], 21.5)
+        self.assertEqual(list(sensors[1]['tags']), ['a', 'b'])
+        self.assertEqual(sorted(view), ['blob', 'id', 'sensors'])
+        with self.assertRaises(KeyError):
+            view['missing']
+        with self.assertRaises(IndexError):
+            sensors[2]
+        with self.assertRaises(ValueError):
+            ArrayView(encoded)
+
+    def test_raw_bytes(self):
+        items = [1, 'two', [3, {'four': 4}], b'five']
+        encoded = packb(items) + b'\xc0'
+        view = ArrayView(encoded)
+        self.assertEqual(bytes(view.raw()), packb(items))
+        for index, item in enumerate(items):
+            self.assertEqual(bytes(view.raw_item(index)), packb(item))
+            self.assertEqual(bytes(view.raw_item(index - len(items))), packb(item))
+        for index in (len(items), -len(items) - 1):
+            with self.assertRaisesRegex(IndexError, 'out of range'):
+                view.raw_item(index)
+        mapping = view[2][1]
+        self.assertEqual(bytes(mapping.raw()), packb({'four': 4}))
+        self.assertEqual(bytes(mapping.raw_value('four')), packb(4))
+
+    def test_packing_forwards_raw_bytes(self):
+        encoded = packb({'a': [1, 2, 3], 'b': {'c': 'd'}})
+        view = MapView(encoded)
+        self.assertEqual(packb(view), encoded)
+        self.assertEqual(unpackb(packb({'x': view['a'], 'y': view['b']})), {'x': [1, 2, 3], 'y': {'c': 'd'}})
+
+class LimitedDecodeTest(unittest.TestCase):
+    def test_same_objects_as_unpackb(self):
+        samples = [
+            None, True, 1, -5, 2 ** 40, 1.5, 'abc', 'x' * 300, b'bin', [], {}, [1, [2, [3, {}]]],
+            {'a': {'b': [1, 2, {'c': None}]}, 5: 'int'}, [1.5] * 100, Timestamp(7), array.array('f', [1, 2]),
+        ]
+        for value in samples:
+            encoded = packb(value)
+            self.assertEqual(unpackb_limited(encoded), unpackb(encoded))
+        self.assertEqual(unpackb_limited(packb(plain_tree()), max_depth=DEPTH + 2), plain_tree())
+
+    def test_limits(self):
+        cases = [
+            (b'\x91' * 100 + b'\xc0', {}, 'max_depth'),
+            (packb(plain_tree()), {'max_depth': DEPTH}, 'max_depth'),
+            (b'\xdd\xff\xff\xff\xff' + b'\xc0' * 10, {}, 'max_elements'),
+            (packb([1] * 100), {'max_elements': 50}, 'max_elements'),
+            (packb('x' * 100), {'max_str_len': 10}, 'length limit'),
+            (packb(bytes(100)), {'max_bin_len': 10}, 'length limit'),
+            (packb(ExtFormat(1, bytes(100))), {'max_ext_len': 10}, 'length limit'),
+            (packb([1] * 100), {'max_bytes': 50}, 'max_bytes'),
+            (b'\xde\x00\x10\x01', {}, 'Declared length'),
+            (packb('hello')[:-1], {}, 'Truncated'),
+            (b'\xcd\x01', {}, 'Truncated'),
+            (packb(1) + b'\x00', {}, 'Extra data'),
+            (b'\xc1', {}, 'Unknown format'),
+            (b'\x81\x91\x01\x02', {}, 'Unhashable'),
+        ]
+        for data, limits, message in cases:
+            with self.assertRaisesRegex(ValueError, message):
+                unpackb_limited(data, **limits)
+
+    def test_depth_beyond_recursion_limit(self):
+        value = unpackb_limited(b'\x91' * 5000 + b'\xc0', max_depth=None)
+        for _ in range(5000):
+            value, = value
+        self.assertIsNone(value)
+
+class UnpackerLimitsTest(unittest.TestCase):
+    def test_chunked_feeds(self):
+        objs = [plain_tree(DEPTH - 10), 1, 'x' * 300, {'a': [1, 2, {'b': b'z' * 70000}]}, [], Timestamp(5)]
+        stream = b''.join(packb(obj) for obj in objs)
+        for chunk_size in (1, 7, 4096, len(stream)):
+            unpacker = Unpacker(limits={'max_depth': DEPTH, 'zero_copy': False})
+            received = []
+            for start in range(0, len(stream), chunk_size):
+                unpacker.feed(stream[start:start + chunk_size])
+                received += unpacker
+            self.assertEqual(received, objs)
+            self.assertEqual(unpacker.buffered(), 0)
+
+    def test_bad_objects_are_dropped(self):
+        unpacker = Unpacker(limits={})
+        unpacker.feed(b'\xc1' + packb(1) + b'\x92\x01\xc1' + packb(2))
+        with self.assertRaisesRegex(ValueError, 'Unknown format'):
+            next(unpacker)
+        self.assertEqual(next(unpacker), 1)
+        with self.assertRaisesRegex(ValueError, 'Unknown format'):
+            next(unpacker)
+        self.assertEqual(list(unpacker), [2])
+        unpacker = Unpacker(limits={'max_str_len': 4})
+        unpacker.feed(packb(['a', 'too long', [1, 2]]) + packb('ok'))
+        with self.assertRaisesRegex(ValueError, 'length limit'):
+            next(unpacker)
+        self.assertEqual(list(unpacker), ['ok'])
+
+    def test_headers_are_checked_before_buffering(self):
+        unpacker = Unpacker(max_buffer_size=64, limits={'max_str_len': 16})
+        unpacker.feed(b'\xdb\xff\xff\xff\xff')
+        with self.assertRaisesRegex(ValueError, 'length limit'):
+            next(unpacker)
+        self.assertEqual(unpacker.buffered(), 0)
+        for _ in range(100):
+            unpacker.feed(bytes(64))
+            self.assertEqual(list(unpacker), [])
+        self.assertEqual(unpacker.buffered(), 0)
+        unpacker = Unpacker(max_buffer_size=64, limits={'max_bin_len': 16})
+        stream = packb(bytes(1000)) + packb('next')
+        received = []
+        for start in range(0, len(stream), 10):
+            unpacker.feed(stream[start:start + 10])
+            try:
+                received += unpacker
+            except ValueError as e:
+                received.append(str(e))
+        self.assertEqual(received, ['Payload exceeds its length limit', 'next'])
+
+    def test_rest_of_a_dropped_object_is_discarded(self):
+        cases = [
+            (packb([[1, [2, [3]]], 'x' * 100]), {'max_depth': 2}, 'max_depth'),
+            (packb([1, 2, 3, bytes(1000)]), {'max_elements': 3}, 'max_elements'),
+            (b'\xdd\x00\x00\x00\x05' + packb('y' * 1000) * 5, {'max_elements': 3}, 'max_elements'),
+            (packb([1, 2, 3, bytes(1000)]), {'max_bytes': 100}, 'max_bytes'),
+            (packb({'a': [ExtFormat(1, bytes(500))]}), {'max_ext_len': 100}, 'length limit'),
+        ]
+        for data, limits, message in cases:
+            for chunk_size in (1, 64, 199):
+                unpacker = Unpacker(max_buffer_size=200, limits=limits)
+                stream = data + packb(7)
+                errors = []
+                received = []
+                for start in range(0, len(stream), chunk_size):
+                    unpacker.feed(stream[start:start + chunk_size])
+                    while True:
+                        try:
+                            received += unpacker
+                            break
+                        except ValueError as e:
+                            errors.append(str(e))
+                self.assertEqual(len(errors), 1)
+                self.assertRegex(errors[0], message)
+                self.assertEqual(received, [7])
+                self.assertEqual(unpacker.buffered(), 0)
+
+    def test_invalid_limits(self):
+        with self.assertRaisesRegex(ValueError, 'zero_copy'):
+            Unpacker(limits={'zero_copy': True})
+        with self.assertRaises(TypeError):
+            Unpacker(limits={'max_strlen': 10})
+        unpacker = Unpacker(limits={'max_depth': None, 'intern_strings': True})
+        unpacker.feed(packb([[[['deep']]]]))
+        self.assertEqual(list(unpacker), [[[[['deep']]]]])
+
+class SkipTest(unittest.TestCase):
+    def test_skip_and_split(self):
+        objs = [plain_tree(DEPTH - 3), {'a': [1.5] * 40}, 'x' * 300, b'y' * 70000, list(range(100)), None]
+        stream = b''.join(packb(obj) for obj in objs)
+        self.assertEqual([unpackb(part) for part in split(stream)], objs)
+        self.assertEqual(skip(stream, 0, len(objs)), len(stream))
+        self.assertEqual(skip(packb(list(range(100))), 3, 50), 53)
+
+    def test_truncated(self):
+        for data in (b'', b'\x92\x01', b'\xd9', b'\xdc\x00', packb('abcdef')[:-1], packb([1] * 40)[:-1]):
+            with self.assertRaisesRegex(ValueError, 'Truncated object'):
+                skip(data)
+
+class ExtractTest(unittest.TestCase):
+    def setUp(self):
+        self.msg = {
+            'id': 7, 'sensors': [{'temp': float(i), 'name': 's%d' % i, 'raw': list(range(40))} for i in range(10)],
+            'meta': {1: 'one', -3: 'neg'},
+        }
+        self.data = packb(self.msg)
+
+    def test_paths(self):
+        data = self.data
+        self.assertEqual(extract(data, ['sensors', 3, 'temp']), 3.0)
+        self.assertEqual(extract(data, ['sensors', -1, 'name']), 's9')
+        self.assertEqual(extract(data, ['sensors', 2, 'raw', 39]), 39)
+        self.assertEqual(extract(data, ['meta', -3]), 'neg')
+        self.assertEqual(extract(data, ['meta', 1]), 'one')
+        self.assertEqual(extract(data, []), self.msg)
+        self.assertIsNone(extract(data, ['nope'], None))
+        self.assertIsNone(extract(data, ['sensors', 10], None))
+
+    def test_missing(self):
+        for path in (['nope'], ['sensors', 10], ['sensors', 'x']):
+            with self.assertRaises((KeyError, IndexError)):
+                extract(self.data, path)
+        with self.assertRaisesRegex(ValueError, 'scalar'):
+            extract(self.data, ['id', 'x'])
+        with self.assertRaises(TypeError):
+            PathQuery([1.5])
+
+    def test_truncated(self):
+        for data, path in ((b'', ['a']), (b'', []), (b'\x92\x01', [1]), (b'\xde\x00', ['a']), (b'\x81\xa1', ['a']),
+                           (b'\x81\x01', [1]), (self.data[:-1], ['meta', -3])):
+            with self.assertRaisesRegex(ValueError, 'Truncated object'):
+                extract(data, path, None)
+
+    def test_extract_many(self):
+        query = PathQuery(('sensors', 3, 'temp'))
+        self.assertEqual(list(query.extract_many([self.data] * 5)), [3.0] * 5)
+
+class KeyCacheTest(unittest.TestCase):
+    def setUp(self):
+        set_key_cache_size(4)
+        self.addCleanup(set_key_cache_size, codec._KEY_CACHE_SIZE)
+
+    def test_cache_info(self):
+        self.assertEqual(key_cache_info(), {'size': 0, 'maxsize': 4, 'hits': 0, 'misses': 0, 'hit_rate': 0.0})
+        messages = [{'id': i, 'temp': 1.5, 1: 'int keys are not cached'} for i in range(10)]
+        self.assertEqual(unpackb(packb(messages)), messages)
+        info = key_cache_info()
+        self.assertEqual((info['size'], info['hits'], info['misses']), (2, 18, 2))
+        self.assertEqual(info['hit_rate'], 0.9)
+
+    def test_bounded_size(self):
+        keys = ['k%d' % i for i in range(10)]
+        self.assertEqual(unpackb(packb(dict.fromkeys(keys, 0))), dict.fromkeys(keys, 0))
+        self.assertEqual(key_cache_info()['size'], 4)
+        set_key_cache_size(8)
+        self.assertEqual(key_cache_info()['size'], 0)
+        self.assertEqual(key_cache_info()['maxsize'], 8)
+
+    def test_long_keys_are_encoded_inline(self):
+        long_key = 'x' * (codec._KEY_CACHE_MAX_LENGTH + 1)
+        message = {long_key: 1, 'é' * 40: 2, 'y' * 300: 3}
+        for _ in range(3):
+            self.assertEqual(unpackb(packb(message)), message)
+            self.assertEqual(unpackb(Map16Format({Str8Format(long_key): FixIntFormat(1)}).to_bytes()), {long_key: 1})
+        self.assertEqual(key_cache_info()['size'], 0)
+        self.assertEqual(key_cache_info()['misses'], 0)
+
+class ZeroCopyTest(unittest.TestCase):
+    def test_large_payloads_are_views(self):
+        data = bytearray(packb({'big': bytes(range(256)) * 2, 'small': b'abc', 'ext': ExtFormat(3, bytes(300))}))
+        decoded = unpackb(data, zero_copy=True)
+        self.assertIsInstance(decoded['big'], memoryview)
+        self.assertIsInstance(decoded['small'], bytes)
+        self.assertIsInstance(decoded['ext'].data, memoryview)
+        self.assertEqual(bytes(decoded['big']), bytes(range(256)) * 2)
+        data[data.index(bytes(range(256)))] = 0xff
+        self.assertEqual(decoded['big'][0], 0xff)
+        self.assertIsInstance(unpackb(data)['big'], bytes)
+
+    def test_same_values_as_copying_decode(self):
+        tree = plain_tree(DEPTH - 5)
+        encoded = packb(tree)
+        self.assertEqual(unpackb(encoded, zero_copy=True), tree)
+        self.assertEqual(unpackb(encoded, zero_copy=True, intern_strings=True), tree)
+
+    def test_intern_strings(self):
+        first = unpackb(packb(['sensor-a', 'sensor-a', 'x' * 100, 'x' * 100]), intern_strings=True)
+        second = unpackb(packb(['sensor-a']), intern_strings=True)
+        self.assertIs(first[0], first[1])
+        self.assertIs(first[0], second[0])
+        self.assertIsNot(first[2], first[3])
+
+class Point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+class ExtCodecTest(unittest.TestCase):
+    def test_timestamp(self):
+        self.assertEqual(packb(Timestamp(1)), b'\xd6\xff\x00\x00\x00\x01')
+        self.assertEqual(len(packb(Timestamp(1, 5))), 10)
+        self.assertEqual(len(packb(Timestamp(2 ** 34))), 15)
+        for value in (Timestamp(0), Timestamp(2 ** 32 - 1), Timestamp(2 ** 34 - 1, 999999999), Timestamp(-1, 5)):
+            self.assertEqual(unpackb(packb(value)), value)
+            self.assertEqual(unpackb(packb([value, {'t': value}])), [value, {'t': value}])
+        with self.assertRaises(ValueError):
+            Timestamp(0, 1000000000)
+        with self.assertRaises(ValueError):
+            unpackb(b'\xd5\xff\x00\x00')
+
+    def test_timestamp_conversions(self):
+        self.assertEqual(Timestamp.from_unix(0.9999999999), Timestamp(1, 0))
+        self.assertEqual(Timestamp.from_unix(-0.0000000001), Timestamp(0, 0))
+        self.assertEqual(Timestamp.from_unix(-1.25), Timestamp(-2, 750000000))
+        self.assertEqual(Timestamp(-2, 750000000).to_unix(), -1.25)
+        self.assertEqual(Timestamp.from_unix_nano(-1), Timestamp(-1, 999999999))
+        self.assertEqual(Timestamp(5, 1).to_unix_nano(), 5000000001)
+
+    def test_arrays(self):
+        vector = array.array('f', [1.0, 2.0])
+        self.assertEqual(packb(vector), b'\xd7\x11' + struct.pack('<2f', 1.0, 2.0))
+        for values in (vector, array.array('f', [0.5] * 7), array.array('h', [1, -2]), array.array('d', range(100))):
+            decoded = unpackb(packb({'v': values}))['v']
+            self.assertIsInstance(decoded, array.array)
+            self.assertEqual(decoded, values)
+
+    def test_registered_type(self):
+        register_ext_type(5, Point, lambda point: bytes([point.x, point.y]), lambda payload: Point(*payload))
+        self.addCleanup(codec._EXT_ENCODERS.pop, Point)
+        self.addCleanup(codec._EXT_DECODERS.pop, 5)
+        encoded = packb({'p': Point(1, 2)})
+        self.assertEqual(encoded, b'\x81\xa1p\xd5\x05\x01\x02')
+        decoded = unpackb(encoded)['p']
+        self.assertIsInstance(decoded, Point)
+        self.assertEqual((decoded.x, decoded.y), (1, 2))
+        with self.assertRaisesRegex(ValueError, 'Ext type out of range'):
+            register_ext_type(128, Point, bytes, bytes)
+
+    def test_unknown_types_round_trip(self):
+        for value in (ExtFormat(9, b'abc'), ExtFormat(-128, b'\x01'), ExtFormat(100, bytes(300))):
+            decoded = unpackb(packb([value]))[0]
+            self.assertIsInstance(decoded, ExtFormat)
+            self.assertEqual((decoded.type, bytes(decoded.data)), (value.type, value.data))
+            self.assertEqual(packb(decoded), packb(value))
+
+class PackedSizeTest(unittest.TestCase):
+    def test_matches_packb(self):
+        values = [
+            None, True, 0, -32, -33, 255, 65536, 2 ** 64 - 1, -2 ** 63, 0.25, '', 'x' * 31, 'x' * 32, 'é' * 200,
+            b'', bytes(256), memoryview(array.array('i', range(10))), [], list(range(16)), {'a': 1},
+            {i: i for i in range(16)}, Timestamp(1), Timestamp(2 ** 40, 1), array.array('f', [1, 2]),
+            array.array('h', range(200)), ArrayView(packb([1, 'a'])), MapView(packb({'a': [1]})),
+            {'k' * 40: 'long keys are not cached', 'k': 1}, plain_tree(DEPTH - 10),
+        ]
+        for value in values:
+            encoded = packb(value)
+            self.assertEqual(packed_size(value), len(encoded))
+            buffer = bytearray(len(encoded) + 5)
+            self.assertEqual(pack_into(value, buffer, 2), 2 + len(encoded))
+            self.assertEqual(bytes(buffer[2:-3]), encoded)
+
+    def test_format_trees(self):
+        tree = typed_tree(DEPTH - 10)
+        encoded = tree.to_bytes()
+        self.assertEqual(tree.packed_size(), len(encoded))
+        self.assertEqual(packed_size(tree), len(encoded))
+        buffer = bytearray(len(encoded))
+        self.assertEqual(pack_into(tree, memoryview(buffer)), len(encoded))
+        self.assertEqual(buffer, encoded)
+
+    def test_buffer_too_small(self):
+        buffer = bytearray(4)
+        with self.assertRaisesRegex(ValueError, 'Buffer too small'):
+            pack_into('abcd', buffer)
+        self.assertEqual(buffer, bytearray(4))
+        with self.assertRaisesRegex(ValueError, 'Buffer too small'):
+            pack_into(1, bytearray(8), 8)
+        with self.assertRaises(TypeError):
+            packed_size(object())
+
+if __name__ == '__main__':
+    unittest.main()
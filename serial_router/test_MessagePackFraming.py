@@ -0,0 +1,163 @@
+import os
+import socket
+import threading
+import unittest
+
+from MessagePackFormat import Float64Format, packb, skip_partial, unpackb
+from MessagePackFraming import LENGTH_PREFIXED, SELF_DELIMITING, FrameReader, FrameWriter, split_frames
+
+FRAMINGS = (LENGTH_PREFIXED, SELF_DELIMITING)
+OBJS = [{'seq': i, 'temp': i / 4, 'raw': list(range(i % 50)), 'blob': bytes(i % 700)} for i in range(300)]
+
+# A socket-like target accepting at most max_send bytes per sendmsg() call.
+class SlowTarget:
+    def __init__(self, max_send):
+        self.max_send = max_send
+        self.data = bytearray()
+        self.batch_sizes = []
+
+    def sendmsg(self, buffers):
+        self.batch_sizes.append(len(buffers))
+        sent = 0
+        for buffer in buffers:
+            chunk = bytes(buffer)[:self.max_send - sent]
+            self.data += chunk
+            sent += len(chunk)
+            if sent == self.max_send:
+                break
+        return sent
+
+# A socket-like source handing out at most read_size bytes per recv_into().
+class ChunkedSource:
+    def __init__(self, data, read_size):
+        self.data = memoryview(data)
+        self.read_size = read_size
+
+    def recv_into(self, buffer):
+        count = min(len(buffer), self.read_size, len(self.data))
+        buffer[:count] = self.data[:count]
+        self.data = self.data[count:]
+        return count
+
+def frames_of(reader):
+    return [unpackb(frame) for frame in reader]
+
+class SplitFramesTest(unittest.TestCase):
+    def test_partial_tail(self):
+        for framing in FRAMINGS:
+            writer = SlowTarget(1 << 30)
+            frame_writer = FrameWriter(writer, framing)
+            for obj in OBJS[:10]:
+                frame_writer.write(obj)
+            frame_writer.flush()
+            data = bytes(writer.data)
+            frames, offset = split_frames(data[:-3], framing)
+            self.assertEqual([unpackb(frame) for frame in frames], OBJS[:9])
+            frames, end = split_frames(data, framing, offset)
+            self.assertEqual([unpackb(frame) for frame in frames], OBJS[9:10])
+            self.assertEqual(end, len(data))
+
+    def test_frame_too_large(self):
+        with self.assertRaisesRegex(ValueError, 'Frame too large'):
+            split_frames(b'\x00\x00\x01\x00', LENGTH_PREFIXED, max_frame_size=255)
+        with self.assertRaisesRegex(ValueError, 'Frame too large'):
+            split_frames(packb(bytes(300))[:-1], SELF_DELIMITING, max_frame_size=255)
+        with self.assertRaises(ValueError):
+            split_frames(b'', 'newline')
+
+    def test_skip_partial_resumes(self):
+        data = packb(OBJS)
+        offset, remaining = 0, 1
+        for end in range(1, len(data) + 1, 97):
+            offset, remaining = skip_partial(data[:end], offset, remaining)
+            self.assertGreater(remaining, 0)
+        self.assertEqual(skip_partial(data, offset, remaining), (len(data), 0))
+
+class WriterTest(unittest.TestCase):
+    def test_partial_writes(self):
+        for framing in FRAMINGS:
+            target = SlowTarget(1000)
+            writer = FrameWriter(target, framing, max_pending=1 << 30)
+            for obj in OBJS:
+                writer.write(obj)
+            writer.write(Float64Format(2.5))
+            writer.flush()
+            self.assertEqual(writer._pending, 0)
+            self.assertEqual(frames_of(FrameReader(ChunkedSource(target.data, 1 << 20), framing)), OBJS + [2.5])
+
+    def test_iov_max_batching(self):
+        target = SlowTarget(1 << 30)
+        writer = FrameWriter(target, LENGTH_PREFIXED, max_pending=1 << 30)
+        writer._iov_max = 16
+        for obj in OBJS[:20]:
+            writer.write(obj)
+        writer.flush()
+        self.assertEqual(target.batch_sizes, [16, 16, 8])
+        self.assertEqual(frames_of(FrameReader(ChunkedSource(target.data, 1 << 20))), OBJS[:20])
+
+class ReaderTest(unittest.TestCase):
+    def test_small_reads(self):
+        for framing in FRAMINGS:
+            target = SlowTarget(1 << 30)
+            writer = FrameWriter(target, framing)
+            for obj in OBJS:
+                writer.write(obj)
+            writer.flush()
+            for read_size in (1, 7, 4096):
+                reader = FrameReader(ChunkedSource(target.data, read_size), framing, buffer_size=64)
+                self.assertEqual(frames_of(reader), OBJS)
+
+    def test_large_frame_in_many_reads(self):
+        big = packb([OBJS] * 20)
+        reader = FrameReader(ChunkedSource(big + packb(1), 4096), SELF_DELIMITING, buffer_size=4096)
+        self.assertEqual(frames_of(reader), [[OBJS] * 20, 1])
+
+    def test_truncated_stream(self):
+        for framing, data in ((LENGTH_PREFIXED, b'\x00\x00\x00\x05\x92'), (SELF_DELIMITING, b'\x92\x01')):
+            reader = FrameReader(ChunkedSource(data, 1), framing)
+            with self.assertRaisesRegex(ValueError, 'Truncated frame'):
+                frames_of(reader)
+
+    def test_oversized_length_prefix(self):
+        reader = FrameReader(ChunkedSource(b'\xdb\xff\xff\xff\xff' + bytes(10), 4), LENGTH_PREFIXED,
+                             buffer_size=16, max_frame_size=1024)
+        for _ in range(3):
+            with self.assertRaisesRegex(ValueError, 'Frame too large'):
+                reader.read_frames()
+        self.assertEqual(len(reader._buffer), 16)
+
+    def test_oversized_delimited_frame(self):
+        reader = FrameReader(ChunkedSource(packb(bytes(5000)), 256), SELF_DELIMITING, buffer_size=256,
+                             max_frame_size=1024)
+        with self.assertRaisesRegex(ValueError, 'Frame too large'):
+            frames_of(reader)
+
+class TransportTest(unittest.TestCase):
+    def transfer(self, writer_target, reader_source, framing, close_writer):
+        received = []
+        reader = FrameReader(reader_source, framing, buffer_size=1024)
+        thread = threading.Thread(target=lambda: received.extend(bytes(frame) for frame in reader))
+        thread.start()
+        writer = FrameWriter(writer_target, framing, max_pending=8192)
+        for obj in OBJS:
+            writer.write(obj)
+        writer.flush()
+        close_writer()
+        thread.join()
+        self.assertEqual([unpackb(frame) for frame in received], OBJS)
+
+    def test_socketpair(self):
+        for framing in FRAMINGS:
+            left, right = socket.socketpair()
+            self.addCleanup(right.close)
+            left.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            self.transfer(left, right, framing, left.close)
+
+    def test_pipe(self):
+        for framing in FRAMINGS:
+            read_fd, write_fd = os.pipe()
+            self.addCleanup(os.close, read_fd)
+            self.transfer(write_fd, read_fd, framing, lambda: os.close(write_fd))
+
+if __name__ == '__main__':
+    unittest.main()
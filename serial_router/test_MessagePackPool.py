@@ -0,0 +1,64 @@
+import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import unittest
+
+from MessagePackFormat import packb
+from MessagePackPool import _MIN_PARALLEL_ITEMS, _SHARED_MEMORY_MIN_SIZE, pack_many, unpack_many
+
+SMALL = [{'seq': i, 'temp': i / 4, 'name': 'probe-%d' % (i % 7), 'raw': list(range(i % 20))}
+         for i in range(_MIN_PARALLEL_ITEMS * 2)]
+LARGE = [{'seq': i, 'blob': bytes([i % 256]) * 4096} for i in range(_SHARED_MEMORY_MIN_SIZE // 4096 + 16)]
+
+class InlineTest(unittest.TestCase):
+    def test_single_worker(self):
+        frames = pack_many(SMALL, workers=1)
+        self.assertEqual(frames, [packb(obj) for obj in SMALL])
+        self.assertEqual(unpack_many(frames, workers=1), SMALL)
+
+    def test_small_batch(self):
+        objs = SMALL[:_MIN_PARALLEL_ITEMS - 1]
+        self.assertEqual(unpack_many(pack_many(iter(objs), workers=4), workers=4), objs)
+        self.assertEqual(pack_many([]), [])
+        self.assertEqual(unpack_many([]), [])
+
+class ExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_inline_buffers(self):
+        frames = pack_many(SMALL, executor=self.executor, chunk_size=50)
+        self.assertEqual(frames, [packb(obj) for obj in SMALL])
+        frames = [bytearray(frame) if i % 2 else memoryview(frame) for i, frame in enumerate(frames)]
+        self.assertEqual(unpack_many(frames, executor=self.executor, chunk_size=50), SMALL)
+
+    def test_shared_memory(self):
+        frames = pack_many(LARGE, executor=self.executor)
+        self.assertGreaterEqual(sum(map(len, frames)), _SHARED_MEMORY_MIN_SIZE)
+        self.assertEqual(unpack_many(frames, executor=self.executor), LARGE)
+
+    def test_numeric_arrays(self):
+        frames = [packb([1.5] * 20)] * 4
+        decoded = unpack_many(frames, executor=self.executor, numeric_arrays='array')
+        self.assertEqual(decoded, [array.array('d', [1.5] * 20)] * 4)
+
+    def test_errors_propagate(self):
+        frames = pack_many(SMALL[:10]) + [b'\xc1']
+        with self.assertRaisesRegex(ValueError, 'Unknown format'):
+            unpack_many(frames, executor=self.executor)
+        with self.assertRaises(TypeError):
+            pack_many([object()], executor=self.executor)
+
+class ProcessPoolTest(unittest.TestCase):
+    def test_default_pool(self):
+        frames = pack_many(SMALL, workers=2)
+        self.assertEqual(frames, [packb(obj) for obj in SMALL])
+        self.assertEqual(unpack_many(frames, workers=2), SMALL)
+
+    def test_shared_memory(self):
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            frames = pack_many(LARGE, executor=executor)
+            self.assertEqual(unpack_many(frames, executor=executor), LARGE)
+
+if __name__ == '__main__':
+    unittest.main()
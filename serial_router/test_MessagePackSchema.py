@@ -0,0 +1,88 @@
+import unittest
+
+from MessagePackFormat import (
+    BoolFormat, UInt8Format, UInt16Format, UInt32Format, UInt64Format, Int8Format, Int64Format,
+    Float32Format, Float64Format, Str8Format, Bin16Format, NilFormat, packb, unpackb,
+)
+from MessagePackSchema import MessageSchema
+
+FIXED = MessageSchema([
+    ('id', UInt32Format), ('seq', UInt64Format), ('delta', Int8Format), ('offset', Int64Format),
+    ('temp', Float64Format), ('gain', Float32Format), ('flags', UInt8Format),
+])
+FIXED_MESSAGE = {'id': 7, 'seq': 2 ** 40, 'delta': -3, 'offset': -2 ** 63, 'temp': 21.5, 'gain': 0.5, 'flags': 0}
+
+SEGMENTED = MessageSchema([
+    ('id', UInt16Format), ('ok', BoolFormat), ('name', Str8Format), ('temp', Float64Format),
+    ('blob', Bin16Format), ('valid', BoolFormat),
+])
+SEGMENTED_MESSAGE = {'id': 300, 'ok': True, 'name': 'probé', 'temp': -1.25, 'blob': bytes(300), 'valid': False}
+
+class FixedLayoutTest(unittest.TestCase):
+    def test_round_trip(self):
+        data = FIXED.pack(FIXED_MESSAGE)
+        self.assertEqual(len(data), FIXED.size)
+        self.assertEqual(FIXED.unpack(data), FIXED_MESSAGE)
+        self.assertEqual(unpackb(data), FIXED_MESSAGE)
+        self.assertEqual(data, FIXED.to_format(FIXED_MESSAGE).to_bytes())
+        self.assertEqual(list(unpackb(data)), list(FIXED.names))
+
+    def test_unpackb_fallback(self):
+        # packb() picks the smallest int formats and a float64 for 'gain'.
+        data = packb(FIXED_MESSAGE)
+        self.assertNotEqual(len(data), FIXED.size)
+        self.assertEqual(FIXED.unpack(data), FIXED_MESSAGE)
+        reordered = dict(reversed(list(FIXED_MESSAGE.items())))
+        self.assertEqual(FIXED.unpack(packb(reordered)), FIXED_MESSAGE)
+
+class SegmentedLayoutTest(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertIsNone(SEGMENTED.size)
+        data = SEGMENTED.pack(SEGMENTED_MESSAGE)
+        self.assertEqual(SEGMENTED.unpack(data), SEGMENTED_MESSAGE)
+        self.assertEqual(unpackb(data), SEGMENTED_MESSAGE)
+        self.assertEqual(data, SEGMENTED.to_format(SEGMENTED_MESSAGE).to_bytes())
+        empty = dict(SEGMENTED_MESSAGE, name='', blob=b'')
+        self.assertEqual(SEGMENTED.unpack(SEGMENTED.pack(empty)), empty)
+
+    def test_unpackb_fallback(self):
+        self.assertEqual(SEGMENTED.unpack(packb(SEGMENTED_MESSAGE)), SEGMENTED_MESSAGE)
+        single = MessageSchema([('ok', BoolFormat)])
+        self.assertEqual(single.unpack(single.pack({'ok': True})), {'ok': True})
+        self.assertEqual(single.unpack(packb({'ok': False})), {'ok': False})
+
+class ValidationTest(unittest.TestCase):
+    def test_schema_definition(self):
+        for fields in ([], [('a', UInt8Format), ('a', UInt8Format)], [('a', NilFormat)]):
+            with self.assertRaises(ValueError):
+                MessageSchema(fields)
+
+    def test_pack_rejects_values_outside_the_field(self):
+        for schema, message, name in (
+            (FIXED, dict(FIXED_MESSAGE, flags=True), 'flags'),
+            (FIXED, dict(FIXED_MESSAGE, flags=256), 'flags'),
+            (FIXED, dict(FIXED_MESSAGE, id=1.0), 'id'),
+            (FIXED, dict(FIXED_MESSAGE, gain=1e39), 'gain'),
+            (SEGMENTED, dict(SEGMENTED_MESSAGE, ok=1), 'ok'),
+            (SEGMENTED, dict(SEGMENTED_MESSAGE, name=b'probe'), 'name'),
+            (SEGMENTED, dict(SEGMENTED_MESSAGE, name='é' * 128), 'name'),
+            (SEGMENTED, dict(SEGMENTED_MESSAGE, blob='x'), 'blob'),
+        ):
+            with self.assertRaisesRegex(ValueError, "Field '%s' does not match schema" % name):
+                schema.pack(message)
+        with self.assertRaises(KeyError):
+            FIXED.pack({'id': 7})
+
+    def test_unpack_rejects_other_messages(self):
+        for data in (packb({'id': 7}), packb([1, 2]), packb(dict(FIXED_MESSAGE, extra=1))):
+            with self.assertRaisesRegex(ValueError, 'Message does not match schema'):
+                FIXED.unpack(data)
+        for message, name in ((dict(FIXED_MESSAGE, flags=True), 'flags'), (dict(FIXED_MESSAGE, delta=200), 'delta'),
+                              (dict(FIXED_MESSAGE, temp=1), 'temp')):
+            with self.assertRaisesRegex(ValueError, "Field '%s' does not match schema" % name):
+                FIXED.unpack(packb(message))
+        with self.assertRaisesRegex(ValueError, "Field 'name' does not match schema"):
+            SEGMENTED.unpack(packb(dict(SEGMENTED_MESSAGE, name=b'raw')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+
+import MessagePackFormat as codec
+from MessagePackFormat import (
+    FixStrFormat, UInt8Format, UInt16Format, Array16Format, Map16Format, Unpacker,
+    packb, unpackb, unpackb_limited, pack_into,
+)
+from MessagePackStats import disable_stats, enable_stats, get_stats
+
+MESSAGE = {'id': 300, 'tags': ['a', 'b'], 'pos': [1.5, 2.5]}
+# Lead byte counts and container depths of one MESSAGE.
+MESSAGE_TYPES = {'FixStrFormat': 5, 'FixArrayFormat': 2, 'Float64Format': 2, 'FixMapFormat': 1, 'UInt16Format': 1}
+MESSAGE_DEPTHS = {0: 1, 1: 2}
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.timings = []
+        self.stats = enable_stats(lambda direction, lead_byte, size, seconds: self.timings.append(
+            (direction, lead_byte, size)))
+        self.addCleanup(disable_stats)
+
+    def assert_encoded(self, messages, size):
+        summary = self.stats.summary()
+        self.assertEqual(summary['encoded'], {name: count * messages for name, count in MESSAGE_TYPES.items()})
+        self.assertEqual(summary['encode_depths'], {depth: count * messages for depth, count in MESSAGE_DEPTHS.items()})
+        self.assertEqual(summary['bytes_encoded'], size * messages)
+        self.assertEqual(self.timings, [('encode', 0x83, size)] * messages)
+
+    def assert_decoded(self, messages, size):
+        summary = self.stats.summary()
+        self.assertEqual(summary['decoded'], {name: count * messages for name, count in MESSAGE_TYPES.items()})
+        self.assertEqual(summary['decode_depths'], {depth: count * messages for depth, count in MESSAGE_DEPTHS.items()})
+        self.assertEqual(summary['bytes_decoded'], size * messages)
+        self.assertEqual(self.timings, [('decode', 0x83, size)] * messages)
+
+    def test_packb(self):
+        for _ in range(3):
+            data = packb(MESSAGE)
+        self.assert_encoded(3, len(data))
+
+    def test_pack_into(self):
+        buffer = bytearray(100)
+        for _ in range(3):
+            size = pack_into(MESSAGE, buffer, 10)
+        self.assert_encoded(3, size - 10)
+        self.assertEqual(bytes(buffer[10:size]), packb(MESSAGE))
+
+    def test_to_bytes(self):
+        message = Map16Format({FixStrFormat('a'): Array16Format([UInt8Format(1), UInt16Format(2)])})
+        for _ in range(2):
+            data = message.to_bytes()
+        summary = self.stats.summary()
+        self.assertEqual(summary['encoded'], {'FixStrFormat': 2, 'Map16Format': 2, 'Array16Format': 2,
+                                              'UInt8Format': 2, 'UInt16Format': 2})
+        self.assertEqual(summary['encode_depths'], {0: 2, 1: 2})
+        self.assertEqual(summary['bytes_encoded'], 2 * len(data))
+        self.assertEqual(self.timings, [('encode', 0xde, len(data))] * 2)
+        self.stats.reset()
+        self.timings.clear()
+        pack_into(message, bytearray(len(data)))
+        self.assertEqual(self.stats.bytes_encoded, len(data))
+        self.assertEqual(self.timings, [('encode', 0xde, len(data))])
+
+    def test_unpackb(self):
+        data = packb(MESSAGE)
+        self.timings.clear()
+        self.stats.reset()
+        for _ in range(2):
+            self.assertEqual(unpackb(data), MESSAGE)
+        self.assert_decoded(2, len(data))
+
+    def test_unpackb_limited(self):
+        data = packb(MESSAGE)
+        self.timings.clear()
+        self.stats.reset()
+        for _ in range(2):
+            self.assertEqual(unpackb_limited(data, max_depth=4), MESSAGE)
+        self.assert_decoded(2, len(data))
+
+    def test_unpacker(self):
+        data = packb(MESSAGE)
+        self.timings.clear()
+        self.stats.reset()
+        for limits in (None, {'max_depth': 4}):
+            unpacker = Unpacker(limits=limits)
+            unpacker.feed(data * 2)
+            self.assertEqual(list(unpacker), [MESSAGE] * 2)
+        self.assert_decoded(4, len(data))
+
+    def test_bulk_runs_are_counted_per_element(self):
+        data = packb([1.5] * 100)
+        self.stats.reset()
+        self.assertEqual(unpackb(data), [1.5] * 100)
+        self.assertEqual(self.stats.summary()['decoded'], {'Float64Format': 100, 'Array16Format': 1})
+
+    def test_disable_restores_the_codec(self):
+        self.assertIs(get_stats(), self.stats)
+        self.assertIs(disable_stats(), self.stats)
+        self.assertIsNone(get_stats())
+        self.assertEqual(codec._BULK_MIN_RUN, 16)
+        self.assertEqual(codec._fill.__name__, '_fill')
+        self.assertEqual(codec.packed_size.__name__, 'packed_size')
+        self.assertEqual(codec.Packer.pack.__name__, 'pack')
+        self.assertIsInstance(vars(FixStrFormat)['from_buffer'], staticmethod)
+        packb(MESSAGE)
+        self.assertEqual(self.stats.bytes_encoded, 0)
+
+if __name__ == '__main__':
+    unittest.main()
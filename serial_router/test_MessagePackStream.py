@@ -0,0 +1,98 @@
+import asyncio
+import unittest
+
+from MessagePackFormat import packb
+from MessagePackStream import MessagePackReader, open_connection, start_server
+
+class LoopbackTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.received = []
+        self.server_done = asyncio.Event()
+        self.server = await start_server(self.echo, '127.0.0.1', 0)
+        self.addAsyncCleanup(self.server.wait_closed)
+        self.addCleanup(self.server.close)
+        port = self.server.sockets[0].getsockname()[1]
+        self.reader, self.writer = await open_connection('127.0.0.1', port)
+        self.addAsyncCleanup(self.close_client)
+
+    async def close_client(self):
+        if not self.writer._writer.is_closing():
+            await self.writer.close()
+        await self.server_done.wait()
+
+    # Echoes every object back and records it, hanging up on None.
+    async def echo(self, reader, writer):
+        async for obj in reader:
+            if obj is None:
+                break
+            self.received.append(obj)
+            await writer.send(obj)
+        await writer.close()
+        self.server_done.set()
+
+    async def test_round_trip(self):
+        objs = [{'seq': i, 'data': bytes(i % 300), 'tags': ['a'] * (i % 5)} for i in range(200)]
+        for obj in objs:
+            await self.writer.send(obj)
+            self.assertEqual(await self.reader.read(), obj)
+        await self.writer.close()
+        with self.assertRaises(EOFError):
+            await self.reader.read()
+        await self.server_done.wait()
+        self.assertEqual(self.received, objs)
+
+    async def test_writes_are_coalesced(self):
+        transport_writes = []
+        stream_writer = self.writer._writer
+        write = stream_writer.write
+        stream_writer.write = lambda data: (transport_writes.append(len(data)), write(data))
+        objs = list(range(1000))
+        for obj in objs:
+            self.writer.write(obj)
+        self.assertEqual(transport_writes, [])
+        await self.writer.drain()
+        self.assertEqual(transport_writes, [len(b''.join(packb(obj) for obj in objs))])
+        self.writer.flush_size = 100
+        self.writer.write(bytes(200))
+        self.assertEqual(len(transport_writes), 2)
+        echoed = [await self.reader.read() for _ in range(len(objs) + 1)]
+        self.assertEqual(echoed, objs + [bytes(200)])
+
+    async def test_async_iteration_stops_at_end(self):
+        for obj in ('a', 'b', 'c', None):
+            self.writer.write(obj)
+        self.assertEqual([obj async for obj in self.reader], ['a', 'b', 'c'])
+        with self.assertRaises(EOFError):
+            await self.reader.read()
+
+    async def test_write_after_close(self):
+        self.writer.write(1)
+        await self.writer.close()
+        with self.assertRaises(ConnectionResetError):
+            self.writer.write(2)
+        with self.assertRaises(ConnectionResetError):
+            await self.writer.send(2)
+        await self.server_done.wait()
+        self.assertEqual(self.received, [1])
+
+class TruncatedStreamTest(unittest.IsolatedAsyncioTestCase):
+    async def test_truncated_object(self):
+        stream = asyncio.StreamReader()
+        reader = MessagePackReader(stream, read_size=3)
+        stream.feed_data(packb([1, 2]) + packb('x' * 40)[:-1])
+        stream.feed_eof()
+        self.assertEqual(await reader.read(), [1, 2])
+        with self.assertRaisesRegex(ValueError, 'Truncated object'):
+            await reader.read()
+
+    async def test_limits(self):
+        stream = asyncio.StreamReader()
+        reader = MessagePackReader(stream, limits={'max_str_len': 4})
+        stream.feed_data(packb('too long') + packb('ok'))
+        stream.feed_eof()
+        with self.assertRaises(ValueError):
+            await reader.read()
+        self.assertEqual(await reader.read(), 'ok')
+
+if __name__ == '__main__':
+    unittest.main()